@@ -0,0 +1,101 @@
+from collections import Counter
+import random
+
+from approx_stats import (
+    ApproxStats,
+    CountMinSketch,
+    HeavyHitters,
+    HyperLogLog,
+    sketch_directory,
+)
+from generate_tracks import zipf_weights
+from sqlite_store import SqliteTracks, connect, ingest
+from stats import albums_by_playcount, unique_albums
+from track_store import TrackStore
+from util import load_tracks_data
+
+
+def zipf_stream(n: int, keys: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    weights = zipf_weights(keys, 1.1)
+    return [f"key {k}" for k in rng.choices(range(keys), cum_weights=weights, k=n)]
+
+
+def test_hyperloglog_counts_distinct_keys():
+    first, second = HyperLogLog(), HyperLogLog()
+    for i in range(20_000):
+        first.add(f"key {i}")
+        second.add(f"key {i + 10_000}")
+
+    assert abs(first.count() - 20_000) < 20_000 * 0.025
+
+    first.merge(second)
+    assert abs(first.count() - 30_000) < 30_000 * 0.025
+
+    small = HyperLogLog()
+    for i in range(100):
+        small.add(f"key {i}")
+    assert abs(small.count() - 100) <= 2
+
+
+def test_count_min_sketch_never_underestimates():
+    stream = zipf_stream(50_000, 5_000)
+    sketch = CountMinSketch(epsilon=0.001, delta=0.01)
+    halves = CountMinSketch(epsilon=0.001, delta=0.01)
+    for i, key in enumerate(stream):
+        (sketch if i % 2 else halves).add(key)
+    sketch.merge(halves)
+
+    for key, count in sorted(Counter(stream).items())[:500]:
+        assert count <= sketch.estimate(key) <= count + 0.001 * len(stream) * 2
+
+
+def test_heavy_hitters_keep_frequent_keys():
+    stream = zipf_stream(50_000, 5_000)
+    counts = Counter(stream)
+    first, second = HeavyHitters(capacity=100), HeavyHitters(capacity=100)
+    for i, key in enumerate(stream):
+        (first if i % 2 else second).add(key)
+    first.merge(second)
+
+    bound = len(stream) / 101
+    for key, count in counts.items():
+        if count > bound:
+            assert key in first.counters
+        if key in first.counters:
+            assert count - bound <= first.counters[key] <= count
+
+
+def test_approx_stats_of_a_store_and_of_files(tmp_path, write_page, tracks):
+    stats = ApproxStats()
+    stats.update(TrackStore.from_tracks(tracks))
+
+    assert stats.distinct_albums() == len(unique_albums(tracks))
+    assert [(c.mbid, c.playcount) for c in stats.top_albums(2)] == [
+        (album.mbid, playcount)
+        for album, playcount in albums_by_playcount(tracks)
+        if album.mbid and album.name
+    ][:2]
+
+    write_page(tmp_path, "tracks_0001.json", [100, 200])
+    write_page(tmp_path, "tracks_0002.json", [300])
+    sketched = sketch_directory(str(tmp_path), workers=1)
+    loaded = load_tracks_data(str(tmp_path), workers=1)
+
+    assert sketched.distinct_tracks() == 1
+    assert sketched.artist_counts.total == len(loaded)
+
+
+def test_approx_stats_of_sqlite_tracks_match_a_track_store(tmp_path, write_page):
+    write_page(tmp_path, "tracks_0001.json", [100, 200])
+    write_page(tmp_path, "tracks_0002.json", [300])
+    connection = connect(str(tmp_path / "rechord.db"))
+    ingest(connection, str(tmp_path))
+
+    on_sqlite, in_memory = ApproxStats(), ApproxStats()
+    on_sqlite.update(SqliteTracks(connection))
+    in_memory.update(TrackStore.from_tracks(load_tracks_data(str(tmp_path), workers=1)))
+
+    assert on_sqlite.album_counts.counts == in_memory.album_counts.counts
+    assert on_sqlite.top_artist_keys.counters == in_memory.top_artist_keys.counters
+    assert on_sqlite.distinct_tracks() == in_memory.distinct_tracks() == 1
@@ -0,0 +1,271 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from generate_tracks import generate
+from last_fm_model import RECENT_TRACKS_ADAPTER
+from snapshot import load_with_snapshot
+from stats import (
+    albums_by_playcount,
+    first_and_last_listen,
+    tracks_between,
+    tracks_in_album,
+    unique_albums,
+)
+from store import Store
+from util import load_track_store, load_tracks_data, tracks_files
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+
+def best_time(fn: Callable[[], Any], repeat: int) -> float:
+    """
+    Return the shortest of `repeat` run times of the function, in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def peak_memory(fn: Callable[[], Any]) -> int:
+    """
+    Return the peak number of bytes allocated while the function ran, including what it returns.
+    """
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+def dataset(data_dir: str, size: int, seed: int) -> str:
+    """
+    Return the directory of a generated dataset of the size, generating it first if needed.
+    """
+    dir = os.path.join(data_dir, f"{size}-{seed}")
+    if not os.path.isdir(dir) or not tracks_files(dir):
+        logging.getLogger(__name__).info(f"Generating {size} scrobbles in {dir}")
+        generate(dir, size, seed=seed)
+    return dir
+
+
+def run(dir: str, repeat: int, load_repeat: int) -> dict[str, float]:
+    """
+    Measure loading and the functions in stats on a dataset.
+
+    Times are in seconds and memory in bytes.
+    """
+    results = {}
+
+    with open(tracks_files(dir)[0], "rb") as f:
+        page = f.read()
+    results["parse_page"] = best_time(
+        lambda: RECENT_TRACKS_ADAPTER.validate_json(page), repeat
+    )
+
+    results["load_tracks_data"] = best_time(
+        lambda: load_tracks_data(dir, workers=1), load_repeat
+    )
+    results["load_track_store"] = best_time(
+        lambda: load_track_store(dir, workers=1), load_repeat
+    )
+    snapshot_path = os.path.join(dir, ".benchmark-snapshot")
+    if os.path.exists(snapshot_path):
+        os.remove(snapshot_path)
+    results["load_snapshot_cold"] = best_time(
+        lambda: load_with_snapshot(dir, snapshot_path, workers=1), 1
+    )
+    results["load_snapshot_warm"] = best_time(
+        lambda: load_with_snapshot(dir, snapshot_path, workers=1), load_repeat
+    )
+
+    results["peak_memory_tracks_data"] = peak_memory(
+        lambda: load_tracks_data(dir, workers=1)
+    )
+    results["peak_memory_track_store"] = peak_memory(
+        lambda: load_track_store(dir, workers=1)
+    )
+
+    store = load_track_store(dir, workers=1)
+    tracks = list(store)
+
+    album, _ = albums_by_playcount(store)[0]
+    first = store.time(0)
+    last = store.time(len(store) - 1)
+    middle = first + (last - first) / 2
+    month = (middle, middle + timedelta(days=30))
+
+    for name, indexed in (("list", tracks), ("store", store)):
+        album_tracks = tracks_in_album(indexed, album)
+        results[f"{name}.unique_albums"] = best_time(
+            lambda: unique_albums(indexed), repeat
+        )
+        results[f"{name}.tracks_in_album"] = best_time(
+            lambda: tracks_in_album(indexed, album), repeat
+        )
+        results[f"{name}.first_and_last_listen"] = best_time(
+            lambda: first_and_last_listen(album_tracks), repeat
+        )
+        results[f"{name}.tracks_between"] = best_time(
+            lambda: tracks_between(indexed, *month), repeat
+        )
+        results[f"{name}.albums_by_playcount"] = best_time(
+            lambda: albums_by_playcount(indexed), repeat
+        )
+        results[f"{name}.album_index"] = best_time(lambda: Store(indexed), repeat)
+
+    os.remove(snapshot_path)
+
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return f"{commit}-dirty" if dirty else commit
+
+
+def previous_results(
+    results_file: str, size: int, commit: Optional[str]
+) -> Optional[dict[str, Any]]:
+    """
+    Return the latest saved results for the size that were measured at another commit.
+    """
+    if not os.path.exists(results_file):
+        return None
+
+    previous = None
+    with open(results_file) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["size"] == size and record["commit"] != commit:
+                previous = record
+    return previous
+
+
+def format_value(name: str, value: float) -> str:
+    if name.startswith("peak_memory"):
+        return f"{value / 1024 / 1024:10.1f} MiB"
+    return f"{value * 1000:10.3f} ms "
+
+
+def report(results: dict[str, float], previous: Optional[dict[str, Any]]):
+    for name, value in results.items():
+        line = f"{name:32} {format_value(name, value)}"
+        if previous and previous["results"].get(name):
+            ratio = value / previous["results"][name]
+            line += f"  {ratio:5.2f}x {previous['commit']}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark loading and the stats functions on generated listening histories."
+    )
+    parser.add_argument(
+        "--sizes",
+        help="The numbers of scrobbles to benchmark with",
+        required=False,
+        dest="sizes",
+        type=int,
+        nargs="+",
+        default=SIZES,
+    )
+    parser.add_argument(
+        "--data-dir",
+        help="The directory the generated datasets are kept in between runs",
+        required=False,
+        dest="data_dir",
+        default=".benchmark",
+    )
+    parser.add_argument(
+        "--results",
+        help="The JSON lines file the results are appended to",
+        required=False,
+        dest="results",
+        default=os.path.join(".benchmark", "results.jsonl"),
+    )
+    parser.add_argument(
+        "--repeat",
+        help="The number of runs of every function. The fastest run counts",
+        required=False,
+        dest="repeat",
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "--load-repeat",
+        help="The number of runs of every way to load the data",
+        required=False,
+        dest="load_repeat",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--seed",
+        help="The seed of the generated datasets",
+        required=False,
+        dest="seed",
+        type=int,
+        default=0,
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    commit = git_commit()
+    os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+
+    for size in args.sizes:
+        dir = dataset(args.data_dir, size, args.seed)
+        results = run(dir, args.repeat, args.load_repeat)
+        previous = previous_results(args.results, size, commit)
+
+        print(f"\n{size} scrobbles")
+        report(results, previous)
+
+        with open(args.results, "a") as f:
+            record = {
+                "commit": commit,
+                "date": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "size": size,
+                "seed": args.seed,
+                "results": results,
+            }
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
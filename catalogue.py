@@ -0,0 +1,98 @@
+import json
+import os
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+CATALOGUE_FILE_NAME = "index.json"
+
+PARTITIONS = ("month", "year")
+
+
+@dataclass(frozen=True)
+class CatalogueEntry:
+    """
+    A segment of a compacted directory.
+
+    `first` and `last` are the unix timestamps of its first and last play and
+    `bytes` its size on disk. Segments hold plays in time order and never
+    overlap, so a time range maps to a contiguous run of segments. With
+    partitioning, `partition` names the month (2024-03) or year (2024) that
+    holds every play of the segment.
+    """
+
+    file: str
+    sha256: str
+    tracks: int
+    first: int
+    last: int
+    bytes: int = 0
+    partition: Optional[str] = None
+
+    def overlaps(
+        self, date_from: Optional[datetime], date_to: Optional[datetime]
+    ) -> bool:
+        return (date_from is None or self.last >= date_from.timestamp()) and (
+            date_to is None or self.first <= date_to.timestamp()
+        )
+
+
+def partition_name(timestamp: int, partition: str) -> str:
+    """
+    Return the name of the month or year partition a unix timestamp falls in, in UTC.
+    """
+    time = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+    if partition == "month":
+        return time.strftime("%Y-%m")
+    if partition == "year":
+        return time.strftime("%Y")
+
+    raise ValueError(f"Unsupported partition: {partition}")
+
+
+def read_catalogue(dir: str) -> Optional[list[CatalogueEntry]]:
+    """
+    Return the segments of a compacted directory, or None if it has no catalogue.
+    """
+    path = os.path.join(dir, CATALOGUE_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return [CatalogueEntry(**entry) for entry in json.load(f)["segments"]]
+
+
+def write_catalogue(dir: str, entries: list[CatalogueEntry]):
+    path = os.path.join(dir, CATALOGUE_FILE_NAME)
+    with open(f"{path}.part", "w") as f:
+        json.dump({"segments": [asdict(entry) for entry in entries]}, f, indent=2)
+    os.replace(f"{path}.part", path)
+
+
+def files_between(
+    dir: str,
+    files: list[str],
+    date_from: Optional[datetime],
+    date_to: Optional[datetime],
+) -> list[str]:
+    """
+    Return the tracks files of the directory that may hold plays between the
+    dates, in the order given.
+
+    Catalogued segments are kept if they overlap the range. Files the
+    catalogue does not list, such as pages downloaded after compaction, have
+    unknown bounds and are always kept, as is every file of a directory
+    without a catalogue.
+    """
+    entries = read_catalogue(dir)
+    if entries is None:
+        return files
+
+    catalogued = {entry.file: entry for entry in entries}
+    return [
+        f
+        for f in files
+        if (entry := catalogued.get(os.path.basename(f))) is None
+        or entry.overlaps(date_from, date_to)
+    ]
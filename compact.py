@@ -0,0 +1,248 @@
+import argparse
+import heapq
+import json
+import logging
+import os
+import tempfile
+from collections.abc import Iterator
+from typing import BinaryIO, Optional
+
+from catalogue import PARTITIONS, CatalogueEntry, partition_name, write_catalogue
+from last_fm_model import TRACK_ADAPTER, Track
+from segments import SEGMENT_FORMATS, SegmentWriter
+from util import iter_tracks_files, tracks_files
+
+SEGMENT_PREFIX = "tracks_compacted"
+
+# The key of a play: its time, artist and track name
+Key = tuple[int, str, str]
+
+
+def play_key(track: Track) -> Key:
+    return (int(track.timestamp.time.timestamp()), track.artist.name, track.name)
+
+
+def encode_run_line(key: Key, track: Track) -> bytes:
+    # The key is JSON without raw tabs, so the first tab ends it
+    return (
+        json.dumps(key).encode()
+        + b"\t"
+        + TRACK_ADAPTER.dump_json(track, by_alias=True)
+        + b"\n"
+    )
+
+
+def write_run(run_dir: str, number: int, tracks: list[tuple[Key, Track]]) -> str:
+    """
+    Write tracks sorted by key and without duplicates to a run file, and return its path.
+    """
+    tracks.sort(key=lambda item: item[0])
+    path = os.path.join(run_dir, f"run_{number:06}")
+
+    with open(path, "wb") as f:
+        previous = None
+        for key, track in tracks:
+            if key != previous:
+                f.write(encode_run_line(key, track))
+                previous = key
+
+    return path
+
+
+def read_run(f: BinaryIO) -> Iterator[tuple[Key, bytes]]:
+    for line in f:
+        key, track = line.split(b"\t", 1)
+        yield tuple(json.loads(key)), track
+
+
+def sorted_runs(files: list[str], run_dir: str, run_size: int) -> list[str]:
+    """
+    Split the tracks of the files into sorted runs of at most `run_size` tracks.
+    """
+    runs: list[str] = []
+    buffer: list[tuple[Key, Track]] = []
+
+    for track in iter_tracks_files(files):
+        buffer.append((play_key(track), track))
+        if len(buffer) >= run_size:
+            runs.append(write_run(run_dir, len(runs), buffer))
+            buffer = []
+
+    if buffer:
+        runs.append(write_run(run_dir, len(runs), buffer))
+
+    return runs
+
+
+def merge_runs(runs: list[str]) -> Iterator[tuple[Key, bytes]]:
+    """
+    Yield the tracks of sorted runs in key order, once per key.
+    """
+    handles = [open(run, "rb") for run in runs]
+    try:
+        previous = None
+        for key, track in heapq.merge(
+            *(read_run(f) for f in handles), key=lambda item: item[0]
+        ):
+            if key != previous:
+                yield key, track
+                previous = key
+    finally:
+        for f in handles:
+            f.close()
+
+
+def compact(
+    source_dir: str,
+    dest_dir: str,
+    format: str = "ndjson.zst",
+    segment_bytes: int = 64 * 1024 * 1024,
+    run_size: int = 200_000,
+    partition: Optional[str] = None,
+) -> list[CatalogueEntry]:
+    """
+    Merge the page files and segments of the source directory into sorted,
+    deduplicated segments in the destination directory, and catalogue them.
+
+    Plays with the same time, artist and track name are kept once. The tracks
+    are sorted with an external merge sort: runs of `run_size` tracks are
+    sorted in memory and written to temporary files, which are then merged, so
+    memory does not grow with the size of the history. Segments only end
+    between plays of different times, so their time ranges never overlap.
+
+    With a `partition` of "month" or "year", segments also end at the start of
+    every month or year and are named after it, such as tracks_2024-03_0001.
+    """
+    if os.path.realpath(source_dir) == os.path.realpath(dest_dir):
+        raise ValueError("The destination directory must differ from the source")
+    if partition is not None and partition not in PARTITIONS:
+        raise ValueError(f"Unsupported partition: {partition}")
+
+    os.makedirs(dest_dir, exist_ok=True)
+    if tracks_files(dest_dir):
+        raise ValueError(f"{dest_dir} already holds tracks files")
+
+    files = tracks_files(source_dir)
+    writer: Optional[SegmentWriter] = None
+    entries: list[CatalogueEntry] = []
+
+    name: Optional[str] = None
+    tracks = 0
+    first: Optional[int] = None
+    last: Optional[int] = None
+
+    def close_segment():
+        closed = writer.close() if writer is not None else None
+        if closed is not None and first is not None and last is not None:
+            file, digest = closed
+            size = os.path.getsize(os.path.join(dest_dir, file))
+            entries.append(
+                CatalogueEntry(file, digest, tracks, first, last, size, name)
+            )
+
+    with tempfile.TemporaryDirectory(dir=dest_dir, prefix=".compact-") as run_dir:
+        runs = sorted_runs(files, run_dir, run_size)
+
+        for (time, _, _), track in merge_runs(runs):
+            play_partition = partition_name(time, partition) if partition else None
+
+            if writer is None or play_partition != name:
+                close_segment()
+                name = play_partition
+                prefix = f"tracks_{name}" if name else SEGMENT_PREFIX
+                writer = SegmentWriter(dest_dir, prefix, format, segment_bytes)
+                tracks, first = 0, None
+            elif writer.full() and time != last:
+                close_segment()
+                tracks, first = 0, None
+
+            writer.write(track)
+            tracks += 1
+            first = time if first is None else first
+            last = time
+
+        close_segment()
+
+    write_catalogue(dest_dir, entries)
+
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge downloaded tracks files into sorted segments without duplicate plays."
+    )
+    parser.add_argument(
+        "--data-dir",
+        help="The directory with the downloaded tracks files",
+        required=False,
+        dest="data_dir",
+        default="data",
+    )
+    parser.add_argument(
+        "--dest-dir",
+        help="The directory to write the segments and their index to",
+        required=True,
+        dest="dest_dir",
+    )
+    parser.add_argument(
+        "--format",
+        help="The format of the segments",
+        required=False,
+        dest="format",
+        default="ndjson.zst",
+        choices=SEGMENT_FORMATS,
+    )
+    parser.add_argument(
+        "--segment-size",
+        help="The size of the segments in MiB, before compression",
+        required=False,
+        dest="segment_size",
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        "--partition",
+        help="Split the segments by month or by year",
+        required=False,
+        dest="partition",
+        default=None,
+        choices=PARTITIONS,
+    )
+    parser.add_argument(
+        "--run-size",
+        help="The number of tracks sorted in memory at a time",
+        required=False,
+        dest="run_size",
+        type=int,
+        default=200_000,
+    )
+    parser.add_argument(
+        "--log-level",
+        help="The log level",
+        required=False,
+        dest="log_level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+
+    entries = compact(
+        args.data_dir,
+        args.dest_dir,
+        format=args.format,
+        segment_bytes=args.segment_size * 1024 * 1024,
+        run_size=args.run_size,
+        partition=args.partition,
+    )
+
+    logging.getLogger(__name__).info(
+        f"Wrote {sum(e.tracks for e in entries)} tracks to {len(entries)} segments"
+    )
+
+
+if __name__ == "__main__":
+    main()
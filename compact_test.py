@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+
+from pytest import raises
+
+from catalogue import read_catalogue
+from compact import compact
+from util import iter_tracks, load_track_store, load_tracks_data, tracks_files
+
+
+def test_compact_merges_and_deduplicates_pages(tmp_path, write_page):
+    source = tmp_path / "source"
+    source.mkdir()
+    # Pages that overlap, as when new scrobbles shift the pagination
+    write_page(source, "tracks_1_9_0001.json", [900, 800, 700, 600])
+    write_page(source, "tracks_1_9_0002.json", [600, 500, 400])
+    write_page(source, "tracks_1_9_0003.json", [500, 300, 200, 100])
+    dest = tmp_path / "dest"
+
+    entries = compact(str(source), str(dest), segment_bytes=600, run_size=3)
+
+    assert len(entries) > 1
+    assert sum(e.tracks for e in entries) == 9
+    assert all(a.last < b.first for a, b in zip(entries, entries[1:]))
+    assert read_catalogue(str(dest)) == entries
+    assert [f.split("/")[-1] for f in tracks_files(str(dest))] == [
+        e.file for e in entries
+    ]
+
+    tracks = load_tracks_data(str(dest), workers=1)
+    assert [int(t.timestamp.time.timestamp()) for t in tracks] == list(
+        range(100, 1000, 100)
+    )
+    assert load_track_store(str(dest), workers=1).is_sorted
+
+
+def test_compact_refuses_to_overwrite(tmp_path, write_page):
+    write_page(tmp_path, "tracks_1_9_0001.json", [100])
+
+    with raises(ValueError):
+        compact(str(tmp_path), str(tmp_path))
+
+
+def test_load_tracks_data_opens_only_the_partitions_of_the_range(tmp_path, write_page):
+    source = tmp_path / "source"
+    source.mkdir()
+    # One play on the 1st of January, February and March 2024
+    write_page(source, "tracks_1_9_0001.json", [1709251200, 1706745600, 1704067200])
+    dest = tmp_path / "dest"
+
+    entries = compact(str(source), str(dest), partition="month")
+
+    assert [e.partition for e in entries] == ["2024-01", "2024-02", "2024-03"]
+    assert [e.file for e in entries][0] == "tracks_2024-01_0001.ndjson.zst"
+    assert all(e.bytes > 0 for e in entries)
+
+    timings = {}
+    tracks = load_tracks_data(
+        str(dest),
+        workers=1,
+        timings=timings,
+        date_from=datetime(2024, 2, 1, tzinfo=timezone.utc),
+        date_to=datetime(2024, 2, 29, tzinfo=timezone.utc),
+    )
+
+    assert [int(t.timestamp.time.timestamp()) for t in tracks] == [1706745600]
+    assert [f.split("/")[-1] for f in timings] == ["tracks_2024-02_0001.ndjson.zst"]
+
+    # Pages downloaded after compaction are not catalogued, so their bounds are unknown
+    write_page(dest, "tracks_1_9_0002.json", [1712000000, 1707000000])
+    february = {
+        "date_from": datetime(2024, 2, 1, tzinfo=timezone.utc),
+        "date_to": datetime(2024, 2, 29, tzinfo=timezone.utc),
+    }
+
+    assert [
+        int(t.timestamp.time.timestamp())
+        for t in load_tracks_data(str(dest), workers=1, **february)
+    ] == [1706745600, 1707000000]
+    assert sorted(
+        int(t.timestamp.time.timestamp()) for t in iter_tracks(str(dest), **february)
+    ) == [1706745600, 1707000000]
@@ -0,0 +1,84 @@
+import json
+from collections.abc import Callable
+
+from pytest import fixture
+
+from last_fm_model import Track
+
+# A play is an (album, track name, unix time) triple. The album is used as both
+# its MBID and its name, and every track is by Suede. A bare unix time is a play
+# of Animal Nitrate off an album without an MBID or a name, which is not ranked.
+Play = tuple[str, str, int] | int
+
+PLAYS: list[Play] = [
+    ("suede", "Animal Nitrate", 1711782712),
+    ("dog-man-star", "The Asphalt World", 1711788633),
+    ("suede", "So Young", 1711790000),
+]
+
+
+def track_json(play: Play) -> dict:
+    album, name, uts = ("", "Animal Nitrate", play) if isinstance(play, int) else play
+    return {
+        "artist": {"mbid": "", "#text": "Suede"},
+        "image": [{"size": "small", "#text": f"https://last.fm/{album}.jpg"}],
+        "mbid": "",
+        "album": {"mbid": album, "#text": album},
+        "name": name,
+        "url": f"https://www.last.fm/music/Suede/_/{name}",
+        "date": {"uts": str(uts), "#text": ""},
+    }
+
+
+def recent_tracks_json(plays: list[Play], page: int = 1, total_pages: int = 1) -> dict:
+    return {
+        "recenttracks": {
+            "track": [track_json(play) for play in plays],
+            "@attr": {
+                "user": "scrbl",
+                "totalPages": str(total_pages),
+                "page": str(page),
+                "perPage": "200",
+                "total": str(len(plays) * total_pages),
+            },
+        }
+    }
+
+
+@fixture
+def plays() -> list[Play]:
+    return list(PLAYS)
+
+
+@fixture
+def make_track() -> Callable[[Play], Track]:
+    """
+    Build the Track of a play.
+    """
+    return lambda play: Track(**track_json(play))
+
+
+@fixture
+def tracks(make_track) -> list[Track]:
+    return [make_track(play) for play in PLAYS]
+
+
+@fixture
+def recent_tracks_page() -> Callable[..., dict]:
+    """
+    Build the body of a recent tracks page with the plays, as Last.fm returns it.
+    """
+    return recent_tracks_json
+
+
+@fixture
+def write_page() -> Callable[..., None]:
+    """
+    Write the plays to a page file in a directory, as the downloader does.
+    """
+
+    def write(dir, name: str, plays: list[Play], page: int = 1, total_pages: int = 1):
+        with open(dir / name, "w") as f:
+            json.dump(recent_tracks_json(plays, page, total_pages), f)
+
+    return write
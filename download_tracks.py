@@ -1,38 +1,76 @@
 from datetime import date, datetime, time, timedelta, timezone
 import argparse
-from httpx import Client
+from abc import ABC, abstractmethod
+import asyncio
+import queue
+import re
+import threading
+from collections import deque
+from contextlib import ExitStack
+from httpx import AsyncClient, Client, Request, Response, TransportError
 import os
 import time as sys_time
-from typing import Generator, Any, Optional
+from typing import AsyncGenerator, Generator, Iterable, Optional, Sequence
 import logging
-from dataclasses import dataclass
-import json
-from last_fm_client import create_authorized_client, create_signed_get_request
+from dataclasses import dataclass, field, replace
+import math
+from pydantic import ValidationError
+from last_fm_client import (
+    LastFmError,
+    check_response,
+    create_async_authorized_client,
+    create_authorized_client,
+    create_signed_get_request,
+)
+from rate_limit import AdaptiveRateLimiter, RateLimiter, backoff_delay
+from util import date_intervals, load_tracks_data
+from manifest import Manifest, ManifestEntry, checksum
+from segments import SEGMENT_FORMATS, SegmentWriter, encode_tracks
 from last_fm_model import (
     Method,
     GetRecentTracksInput,
-    GetRecentTracksOutput,
+    RECENT_TRACKS_ADAPTER,
     Track,
 )
 
+PAGE_SIZE = 200
+MAX_RETRIES = 5
+
 
 @dataclass
 class RecentTracksPage:
-    response_body: dict[str, Any]
+    content: bytes
     tracks: list[Track]
     page: int
     total_pages: int
+    total_tracks: int
     elapsed_time: timedelta
 
 
-def get_recent_tracks_page(
-    client: Client,
+@dataclass(frozen=True)
+class Shard:
+    """
+    A time window of the listening history that is downloaded as its own page walk.
+    """
+
+    date_from: datetime
+    date_to: datetime
+    total_tracks: int
+
+    @property
+    def total_pages(self) -> int:
+        return math.ceil(self.total_tracks / PAGE_SIZE)
+
+
+def recent_tracks_request(
+    client: Client | AsyncClient,
     secret: str,
     user: str,
     date_from: datetime,
     date_to: datetime,
     page: Optional[int],
-) -> RecentTracksPage:
+    limit: int = PAGE_SIZE,
+) -> Request:
     if page is not None and page < 1:
         raise ValueError("page must be greater than or equal to 1")
 
@@ -41,23 +79,30 @@ def get_recent_tracks_page(
 
     input = GetRecentTracksInput(
         user=user,
-        limit=200,
+        limit=limit,
         page=page,
         date_from=date_from,
         date_to=date_to,
     )
 
-    req = create_signed_get_request(
+    return create_signed_get_request(
         client=client,
         secret=secret,
         method=Method.user_get_recent_tracks,
         params=input.as_params(),
     )
 
-    res = client.send(req)
-    response_body = res.json()
 
-    recent_tracks_output = GetRecentTracksOutput(**response_body)
+def recent_tracks_page(res: Response) -> RecentTracksPage:
+    if res.is_error:
+        check_response(res)
+
+    try:
+        recent_tracks_output = RECENT_TRACKS_ADAPTER.validate_json(res.content)
+    except ValidationError:
+        # Last.fm reports some errors with a 200 status
+        check_response(res)
+        raise
 
     recent_tracks = recent_tracks_output.recent_tracks
     attributes = recent_tracks.attributes
@@ -67,9 +112,114 @@ def get_recent_tracks_page(
         tracks=tracks,
         page=attributes.page,
         total_pages=attributes.totalPages,
+        total_tracks=attributes.total,
         elapsed_time=res.elapsed,
-        response_body=response_body,
+        content=res.content,
+    )
+
+
+def retry_delay(
+    error: Exception, attempt: int, limiter: Optional[RateLimiter]
+) -> Optional[float]:
+    """
+    Return the number of seconds to wait before retrying a failed request, or None
+    if the error is permanent or the retries are exhausted.
+    """
+    if isinstance(error, LastFmError) and not error.retryable:
+        return None
+
+    if attempt >= MAX_RETRIES:
+        return None
+
+    if isinstance(error, LastFmError) and error.rate_limited and limiter is not None:
+        limiter.throttled()
+
+    delay = backoff_delay(attempt)
+    logging.getLogger(__name__).warning(
+        f"Request failed: {error}. Retrying in {delay:.1f} seconds"
     )
+    return delay
+
+
+def get_recent_tracks_page(
+    client: Client,
+    secret: str,
+    user: str,
+    date_from: datetime,
+    date_to: datetime,
+    page: Optional[int],
+    limit: int = PAGE_SIZE,
+    limiter: Optional[RateLimiter] = None,
+) -> RecentTracksPage:
+    """
+    Fetch a page of recent tracks, retrying rate limit errors, transient errors
+    and server errors with jittered exponential backoff.
+
+    When a limiter is given, every attempt waits for it and reports its outcome to it.
+    """
+    attempt = 0
+
+    while True:
+        req = recent_tracks_request(
+            client, secret, user, date_from, date_to, page, limit
+        )
+
+        if limiter is not None:
+            limiter.wait()
+
+        try:
+            result = recent_tracks_page(client.send(req))
+        except (LastFmError, TransportError) as e:
+            delay = retry_delay(e, attempt, limiter)
+            if delay is None:
+                raise
+            sys_time.sleep(delay)
+            attempt += 1
+            continue
+
+        if limiter is not None:
+            limiter.succeeded(result.elapsed_time.total_seconds())
+
+        return result
+
+
+async def get_recent_tracks_page_async(
+    client: AsyncClient,
+    secret: str,
+    user: str,
+    date_from: datetime,
+    date_to: datetime,
+    page: Optional[int],
+    limit: int = PAGE_SIZE,
+    limiter: Optional[RateLimiter] = None,
+) -> RecentTracksPage:
+    """
+    The asyncio counterpart of get_recent_tracks_page.
+    """
+    attempt = 0
+
+    while True:
+        req = recent_tracks_request(
+            client, secret, user, date_from, date_to, page, limit
+        )
+
+        if limiter is not None:
+            await limiter.acquire()
+
+        try:
+            result = recent_tracks_page(await client.send(req))
+        except (LastFmError, TransportError) as e:
+            delay = retry_delay(e, attempt, limiter)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+
+        if limiter is not None:
+            limiter.succeeded(result.elapsed_time.total_seconds())
+
+        return result
 
 
 def get_recent_tracks(
@@ -80,10 +230,41 @@ def get_recent_tracks(
     date_from: datetime,
     date_to: datetime,
     pause_in_milliseconds: Optional[int] = 1000,
+    pages: Optional[Iterable[int]] = None,
+    limiter: Optional[RateLimiter] = None,
 ) -> Generator[RecentTracksPage, None, None]:
+    """
+    Fetch the given pages, or every page of the range if pages is None.
+
+    Pauses between pages for pause_in_milliseconds, and in addition waits for the limiter if one is given.
+    """
     if pause_in_milliseconds is not None and pause_in_milliseconds < 0:
         raise ValueError("pause_in_milliseconds must be greater than or equal to 0")
 
+    def pause(page: int, total_pages: Optional[int]):
+        if pause_in_milliseconds is not None and pause_in_milliseconds > 0:
+            logger.debug(
+                f"Sleeping for {pause_in_milliseconds} milliseconds before next page",
+                extra={"page": page, "total_pages": total_pages},
+            )
+            sys_time.sleep(pause_in_milliseconds / 1000)
+
+    if pages is not None:
+        for i, page in enumerate(pages):
+            if i > 0:
+                pause(page, None)
+
+            yield get_recent_tracks_page(
+                client=client,
+                secret=secret,
+                user=user,
+                date_from=date_from,
+                date_to=date_to,
+                page=page,
+                limiter=limiter,
+            )
+        return
+
     page = 1
 
     while True:
@@ -94,22 +275,247 @@ def get_recent_tracks(
             date_from=date_from,
             date_to=date_to,
             page=page,
+            limiter=limiter,
         )
         yield data
 
         if page >= data.total_pages:
             break
 
-        if pause_in_milliseconds is not None and pause_in_milliseconds > 0:
-            logger.debug(
-                f"Sleeping for {pause_in_milliseconds} milliseconds before next page",
-                extra={"page": page, "total_pages": data.total_pages},
-            )
-            sys_time.sleep(pause_in_milliseconds / 1000)
+        pause(page, data.total_pages)
 
         page += 1
 
 
+async def get_recent_tracks_async(
+    client: AsyncClient,
+    logger: logging.Logger,
+    secret: str,
+    user: str,
+    date_from: datetime,
+    date_to: datetime,
+    concurrency: int = 4,
+    limiter: Optional[RateLimiter] = None,
+) -> AsyncGenerator[RecentTracksPage, None]:
+    """
+    Fetch the first page, then the remaining pages with at most `concurrency`
+    requests in flight. Pages are yielded in the order in which they complete.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be greater than or equal to 1")
+
+    if limiter is None:
+        limiter = RateLimiter(requests_per_second=5)
+
+    first_page = await get_recent_tracks_page_async(
+        client=client,
+        secret=secret,
+        user=user,
+        date_from=date_from,
+        date_to=date_to,
+        page=1,
+        limiter=limiter,
+    )
+    yield first_page
+
+    async for page in get_pages_async(
+        client=client,
+        logger=logger,
+        secret=secret,
+        user=user,
+        date_from=date_from,
+        date_to=date_to,
+        pages=range(2, first_page.total_pages + 1),
+        concurrency=concurrency,
+        limiter=limiter,
+    ):
+        yield page
+
+
+async def get_pages_async(
+    client: AsyncClient,
+    logger: logging.Logger,
+    secret: str,
+    user: str,
+    date_from: datetime,
+    date_to: datetime,
+    pages: Iterable[int],
+    concurrency: int,
+    limiter: RateLimiter,
+) -> AsyncGenerator[RecentTracksPage, None]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(page: int) -> RecentTracksPage:
+        async with semaphore:
+            logger.debug(f"Requesting recent tracks page {page}")
+            return await get_recent_tracks_page_async(
+                client=client,
+                secret=secret,
+                user=user,
+                date_from=date_from,
+                date_to=date_to,
+                page=page,
+                limiter=limiter,
+            )
+
+    tasks = [asyncio.create_task(fetch(page)) for page in pages]
+
+    try:
+        for next_page in asyncio.as_completed(tasks):
+            yield await next_page
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def shard_windows(
+    date_from: datetime, date_to: datetime, interval: timedelta
+) -> list[tuple[datetime, datetime]]:
+    """
+    Split the range between date_from and date_to into windows of whole days.
+
+    The first and last windows are clamped to the given range.
+    """
+    start, end = date_from.date(), date_to.date()
+
+    if start == end:
+        return [(date_from, date_to)]
+
+    return [
+        (
+            max(date_from, datetime.combine(s, time.min, tzinfo=date_from.tzinfo)),
+            min(date_to, datetime.combine(e, time.max, tzinfo=date_to.tzinfo)),
+        )
+        for s, e in date_intervals(start, end, interval)
+    ]
+
+
+def rebalance_shards(shards: Sequence[Shard], target_pages: int) -> list[Shard]:
+    """
+    Merge adjacent shards for as long as the merged shard fits in target_pages.
+
+    Shards must be given in chronological order. Empty shards are dropped.
+    """
+    if target_pages < 1:
+        raise ValueError("target_pages must be greater than or equal to 1")
+
+    balanced: list[Shard] = []
+
+    for shard in shards:
+        if balanced:
+            previous = balanced[-1]
+            total_tracks = previous.total_tracks + shard.total_tracks
+            if math.ceil(total_tracks / PAGE_SIZE) <= target_pages:
+                balanced[-1] = Shard(previous.date_from, shard.date_to, total_tracks)
+                continue
+
+        balanced.append(shard)
+
+    return [shard for shard in balanced if shard.total_tracks > 0]
+
+
+async def plan_shards(
+    client: AsyncClient,
+    logger: logging.Logger,
+    secret: str,
+    user: str,
+    date_from: datetime,
+    date_to: datetime,
+    interval: timedelta,
+    target_pages: int,
+    limiter: RateLimiter,
+) -> list[Shard]:
+    """
+    Probe every window with a single-track request to learn its size, split the
+    windows that hold more than target_pages, and merge the small ones.
+    """
+
+    async def probe(window: tuple[datetime, datetime]) -> Shard:
+        p = await get_recent_tracks_page_async(
+            client=client,
+            secret=secret,
+            user=user,
+            date_from=window[0],
+            date_to=window[1],
+            page=1,
+            limit=1,
+            limiter=limiter,
+        )
+        return Shard(window[0], window[1], p.total_tracks)
+
+    async def probe_and_split(window: tuple[datetime, datetime]) -> list[Shard]:
+        shard = await probe(window)
+        days = (shard.date_to.date() - shard.date_from.date()).days + 1
+
+        if shard.total_pages <= target_pages or days < 2:
+            return [shard]
+
+        halves = shard_windows(
+            shard.date_from, shard.date_to, timedelta(days=math.ceil(days / 2))
+        )
+        return [s for half in await gather(halves) for s in half]
+
+    async def gather(windows: list[tuple[datetime, datetime]]) -> list[list[Shard]]:
+        return await asyncio.gather(*(probe_and_split(w) for w in windows))
+
+    windows = shard_windows(date_from, date_to, interval)
+    shards = [s for shards in await gather(windows) for s in shards]
+
+    logger.debug(f"Probed {len(shards)} windows")
+
+    return rebalance_shards(shards, target_pages)
+
+
+async def download_shards(
+    client: AsyncClient,
+    logger: logging.Logger,
+    secret: str,
+    user: str,
+    shards: Sequence[Shard],
+    writer: "PageWriter",
+    workers: int,
+    limiter: RateLimiter,
+    resume: bool = False,
+):
+    """
+    Download every shard as an independent page walk. Up to `workers` shards are
+    walked in parallel, each writing its own files.
+
+    With resume, only the pages that the manifest lacks are fetched.
+    """
+    queue: asyncio.Queue[Shard] = asyncio.Queue()
+    for shard in shards:
+        queue.put_nowait(shard)
+
+    async def worker():
+        while not queue.empty():
+            shard = queue.get_nowait()
+
+            pages = None
+            if resume:
+                pages = writer.manifest.missing_pages(shard.date_from, shard.date_to)
+            if pages is None:
+                pages = range(1, shard.total_pages + 1)
+
+            async for p in get_pages_async(
+                client=client,
+                logger=logger,
+                secret=secret,
+                user=user,
+                date_from=shard.date_from,
+                date_to=shard.date_to,
+                pages=pages,
+                concurrency=1,
+                limiter=limiter,
+            ):
+                logger.debug(
+                    f"Shard {shard.date_from.date()}..{shard.date_to.date()} page {p.page}/{p.total_pages} took {p.elapsed_time.total_seconds()} seconds"
+                )
+                writer.write(shard.date_from, shard.date_to, p)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+
+
 def file_name(date_from: datetime, date_to: datetime, page: int) -> str:
     time_format_in_filename = "%Y-%m-%dT%H%M%S"
     return f"tracks_{date_from.strftime(time_format_in_filename)}_{date_to.strftime(time_format_in_filename)}_{str(page).zfill(4)}.json"
@@ -141,12 +547,17 @@ def main():
         required=True,
         dest="session",
     )
-    parser.add_argument(
+    users = parser.add_mutually_exclusive_group(required=True)
+    users.add_argument(
         "--user",
         help="The username to download tracks for",
-        required=True,
         dest="user",
     )
+    users.add_argument(
+        "--users-file",
+        help="A file with one username per line. Every user is downloaded into a subdirectory of --dest-dir named after them, sharing one connection pool and one rate limit",
+        dest="users_file",
+    )
     parser.add_argument(
         "--from",
         help="The start date in the format YYYY-MM-DD",
@@ -176,6 +587,75 @@ def main():
         type=int,
         default=1000,
     )
+    parser.add_argument(
+        "--concurrency",
+        help="The number of pages to fetch in parallel. Values above 1 enable the asyncio downloader",
+        required=False,
+        dest="concurrency",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--rate",
+        help="The maximum number of requests per second when fetching in parallel, or the initial rate with --adaptive",
+        required=False,
+        dest="rate",
+        type=float,
+        default=5,
+    )
+    parser.add_argument(
+        "--adaptive",
+        help="Adapt the request rate to rate limit errors and response times, starting at --rate. Replaces --pause",
+        required=False,
+        dest="adaptive",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--shard-days",
+        help="Split the range into windows of this many days and download them as parallel shards",
+        required=False,
+        dest="shard_days",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--shard-pages",
+        help="The number of pages to aim for in every shard",
+        required=False,
+        dest="shard_pages",
+        type=int,
+        default=25,
+    )
+    parser.add_argument(
+        "--resume",
+        help="Fetch only the pages that are missing or corrupt according to the manifest in the destination directory",
+        required=False,
+        dest="resume",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--incremental",
+        help="Start from the newest scrobble already stored in the destination directory",
+        required=False,
+        dest="incremental",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--format",
+        help="Write every page as its own JSON file, or tracks as NDJSON into rolling compressed segments",
+        required=False,
+        dest="format",
+        default="json",
+        choices=["json", *SEGMENT_FORMATS],
+    )
+    parser.add_argument(
+        "--segment-size",
+        help="The uncompressed size in MiB after which a new segment is started",
+        required=False,
+        dest="segment_size",
+        type=int,
+        default=64,
+    )
     parser.add_argument(
         "--log-level",
         help="The log level",
@@ -196,11 +676,6 @@ def main():
 
     logging.basicConfig(level=args.log_level)
 
-    api_key = args.api_key
-    secret = args.secret
-    session_key = args.session
-    user = args.user
-    base_url = args.base_url
     dest_dir = args.dest_dir
 
     if not os.path.exists(dest_dir):
@@ -212,26 +687,585 @@ def main():
     if date_to < date_from:
         raise ValueError("The end date must be greater than or equal to the start date")
 
+    if args.adaptive:
+        limiter = AdaptiveRateLimiter(requests_per_second=args.rate)
+    else:
+        limiter = RateLimiter(requests_per_second=args.rate)
+
+    if args.users_file is not None:
+        if args.shard_days is not None:
+            parser.error("--shard-days cannot be combined with --users-file")
+
+        failed = download_users(logger, args, limiter, date_from, date_to)
+        if failed:
+            raise SystemExit(f"Failed to download {', '.join(failed)}")
+        return
+
+    manifest = Manifest.load(dest_dir)
+
+    if args.incremental:
+        date_from = incremental_date_from(logger, manifest, date_from)
+
+        if date_to < date_from:
+            logger.info("Nothing to download")
+            return
+
+    with create_page_writer(
+        manifest, args.format, args.segment_size * 1024 * 1024
+    ) as writer:
+        download(logger, args, writer, limiter, date_from, date_to)
+
+
+def download(
+    logger: logging.Logger,
+    args: argparse.Namespace,
+    writer: "PageWriter",
+    limiter: RateLimiter,
+    date_from: datetime,
+    date_to: datetime,
+):
+    if args.shard_days is not None:
+        asyncio.run(
+            download_sharded(
+                logger=logger,
+                base_url=args.base_url,
+                api_key=args.api_key,
+                secret=args.secret,
+                session_key=args.session,
+                user=args.user,
+                date_from=date_from,
+                date_to=date_to,
+                writer=writer,
+                resume=args.resume,
+                interval=timedelta(days=args.shard_days),
+                target_pages=args.shard_pages,
+                workers=args.concurrency,
+                limiter=limiter,
+            )
+        )
+        return
+
+    if args.concurrency > 1:
+        asyncio.run(
+            download_async(
+                logger=logger,
+                base_url=args.base_url,
+                api_key=args.api_key,
+                secret=args.secret,
+                session_key=args.session,
+                user=args.user,
+                date_from=date_from,
+                date_to=date_to,
+                writer=writer,
+                resume=args.resume,
+                concurrency=args.concurrency,
+                limiter=limiter,
+            )
+        )
+        return
+
     client = create_authorized_client(
-        base_url=base_url, api_key=api_key, session_key=session_key
+        base_url=args.base_url, api_key=args.api_key, session_key=args.session
     )
 
+    pages = writer.manifest.missing_pages(date_from, date_to) if args.resume else None
+
     for p in get_recent_tracks(
         client=client,
         logger=logger,
-        secret=secret,
-        user=user,
+        secret=args.secret,
+        user=args.user,
         date_from=date_from,
         date_to=date_to,
+        pause_in_milliseconds=None if args.adaptive else args.pause,
+        pages=pages,
+        limiter=limiter if args.adaptive else None,
     ):
         logger.debug(
             f"Recent tracks page {p.page}/{p.total_pages} took {p.elapsed_time.total_seconds()} seconds"
         )
+        writer.write(date_from, date_to, p)
+
+
+async def download_async(
+    logger: logging.Logger,
+    base_url: str,
+    api_key: str,
+    secret: str,
+    session_key: str,
+    user: str,
+    date_from: datetime,
+    date_to: datetime,
+    writer: "PageWriter",
+    resume: bool,
+    concurrency: int,
+    limiter: RateLimiter,
+):
+    pages = writer.manifest.missing_pages(date_from, date_to) if resume else None
+
+    async with create_async_authorized_client(
+        base_url=base_url,
+        api_key=api_key,
+        session_key=session_key,
+        max_connections=concurrency,
+    ) as client:
+        if pages is None:
+            downloads = get_recent_tracks_async(
+                client=client,
+                logger=logger,
+                secret=secret,
+                user=user,
+                date_from=date_from,
+                date_to=date_to,
+                concurrency=concurrency,
+                limiter=limiter,
+            )
+        else:
+            downloads = get_pages_async(
+                client=client,
+                logger=logger,
+                secret=secret,
+                user=user,
+                date_from=date_from,
+                date_to=date_to,
+                pages=pages,
+                concurrency=concurrency,
+                limiter=limiter,
+            )
+
+        async for p in downloads:
+            logger.debug(
+                f"Recent tracks page {p.page}/{p.total_pages} took {p.elapsed_time.total_seconds()} seconds"
+            )
+            writer.write(date_from, date_to, p)
+
+
+async def download_sharded(
+    logger: logging.Logger,
+    base_url: str,
+    api_key: str,
+    secret: str,
+    session_key: str,
+    user: str,
+    date_from: datetime,
+    date_to: datetime,
+    writer: "PageWriter",
+    resume: bool,
+    interval: timedelta,
+    target_pages: int,
+    workers: int,
+    limiter: RateLimiter,
+):
+    async with create_async_authorized_client(
+        base_url=base_url,
+        api_key=api_key,
+        session_key=session_key,
+        max_connections=workers,
+    ) as client:
+        shards = await plan_shards(
+            client=client,
+            logger=logger,
+            secret=secret,
+            user=user,
+            date_from=date_from,
+            date_to=date_to,
+            interval=interval,
+            target_pages=target_pages,
+            limiter=limiter,
+        )
+
+        logger.info(
+            f"Downloading {sum(s.total_pages for s in shards)} pages in {len(shards)} shards"
+        )
+
+        await download_shards(
+            client=client,
+            logger=logger,
+            secret=secret,
+            user=user,
+            shards=shards,
+            writer=writer,
+            workers=workers,
+            limiter=limiter,
+            resume=resume,
+        )
+
+
+def incremental_date_from(
+    logger: logging.Logger, manifest: Manifest, date_from: datetime
+) -> datetime:
+    """
+    Return the start of the range that holds the scrobbles newer than the stored ones.
+    """
+    newest = newest_stored_scrobble(manifest)
+    if newest is None:
+        return date_from
+
+    logger.info(f"Newest stored scrobble is from {newest.isoformat()}")
+    return max(date_from, newest + timedelta(seconds=1))
+
+
+# Last.fm usernames start with a letter and hold letters, digits, - and _
+USERNAME = re.compile(r"[A-Za-z][A-Za-z0-9_-]*")
+
+
+def read_users(path: str) -> list[str]:
+    """
+    Read one username per line, skipping blank lines, # comments and repeated names.
+    """
+    users: list[str] = []
+
+    with open(path) as f:
+        for line in f:
+            user = line.split("#", 1)[0].strip()
+            if not user:
+                continue
+            if not USERNAME.fullmatch(user):
+                raise ValueError(f"Invalid username: {user}")
+            if user not in users:
+                users.append(user)
+
+    return users
+
+
+@dataclass
+class UserDownload:
+    """
+    The pages of one user that are still to be fetched in a batch download.
+
+    `walked` is set once the number of pages is known, either from the manifest
+    or from the first page.
+    """
+
+    user: str
+    date_from: datetime
+    date_to: datetime
+    writer: "PageWriter"
+    pages: deque[int] = field(default_factory=deque)
+    walked: bool = False
+    failed: bool = False
+
+
+class FairScheduler:
+    """
+    Hands out the pages of a batch download to workers one user at a time, in turn.
+
+    A user with a long history therefore never holds up the others, and every
+    user is making progress at the same rate.
+    """
+
+    def __init__(self):
+        self.turns: deque[UserDownload] = deque()
+        self.in_flight = 0
+        self.changed = asyncio.Condition()
+
+    def add(self, download: UserDownload, pages: Iterable[int]):
+        had_pages = bool(download.pages)
+        download.pages.extend(pages)
+
+        if download.pages and not had_pages:
+            self.turns.append(download)
+
+    async def next(self) -> Optional[tuple[UserDownload, int]]:
+        """
+        Wait for the next page to fetch, or return None when every page is done.
+        """
+        async with self.changed:
+            while not self.turns:
+                if self.in_flight == 0:
+                    return None
+                await self.changed.wait()
+
+            download = self.turns.popleft()
+            page = download.pages.popleft()
+            if download.pages:
+                self.turns.append(download)
+
+            self.in_flight += 1
+            return download, page
+
+    async def done(self, download: UserDownload, pages: Iterable[int] = ()):
+        """
+        Report a page as done and add the pages it revealed.
+        """
+        async with self.changed:
+            self.in_flight -= 1
+
+            if download.failed:
+                download.pages.clear()
+                if download in self.turns:
+                    self.turns.remove(download)
+            else:
+                self.add(download, pages)
+
+            self.changed.notify_all()
+
+
+async def download_batch(
+    logger: logging.Logger,
+    client: AsyncClient,
+    secret: str,
+    downloads: Sequence[UserDownload],
+    resume: bool,
+    concurrency: int,
+    limiter: RateLimiter,
+) -> list[str]:
+    """
+    Download the pages of many users with `concurrency` workers that share one
+    client and one rate limiter, taking the users in turn.
+
+    Returns the users whose download failed. A failure stops only that user.
+    """
+    scheduler = FairScheduler()
+
+    for download in downloads:
+        pages = None
+        if resume:
+            pages = download.writer.manifest.missing_pages(
+                download.date_from, download.date_to
+            )
+
+        download.walked = pages is not None
+        scheduler.add(download, [1] if pages is None else pages)
+
+    async def worker():
+        while (job := await scheduler.next()) is not None:
+            download, page = job
+            revealed: Iterable[int] = ()
+
+            try:
+                p = await get_recent_tracks_page_async(
+                    client=client,
+                    secret=secret,
+                    user=download.user,
+                    date_from=download.date_from,
+                    date_to=download.date_to,
+                    page=page,
+                    limiter=limiter,
+                )
+                logger.debug(
+                    f"{download.user} page {p.page}/{p.total_pages} took {p.elapsed_time.total_seconds()} seconds"
+                )
+                download.writer.write(download.date_from, download.date_to, p)
+
+                if not download.walked:
+                    download.walked = True
+                    revealed = range(2, p.total_pages + 1)
+            except Exception as e:
+                # A malformed page or a failing writer stops only this user.
+                # Cancellation is not an Exception, so it still stops the batch.
+                logger.error(f"Failed to download {download.user}: {e!r}")
+                download.failed = True
+            finally:
+                await scheduler.done(download, revealed)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return [download.user for download in downloads if download.failed]
+
+
+def download_users(
+    logger: logging.Logger,
+    args: argparse.Namespace,
+    limiter: RateLimiter,
+    date_from: datetime,
+    date_to: datetime,
+) -> list[str]:
+    """
+    Download the users of the users file into subdirectories of the destination
+    directory, and return the users whose download failed.
+    """
+    with ExitStack() as stack:
+        downloads = []
+
+        for user in read_users(args.users_file):
+            user_dir = os.path.join(args.dest_dir, user)
+            os.makedirs(user_dir, exist_ok=True)
+            manifest = Manifest.load(user_dir)
+
+            user_date_from = date_from
+            if args.incremental:
+                user_date_from = incremental_date_from(logger, manifest, date_from)
+                if date_to < user_date_from:
+                    logger.info(f"Nothing to download for {user}")
+                    continue
+
+            writer = stack.enter_context(
+                create_page_writer(
+                    manifest, args.format, args.segment_size * 1024 * 1024
+                )
+            )
+            downloads.append(UserDownload(user, user_date_from, date_to, writer))
+
+        logger.info(f"Downloading {len(downloads)} users")
+
+        async def run() -> list[str]:
+            async with create_async_authorized_client(
+                base_url=args.base_url,
+                api_key=args.api_key,
+                session_key=args.session,
+                max_connections=args.concurrency,
+            ) as client:
+                return await download_batch(
+                    logger=logger,
+                    client=client,
+                    secret=args.secret,
+                    downloads=downloads,
+                    resume=args.resume,
+                    concurrency=args.concurrency,
+                    limiter=limiter,
+                )
+
+        return asyncio.run(run())
+
+
+def page_entry(
+    file: str,
+    date_from: datetime,
+    date_to: datetime,
+    p: RecentTracksPage,
+    sha256: str,
+) -> ManifestEntry:
+    return ManifestEntry(
+        file=file,
+        date_from=int(date_from.timestamp()),
+        date_to=int(date_to.timestamp()),
+        page=p.page,
+        total_pages=p.total_pages,
+        tracks=len(p.tracks),
+        sha256=sha256,
+        newest=max(
+            (int(track.timestamp.time.timestamp()) for track in p.tracks),
+            default=None,
+        ),
+    )
+
+
+class PageWriter(ABC):
+    """
+    Stores downloaded pages in the destination directory and records them in its manifest.
+    """
+
+    def __init__(self, manifest: Manifest):
+        self.manifest = manifest
+
+    @abstractmethod
+    def write(self, date_from: datetime, date_to: datetime, p: RecentTracksPage): ...
+
+    def close(self):
+        pass
+
+    def __enter__(self) -> "PageWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class JsonPageWriter(PageWriter):
+    """
+    Writes every page as the response body received from Last.fm, one file per page.
+    """
+
+    def write(self, date_from: datetime, date_to: datetime, p: RecentTracksPage):
+        name = file_name(date_from, date_to, p.page)
+
+        with open(os.path.join(self.manifest.dest_dir, name), "wb") as f:
+            f.write(p.content)
+
+        self.manifest.record(
+            page_entry(name, date_from, date_to, p, checksum(p.content))
+        )
+
+
+class SegmentPageWriter(PageWriter):
+    """
+    Writes the tracks of every page as NDJSON into rolling compressed segments.
+
+    Encoding, compression and writing happen on a background thread, so the
+    downloader only hands pages over. Pages are recorded in the manifest when
+    their segment is complete, so pages of a segment that was cut short by a
+    crash count as missing.
+    """
+
+    def __init__(self, manifest: Manifest, format: str, segment_bytes: int):
+        super().__init__(manifest)
+
+        prefix = "tracks_" + datetime.now(timezone.utc).strftime("%Y-%m-%dT%H%M%S")
+        self.segments = SegmentWriter(manifest.dest_dir, prefix, format, segment_bytes)
+        self.queue: queue.Queue[
+            Optional[tuple[datetime, datetime, RecentTracksPage]]
+        ] = queue.Queue(maxsize=64)
+        self.pending: list[ManifestEntry] = []
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, date_from: datetime, date_to: datetime, p: RecentTracksPage):
+        if self.error is not None:
+            raise self.error
+
+        self.queue.put((date_from, date_to, p))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while (item := self.queue.get()) is not None:
+            if self.error is not None:
+                # Keep draining so that the downloader never blocks on a full queue
+                continue
+
+            try:
+                date_from, date_to, p = item
+                name = self.segments.write(encode_tracks(p.tracks))
+                self.pending.append(page_entry(name, date_from, date_to, p, ""))
+
+                if self.segments.full():
+                    self._close_segment()
+            except BaseException as e:
+                self.error = e
+
+        if self.error is None:
+            try:
+                self._close_segment()
+            except BaseException as e:
+                self.error = e
+
+    def _close_segment(self):
+        closed = self.segments.close()
+        if closed is None:
+            return
+
+        _, sha256 = closed
+        self.manifest.record(*(replace(entry, sha256=sha256) for entry in self.pending))
+        self.pending = []
+
+
+def create_page_writer(
+    manifest: Manifest, format: str, segment_bytes: int
+) -> PageWriter:
+    if format == "json":
+        return JsonPageWriter(manifest)
+    return SegmentPageWriter(manifest, format, segment_bytes)
+
+
+def newest_stored_scrobble(manifest: Manifest) -> Optional[datetime]:
+    """
+    Return the time of the newest scrobble in the destination directory.
 
-        dest_file = os.path.join(dest_dir, file_name(date_from, date_to, p.page))
+    Falls back to reading the stored pages for directories written before the manifest existed.
+    """
+    newest = manifest.newest_scrobble()
+    if newest is not None:
+        return newest
 
-        with open(dest_file, "w") as f:
-            f.write(json.dumps(p.response_body))
+    tracks = load_tracks_data(manifest.dest_dir)
+    return max((track.timestamp.time for track in tracks), default=None)
 
 
 if __name__ == "__main__":
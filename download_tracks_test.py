@@ -0,0 +1,237 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+
+from httpx import (
+    AsyncClient,
+    ByteStream,
+    Client,
+    MockTransport,
+    Request,
+    Response,
+)
+from pytest import fixture, raises as pytest_raises
+
+from download_tracks import (
+    JsonPageWriter,
+    Shard,
+    UserDownload,
+    download_batch,
+    get_recent_tracks_async,
+    get_recent_tracks_page,
+    rebalance_shards,
+    shard_windows,
+)
+from last_fm_client import LastFmError
+from manifest import Manifest
+from rate_limit import AdaptiveRateLimiter, RateLimiter
+
+date_from = datetime(2024, 3, 1, tzinfo=timezone.utc)
+date_to = datetime(2024, 3, 31, tzinfo=timezone.utc)
+
+
+def page_plays(page: int) -> list[tuple[str, str, int]]:
+    return [("", f"Track {page}", 1711782712 - page)]
+
+
+@fixture
+def mock_client(recent_tracks_page):
+    def client(total_pages: int, requested: list[int]) -> AsyncClient:
+        def handler(request: Request) -> Response:
+            page = int(request.url.params["page"])
+            requested.append(page)
+            body = recent_tracks_page(page_plays(page), page, total_pages)
+            return Response(200, stream=ByteStream(json.dumps(body).encode()))
+
+        return AsyncClient(
+            base_url="https://ws.audioscrobbler.com/",
+            params={"api_key": "api_key", "sk": "session_key", "format": "json"},
+            transport=MockTransport(handler),
+        )
+
+    return client
+
+
+def test_get_recent_tracks_async_fetches_every_page(mock_client):
+    requested = []
+
+    async def download():
+        async with mock_client(total_pages=7, requested=requested) as client:
+            return [
+                p
+                async for p in get_recent_tracks_async(
+                    client=client,
+                    logger=logging.getLogger(__name__),
+                    secret="secret",
+                    user="scrbl",
+                    date_from=date_from,
+                    date_to=date_to,
+                    concurrency=3,
+                    limiter=RateLimiter(requests_per_second=1000),
+                )
+            ]
+
+    pages = asyncio.run(download())
+
+    assert requested[0] == 1
+    assert sorted(p.page for p in pages) == list(range(1, 8))
+    assert sorted(requested) == list(range(1, 8))
+
+
+def test_rate_limiter_spaces_out_reservations():
+    limiter = RateLimiter(requests_per_second=10)
+
+    delays = [limiter.reserve() for _ in range(3)]
+
+    assert delays[0] == 0
+    assert 0.09 < delays[1] <= 0.1
+    assert 0.19 < delays[2] <= 0.2
+
+
+def test_shard_windows_are_clamped_to_the_range():
+    windows = shard_windows(
+        datetime(2024, 3, 1, 12, tzinfo=timezone.utc),
+        datetime(2024, 3, 20, 6, tzinfo=timezone.utc),
+        timedelta(days=10),
+    )
+
+    assert [(w[0].isoformat(), w[1].date().isoformat()) for w in windows] == [
+        ("2024-03-01T12:00:00+00:00", "2024-03-10"),
+        ("2024-03-11T00:00:00+00:00", "2024-03-20"),
+    ]
+    assert windows[-1][1] == datetime(2024, 3, 20, 6, tzinfo=timezone.utc)
+
+
+def test_rebalance_shards_merges_small_neighbours():
+    day = timedelta(days=1)
+    shards = [
+        Shard(date_from + i * day, date_from + (i + 1) * day, total_tracks)
+        for i, total_tracks in enumerate([100, 150, 0, 900, 50, 0])
+    ]
+
+    balanced = rebalance_shards(shards, target_pages=2)
+
+    assert [(s.total_tracks, s.total_pages) for s in balanced] == [
+        (250, 2),
+        (900, 5),
+        (50, 1),
+    ]
+    assert balanced[0].date_from == shards[0].date_from
+    assert balanced[0].date_to == shards[2].date_to
+
+
+def error_client(responses: list[Response]) -> Client:
+    return Client(
+        base_url="https://ws.audioscrobbler.com/",
+        transport=MockTransport(lambda request: responses.pop(0)),
+    )
+
+
+def test_get_recent_tracks_page_retries_rate_limit_errors(
+    monkeypatch, recent_tracks_page
+):
+    monkeypatch.setattr("download_tracks.backoff_delay", lambda attempt: 0)
+    body = json.dumps(recent_tracks_page(page_plays(1))).encode()
+    client = error_client(
+        [
+            Response(429, json={"error": 29, "message": "Rate limit exceeded"}),
+            Response(503, text="Service Unavailable"),
+            Response(200, stream=ByteStream(body)),
+        ]
+    )
+    limiter = AdaptiveRateLimiter(requests_per_second=1000)
+
+    page = get_recent_tracks_page(
+        client, "secret", "scrbl", date_from, date_to, page=1, limiter=limiter
+    )
+
+    assert page.page == 1
+    assert limiter.requests_per_second < 1000
+
+
+def test_get_recent_tracks_page_raises_permanent_errors():
+    client = error_client(
+        [Response(200, json={"error": 6, "message": "User not found"})]
+    )
+
+    with pytest_raises(LastFmError) as e:
+        get_recent_tracks_page(client, "secret", "nobody", date_from, date_to, page=1)
+
+    assert e.value.error == 6
+    assert not e.value.retryable
+
+
+def test_adaptive_rate_limiter_increases_additively_and_decreases_multiplicatively():
+    limiter = AdaptiveRateLimiter(requests_per_second=4, increase=1)
+
+    limiter.succeeded(0.2)
+    assert limiter.requests_per_second == 4.25
+
+    limiter.succeeded(1.0)
+    assert limiter.requests_per_second == 4.25
+
+    limiter.throttled()
+    assert limiter.requests_per_second == 2.125
+
+
+def test_download_batch_takes_users_in_turn(tmp_path, recent_tracks_page):
+    total_pages = {"suede": 4, "blur": 2, "pulp": 1}
+    requested = []
+
+    def handler(request: Request) -> Response:
+        user = request.url.params["user"]
+        page = int(request.url.params["page"])
+        requested.append((user, page))
+        if user == "malformed":
+            return Response(200, json={"recenttracks": {"track": "?"}})
+        if user not in total_pages and user != "full":
+            return Response(200, json={"error": 6, "message": "User not found"})
+        body = recent_tracks_page(page_plays(page), page, total_pages.get(user, 1))
+        body = json.dumps(body).encode()
+        return Response(200, stream=ByteStream(body))
+
+    class FullDiskWriter(JsonPageWriter):
+        def write(self, date_from, date_to, p):
+            raise OSError(28, "No space left on device")
+
+    downloads = []
+    for user in [*total_pages, "nobody", "malformed", "full"]:
+        (tmp_path / user).mkdir()
+        writer_class = FullDiskWriter if user == "full" else JsonPageWriter
+        writer = writer_class(Manifest.load(str(tmp_path / user)))
+        downloads.append(UserDownload(user, date_from, date_to, writer))
+
+    async def download():
+        async with AsyncClient(
+            base_url="https://ws.audioscrobbler.com/",
+            params={"api_key": "api_key", "sk": "session_key", "format": "json"},
+            transport=MockTransport(handler),
+        ) as client:
+            return await download_batch(
+                logger=logging.getLogger(__name__),
+                client=client,
+                secret="secret",
+                downloads=downloads,
+                resume=False,
+                concurrency=1,
+                limiter=RateLimiter(requests_per_second=1000),
+            )
+
+    failed = asyncio.run(download())
+
+    assert failed == ["nobody", "malformed", "full"]
+    assert requested == [
+        ("suede", 1),
+        ("blur", 1),
+        ("pulp", 1),
+        ("nobody", 1),
+        ("malformed", 1),
+        ("full", 1),
+        ("suede", 2),
+        ("blur", 2),
+        ("suede", 3),
+        ("suede", 4),
+    ]
+    for user, pages in total_pages.items():
+        assert len(list((tmp_path / user).glob("tracks_*.json"))) == pages
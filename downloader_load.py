@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from httpx import (
+    ASGITransport,
+    AsyncBaseTransport,
+    AsyncClient,
+    AsyncHTTPTransport,
+    Limits,
+    Request,
+    Response,
+)
+
+from download_tracks import get_recent_tracks_async
+from mock_last_fm import MockConfig, create_app
+from rate_limit import AdaptiveRateLimiter, RateLimiter
+
+
+@dataclass
+class LoadTestResult:
+    pages: int = 0
+    tracks: int = 0
+    seconds: float = 0.0
+    latencies: list[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.seconds if self.seconds else 0.0
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        if len(self.latencies) == 1:
+            return self.latencies[0]
+        return statistics.quantiles(self.latencies, n=1000, method="inclusive")[
+            round(p * 10) - 1
+        ]
+
+
+class TimingTransport(AsyncBaseTransport):
+    """
+    Records the status and the time to the response headers of every request sent through a transport.
+    """
+
+    def __init__(self, transport: AsyncBaseTransport, result: LoadTestResult):
+        self.transport = transport
+        self.result = result
+
+    async def handle_async_request(self, request: Request) -> Response:
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        self.result.latencies.append(time.perf_counter() - start)
+        self.result.statuses[response.status_code] += 1
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+async def run(
+    transport: AsyncBaseTransport,
+    base_url: str,
+    api_key: str,
+    secret: str,
+    user: str,
+    date_from: datetime,
+    date_to: datetime,
+    concurrency: int,
+    limiter: RateLimiter,
+) -> LoadTestResult:
+    """
+    Download every page of the range with the asyncio downloader and measure it.
+    """
+    result = LoadTestResult()
+    logger = logging.getLogger(__name__)
+
+    async with AsyncClient(
+        base_url=base_url,
+        params={"api_key": api_key, "sk": "session-key", "format": "json"},
+        transport=TimingTransport(transport, result),
+    ) as client:
+        start = time.perf_counter()
+        async for page in get_recent_tracks_async(
+            client=client,
+            logger=logger,
+            secret=secret,
+            user=user,
+            date_from=date_from,
+            date_to=date_to,
+            concurrency=concurrency,
+            limiter=limiter,
+        ):
+            result.pages += 1
+            result.tracks += len(page.tracks)
+        result.seconds = time.perf_counter() - start
+
+    return result
+
+
+def report(result: LoadTestResult):
+    print(f"pages        {result.pages}")
+    print(f"tracks       {result.tracks}")
+    print(f"seconds      {result.seconds:.2f}")
+    print(f"pages/sec    {result.pages_per_second:.1f}")
+    print(f"requests     {sum(result.statuses.values())} {dict(result.statuses)}")
+    for p in (50, 90, 99, 99.9):
+        print(f"p{p:<11} {result.percentile(p) * 1000:.1f} ms")
+    print(f"max          {max(result.latencies, default=0) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput and latency of the downloader against a mock Last.fm API."
+    )
+    parser.add_argument(
+        "--base-url",
+        help="The URL of a running mock_last_fm.py. By default a mock is run in process",
+        required=False,
+        dest="base_url",
+        default=None,
+    )
+    parser.add_argument(
+        "--api-key",
+        help="The API key of the mock",
+        required=False,
+        dest="api_key",
+        default="api-key",
+    )
+    parser.add_argument(
+        "--secret",
+        help="The API secret of the mock",
+        required=False,
+        dest="secret",
+        default="secret",
+    )
+    parser.add_argument(
+        "--user",
+        help="The username of the mock",
+        required=False,
+        dest="user",
+        default="scrbl",
+    )
+    parser.add_argument(
+        "--scrobbles",
+        help="The number of plays of the in-process mock",
+        required=False,
+        dest="scrobbles",
+        type=int,
+        default=20_000,
+    )
+    parser.add_argument(
+        "--latency",
+        help="The minimum response time of the in-process mock in milliseconds",
+        required=False,
+        dest="latency",
+        type=float,
+        default=50,
+    )
+    parser.add_argument(
+        "--jitter",
+        help="The maximum random delay added by the in-process mock in milliseconds",
+        required=False,
+        dest="jitter",
+        type=float,
+        default=50,
+    )
+    parser.add_argument(
+        "--error-rate",
+        help="The share of requests the in-process mock fails with error 29",
+        required=False,
+        dest="error_rate",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--rate-limit",
+        help="The requests per second the in-process mock accepts",
+        required=False,
+        dest="rate_limit",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--concurrency",
+        help="The number of pages to fetch in parallel",
+        required=False,
+        dest="concurrency",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--rate",
+        help="The maximum number of requests per second, or the initial rate with --adaptive",
+        required=False,
+        dest="rate",
+        type=float,
+        default=20,
+    )
+    parser.add_argument(
+        "--adaptive",
+        help="Adapt the request rate to rate limit errors and response times",
+        required=False,
+        dest="adaptive",
+        action="store_true",
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    transport: AsyncBaseTransport
+    if args.base_url is None:
+        base_url = "http://mock.last.fm/"
+        transport = ASGITransport(
+            app=create_app(
+                MockConfig(
+                    api_key=args.api_key,
+                    secret=args.secret,
+                    user=args.user,
+                    scrobbles=args.scrobbles,
+                    latency=args.latency / 1000,
+                    jitter=args.jitter / 1000,
+                    error_rate=args.error_rate,
+                    rate_limit=args.rate_limit,
+                )
+            )
+        )
+    else:
+        base_url = args.base_url
+        transport = AsyncHTTPTransport(
+            limits=Limits(
+                max_connections=args.concurrency,
+                max_keepalive_connections=args.concurrency,
+            )
+        )
+
+    limiter = (
+        AdaptiveRateLimiter(args.rate) if args.adaptive else RateLimiter(args.rate)
+    )
+
+    result = asyncio.run(
+        run(
+            transport,
+            base_url,
+            args.api_key,
+            args.secret,
+            args.user,
+            datetime(1970, 1, 1, tzinfo=timezone.utc),
+            datetime.now(timezone.utc),
+            args.concurrency,
+            limiter,
+        )
+    )
+    report(result)
+
+
+if __name__ == "__main__":
+    main()
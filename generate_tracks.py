@@ -0,0 +1,362 @@
+import argparse
+import json
+import logging
+import os
+import random
+import uuid
+from collections.abc import Iterator
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice
+from typing import Any, Optional
+
+from download_tracks import file_name
+
+IMAGE_SIZES = ["small", "medium", "large", "extralarge"]
+
+
+@dataclass
+class Catalogue:
+    """
+    The artists, albums and tracks that synthetic listening histories are drawn from.
+
+    `albums[artist]` holds the albums of an artist as JSON-ready dicts, and
+    `tracks[artist][album]` the track dicts of an album, without their date.
+    """
+
+    artists: list[dict[str, str]]
+    albums: list[list[dict[str, str]]]
+    tracks: list[list[list[dict[str, Any]]]]
+
+
+def zipf_weights(n: int, exponent: float) -> list[float]:
+    """
+    Return the cumulative weights of ranks 1 to n under Zipf's law, for random.choices.
+    """
+    return list(accumulate(1 / rank**exponent for rank in range(1, n + 1)))
+
+
+def mbid(rng: random.Random, empty_mbid_rate: float) -> str:
+    if rng.random() < empty_mbid_rate:
+        return ""
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def create_catalogue(
+    rng: random.Random,
+    artists: int,
+    albums_per_artist: int,
+    tracks_per_album: int,
+    empty_mbid_rate: float,
+    no_album_rate: float,
+) -> Catalogue:
+    catalogue = Catalogue([], [], [])
+
+    for a in range(artists):
+        artist_name = f"Artist {a}"
+        artist = {"mbid": mbid(rng, empty_mbid_rate), "#text": artist_name}
+        catalogue.artists.append(artist)
+        catalogue.albums.append([])
+        catalogue.tracks.append([])
+
+        for b in range(albums_per_artist):
+            if rng.random() < no_album_rate:
+                album = {"mbid": "", "#text": ""}
+            else:
+                album = {"mbid": mbid(rng, empty_mbid_rate), "#text": f"Album {a}-{b}"}
+
+            art = f"{rng.getrandbits(128):032x}"
+            images = [
+                {
+                    "size": size,
+                    "#text": f"https://lastfm.freetls.fastly.net/i/u/{size}/{art}.png",
+                }
+                for size in IMAGE_SIZES
+            ]
+
+            catalogue.albums[a].append(album)
+            catalogue.tracks[a].append(
+                [
+                    {
+                        "artist": artist,
+                        "streamable": "0",
+                        "image": images,
+                        # Last.fm rarely knows the MBID of a track
+                        "mbid": mbid(rng, max(empty_mbid_rate, 0.8)),
+                        "album": album,
+                        "name": f"Track {a}-{b}-{t}",
+                        "url": f"https://www.last.fm/music/Artist+{a}/_/Track+{a}-{b}-{t}",
+                    }
+                    for t in range(tracks_per_album)
+                ]
+            )
+
+    return catalogue
+
+
+def generate_plays(
+    rng: random.Random,
+    catalogue: Catalogue,
+    scrobbles: int,
+    date_from: datetime,
+    date_to: datetime,
+    exponent: float,
+) -> Iterator[dict[str, Any]]:
+    """
+    Yield the plays of one listener, newest first, as Last.fm returns them.
+
+    Artists are picked by a Zipf distribution over a ranking of the catalogue
+    that is shuffled per listener, and an album of the artist by a Zipf
+    distribution over its albums. Each pick plays a run of consecutive tracks
+    of the album, usually from the start. Plays are generated lazily, so
+    memory does not grow with the number of scrobbles beyond their times.
+    """
+    ranking = list(range(len(catalogue.artists)))
+    rng.shuffle(ranking)
+    artist_weights = zipf_weights(len(ranking), exponent)
+    album_weights = zipf_weights(len(catalogue.albums[0]), exponent)
+
+    start, end = int(date_from.timestamp()), int(date_to.timestamp())
+    times = sorted((rng.randrange(start, end) for _ in range(scrobbles)), reverse=True)
+
+    played = 0
+    while played < scrobbles:
+        (rank,) = rng.choices(range(len(ranking)), cum_weights=artist_weights)
+        artist = ranking[rank]
+        (album,) = rng.choices(range(len(album_weights)), cum_weights=album_weights)
+        album_tracks = catalogue.tracks[artist][album]
+
+        first = 0 if rng.random() < 0.7 else rng.randrange(len(album_tracks))
+        length = min(rng.randint(1, len(album_tracks) - first), scrobbles - played)
+
+        # Walking back in time, the run is played from its last track
+        for track in reversed(album_tracks[first : first + length]):
+            uts = times[played]
+            played += 1
+            played_at = datetime.fromtimestamp(uts, tz=timezone.utc)
+            yield {
+                **track,
+                "date": {
+                    "uts": str(uts),
+                    "#text": played_at.strftime("%d %b %Y, %H:%M"),
+                },
+            }
+
+
+def write_pages(
+    dest_dir: str,
+    user: str,
+    plays: Iterator[dict[str, Any]],
+    total: int,
+    date_from: datetime,
+    date_to: datetime,
+    page_size: int = 200,
+) -> list[str]:
+    """
+    Write `total` plays, newest first, as getRecentTracks pages named as the downloader names them.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+
+    total_pages = max(1, -(-total // page_size))
+    files = []
+
+    for page in range(1, total_pages + 1):
+        data = {
+            "recenttracks": {
+                "track": list(islice(plays, page_size)),
+                "@attr": {
+                    "user": user,
+                    "totalPages": str(total_pages),
+                    "page": str(page),
+                    "perPage": str(page_size),
+                    "total": str(total),
+                },
+            }
+        }
+        path = os.path.join(dest_dir, file_name(date_from, date_to, page))
+        with open(path, "w") as f:
+            json.dump(data, f)
+        files.append(path)
+
+    return files
+
+
+def generate(
+    dest_dir: str,
+    scrobbles: int,
+    users: int = 1,
+    years: float = 5,
+    artists: int = 2000,
+    albums_per_artist: int = 8,
+    tracks_per_album: int = 12,
+    exponent: float = 1.1,
+    empty_mbid_rate: float = 0.15,
+    no_album_rate: float = 0.02,
+    page_size: int = 200,
+    seed: int = 0,
+    date_to: Optional[datetime] = None,
+) -> dict[str, list[str]]:
+    """
+    Write the listening histories of synthetic users and return the files of every user.
+
+    With more than one user, every user gets a subdirectory named after them.
+    The same seed always generates the same files.
+    """
+    rng = random.Random(seed)
+    catalogue = create_catalogue(
+        rng,
+        artists,
+        albums_per_artist,
+        tracks_per_album,
+        empty_mbid_rate,
+        no_album_rate,
+    )
+
+    if date_to is None:
+        date_to = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    date_from = date_to - timedelta(days=365.25 * years)
+
+    files = {}
+    for u in range(users):
+        user = f"user{u}"
+        user_dir = dest_dir if users == 1 else os.path.join(dest_dir, user)
+        plays = generate_plays(
+            random.Random(f"{seed}-{user}"),
+            catalogue,
+            scrobbles,
+            date_from,
+            date_to,
+            exponent,
+        )
+        files[user] = write_pages(
+            user_dir, user, plays, scrobbles, date_from, date_to, page_size=page_size
+        )
+
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic Last.fm listening histories as downloaded page files."
+    )
+    parser.add_argument(
+        "--dest-dir",
+        help="The directory to write the page files to",
+        required=True,
+        dest="dest_dir",
+    )
+    parser.add_argument(
+        "--scrobbles",
+        help="The number of plays per user",
+        required=False,
+        dest="scrobbles",
+        type=int,
+        default=100_000,
+    )
+    parser.add_argument(
+        "--users",
+        help="The number of users. With more than one, every user gets a subdirectory",
+        required=False,
+        dest="users",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--years",
+        help="The number of years the plays are spread over",
+        required=False,
+        dest="years",
+        type=float,
+        default=5,
+    )
+    parser.add_argument(
+        "--artists",
+        help="The number of artists in the catalogue",
+        required=False,
+        dest="artists",
+        type=int,
+        default=2000,
+    )
+    parser.add_argument(
+        "--albums-per-artist",
+        help="The number of albums of every artist",
+        required=False,
+        dest="albums_per_artist",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "--tracks-per-album",
+        help="The number of tracks of every album",
+        required=False,
+        dest="tracks_per_album",
+        type=int,
+        default=12,
+    )
+    parser.add_argument(
+        "--zipf",
+        help="The exponent of the Zipf distributions of artists and albums",
+        required=False,
+        dest="exponent",
+        type=float,
+        default=1.1,
+    )
+    parser.add_argument(
+        "--empty-mbid-rate",
+        help="The share of artists and albums without an MBID",
+        required=False,
+        dest="empty_mbid_rate",
+        type=float,
+        default=0.15,
+    )
+    parser.add_argument(
+        "--no-album-rate",
+        help="The share of albums without an MBID or a name",
+        required=False,
+        dest="no_album_rate",
+        type=float,
+        default=0.02,
+    )
+    parser.add_argument(
+        "--page-size",
+        help="The number of tracks per page",
+        required=False,
+        dest="page_size",
+        type=int,
+        default=200,
+    )
+    parser.add_argument(
+        "--seed",
+        help="The seed of the random generator",
+        required=False,
+        dest="seed",
+        type=int,
+        default=0,
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    files = generate(
+        args.dest_dir,
+        args.scrobbles,
+        users=args.users,
+        years=args.years,
+        artists=args.artists,
+        albums_per_artist=args.albums_per_artist,
+        tracks_per_album=args.tracks_per_album,
+        exponent=args.exponent,
+        empty_mbid_rate=args.empty_mbid_rate,
+        no_album_rate=args.no_album_rate,
+        page_size=args.page_size,
+        seed=args.seed,
+    )
+
+    logging.getLogger(__name__).info(
+        f"Wrote {sum(len(f) for f in files.values())} page files for {len(files)} users"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import json
+
+from generate_tracks import generate
+from util import load_tracks_data
+
+
+def test_generated_pages_load_as_a_listening_history(tmp_path):
+    files = generate(str(tmp_path), 450, artists=20, empty_mbid_rate=0.5, seed=1)[
+        "user0"
+    ]
+
+    with open(files[0]) as f:
+        first_page = json.load(f)["recenttracks"]
+    tracks = load_tracks_data(str(tmp_path), workers=1)
+    times = [int(t["date"]["uts"]) for t in first_page["track"]]
+
+    assert len(files) == 3
+    assert first_page["@attr"]["totalPages"] == "3"
+    assert times == sorted(times, reverse=True)
+    assert len(tracks) == 450
+    assert any(track.album.mbid == "" for track in tracks)
+    assert any(track.album.mbid != "" for track in tracks)
+
+
+def test_generation_is_repeatable_per_seed(tmp_path):
+    first = generate(str(tmp_path / "a"), 10, artists=5, seed=3)["user0"]
+    second = generate(str(tmp_path / "b"), 10, artists=5, seed=3)["user0"]
+
+    with open(first[0]) as a, open(second[0]) as b:
+        assert a.read() == b.read()
+
+
+def test_every_user_gets_a_directory(tmp_path):
+    files = generate(str(tmp_path), 10, users=2, artists=5)
+
+    assert sorted(files) == ["user0", "user1"]
+    assert (tmp_path / "user1").is_dir()
@@ -1,8 +1,38 @@
 from io import StringIO
 from hashlib import md5
-from httpx import Client, Request
+from httpx import AsyncClient, Client, Limits, Request, Response
 from typing import Any, Mapping, Optional
-from last_fm_model import Method
+from last_fm_model import Error, ErrorCode, Method
+
+TRANSIENT_ERRORS = {
+    ErrorCode.operation_failed,
+    ErrorCode.service_offline,
+    ErrorCode.temporarily_unavailable,
+}
+
+
+class LastFmError(Exception):
+    """
+    An error response from the Last.fm API, either an error payload or a bare HTTP error status.
+    """
+
+    def __init__(self, status_code: int, error: Optional[int], message: str):
+        super().__init__(f"{message} (status {status_code}, error {error})")
+        self.status_code = status_code
+        self.error = error
+        self.message = message
+
+    @property
+    def rate_limited(self) -> bool:
+        return self.status_code == 429 or self.error == ErrorCode.rate_limit_exceeded
+
+    @property
+    def retryable(self) -> bool:
+        return (
+            self.rate_limited
+            or self.status_code >= 500
+            or self.error in TRANSIENT_ERRORS
+        )
 
 
 def create_unauthorized_client(base_url: str, api_key: str) -> Client:
@@ -19,8 +49,21 @@ def create_authorized_client(base_url: str, api_key: str, session_key: str) -> C
     )
 
 
+def create_async_authorized_client(
+    base_url: str, api_key: str, session_key: str, max_connections: int = 10
+) -> AsyncClient:
+    return AsyncClient(
+        base_url=base_url,
+        params={"api_key": api_key, "sk": session_key, "format": "json"},
+        limits=Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+    )
+
+
 def create_signed_get_request(
-    client: Client,
+    client: Client | AsyncClient,
     method: Method,
     secret: str,
     params: Optional[Mapping[str, Any]] = None,
@@ -60,3 +103,24 @@ def sign(params: dict[str, str], secret: str) -> str:
     hasher = md5()
     hasher.update(message_bytes)
     return hasher.hexdigest()
+
+
+def check_response(res: Response) -> Any:
+    """
+    Return the decoded body of a successful response.
+
+    Raise a LastFmError if the body is an error payload or the status is an HTTP error.
+    """
+    try:
+        body = res.json()
+    except ValueError:
+        body = None
+
+    if isinstance(body, dict) and "error" in body:
+        error = Error(**body)
+        raise LastFmError(res.status_code, error.error, error.message)
+
+    if res.is_error or body is None:
+        raise LastFmError(res.status_code, None, res.reason_phrase)
+
+    return body
@@ -1,8 +1,8 @@
-from enum import StrEnum
+from enum import IntEnum, StrEnum
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Literal
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 from pydantic.dataclasses import dataclass as pydantic_dataclass
 
 
@@ -12,6 +12,23 @@ class Method(StrEnum):
     auth_get_session = "auth.getSession"
 
 
+class ErrorCode(IntEnum):
+    """
+    Error codes that callers react to or the mock answers with.
+    See https://www.last.fm/api/errorcodes
+    """
+
+    invalid_method = 3
+    invalid_parameters = 6
+    operation_failed = 8
+    invalid_api_key = 10
+    service_offline = 11
+    invalid_signature = 13
+    unauthorized_token = 14
+    temporarily_unavailable = 16
+    rate_limit_exceeded = 29
+
+
 @pydantic_dataclass(frozen=True)
 class Error:
     error: int
@@ -135,3 +152,8 @@ class Tracklist:
 @pydantic_dataclass(frozen=True)
 class GetRecentTracksOutput:
     recent_tracks: Tracklist = Field(alias="recenttracks")
+
+
+# Validators for raw JSON bytes. Building an adapter is expensive, so they are created once.
+RECENT_TRACKS_ADAPTER = TypeAdapter(GetRecentTracksOutput)
+TRACK_ADAPTER = TypeAdapter(Track)
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import os
+import time
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from watchfiles import awatch
+
+from approx_stats import ApproxStats
+from last_fm_model import Track
+from rollups import Rollups
+from shared_store import load_shared
+from snapshot import load_with_snapshot
+from sqlite_store import SqliteTracks, connect, ingest
+from store import Store
+from track_store import TrackStore
+from util import file_key, load_track_files, load_track_store, tracks_files
+
+
+def scan(dir: str) -> dict[str, tuple[int, int]]:
+    """
+    Return the modification time and size of every tracks file in the directory.
+    """
+    keys = {}
+    if not os.path.isdir(dir):
+        return keys
+
+    for tracks_file in tracks_files(dir):
+        try:
+            keys[tracks_file] = file_key(tracks_file)
+        except FileNotFoundError:
+            pass
+    return keys
+
+
+def is_tracks_file(change, path: str) -> bool:
+    return os.path.basename(path).startswith("tracks_")
+
+
+@dataclass
+class LoadProgress:
+    """
+    How far the first load of a library got. `error` is set if it failed.
+    """
+
+    files: int = 0
+    files_loaded: int = 0
+    tracks_loaded: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+class Library:
+    """
+    The tracks of a data directory, their album index, rollups and approximate
+    stats, kept up to date while the app runs.
+
+    New files are parsed on a worker thread and their rows are appended to the
+    store and the index on the event loop, so requests never see a half merged
+    state. Rows older than stored ones are sorted in, and only the rows from
+    the earliest new one on are indexed again, so the work is proportional to
+    the new tracks and the ones played after them. Changed and removed files
+    are rare; they trigger a reload from the snapshot on a worker thread, and
+    the new tracks and index are swapped in together. `version` changes with
+    every update.
+
+    With a database, the files are ingested into it and the index is rebuilt.
+
+    With `date_from` or `date_to`, only the tracks played between them are
+    loaded, opening only the catalogued segments of the range, and every
+    update reloads the range.
+
+    With `shared`, the tracks, the index, the rollups and the approximate stats
+    are attached from a memory-mapped dataset that processes serving the same
+    directory build once and share, and every update attaches to a rebuilt dataset.
+    """
+
+    def __init__(
+        self,
+        dir: str,
+        database: Optional[str] = None,
+        workers: Optional[int] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        shared: bool = False,
+    ):
+        if shared and (database or date_from or date_to):
+            raise ValueError("A shared library cannot use a database or a date range")
+
+        self.dir = dir
+        self.database = database
+        self.workers = workers
+        self.date_from = date_from
+        self.date_to = date_to
+        self.shared = shared
+        self.version = 0
+        # The duration of the last full load and of the last refresh, in seconds
+        self.load_seconds = 0.0
+        self.refresh_seconds = 0.0
+        self.files: dict[str, tuple[int, int]] = {}
+        self.progress = LoadProgress()
+        self.tracks: Sequence[Track] = TrackStore()
+        self.store = Store(self.tracks)
+        self.rollups = Rollups(self.tracks)
+        self.approx = ApproxStats()
+
+    @property
+    def ready(self) -> bool:
+        """
+        Whether the tracks were loaded, so requests can be answered.
+        """
+        return self.version > 0
+
+    def load(self):
+        """
+        Load every tracks file and build the index. Blocks until done.
+
+        `progress` is updated while the files are parsed, so the load can run on
+        a worker thread while the event loop reports how far it got.
+        """
+        start = time.perf_counter()
+        files = scan(self.dir)
+        self.progress = LoadProgress(files=len(files))
+
+        def report(files_loaded: int, tracks_loaded: int):
+            self.progress.files_loaded = files_loaded
+            self.progress.tracks_loaded = tracks_loaded
+            self.progress.seconds = time.perf_counter() - start
+
+        try:
+            loaded = self._load(progress=report)
+        except Exception as e:
+            self.progress.error = str(e) or type(e).__name__
+            raise
+
+        self._swap(*loaded, files)
+        self.load_seconds = time.perf_counter() - start
+        report(len(files), len(self.tracks))
+
+    @property
+    def windowed(self) -> bool:
+        return self.date_from is not None or self.date_to is not None
+
+    def _load(
+        self, progress: Optional[Callable[[int, int], None]] = None
+    ) -> tuple[Sequence[Track], Store, Rollups, ApproxStats]:
+        """
+        Load the tracks and build their index, rollups and approximate stats.
+
+        A shared library attaches to all four, as written in the shared dataset.
+        """
+        if self.shared:
+            return load_shared(self.dir, workers=self.workers)
+
+        tracks, store = self._load_index(progress)
+        approx = ApproxStats()
+        approx.update(tracks)
+        return tracks, store, Rollups(tracks), approx
+
+    def _load_index(
+        self, progress: Optional[Callable[[int, int], None]] = None
+    ) -> tuple[Sequence[Track], Store]:
+        if self.database:
+            if os.path.isdir(self.dir):
+                connection = connect(self.database)
+                ingest(connection, self.dir)
+                connection.close()
+            tracks = SqliteTracks.open(self.database)
+        elif self.windowed:
+            tracks = load_track_store(
+                self.dir,
+                workers=self.workers,
+                date_from=self.date_from,
+                date_to=self.date_to,
+                progress=progress,
+            )
+        else:
+            tracks = load_with_snapshot(
+                self.dir, workers=self.workers, progress=progress
+            )
+
+        return tracks, Store(tracks)
+
+    def _swap(
+        self,
+        tracks: Sequence[Track],
+        store: Store,
+        rollups: Rollups,
+        approx: ApproxStats,
+        files: dict[str, tuple[int, int]],
+    ):
+        self.tracks = tracks
+        self.store = store
+        self.rollups = rollups
+        self.approx = approx
+        self.files = files
+        self.version += 1
+
+    async def refresh(self):
+        """
+        Bring the tracks and the index up to date with the files in the directory.
+        """
+        logger = logging.getLogger(__name__)
+
+        files = await asyncio.to_thread(scan, self.dir)
+        added = [f for f in files if f not in self.files]
+        changed = [f for f in files if f in self.files and files[f] != self.files[f]]
+        removed = [f for f in self.files if f not in files]
+
+        if not (added or changed or removed):
+            return
+
+        logger.info(
+            f"{len(added)} tracks files added, {len(changed)} changed, {len(removed)} removed"
+        )
+        start = time.perf_counter()
+
+        if (
+            isinstance(self.tracks, TrackStore)
+            and not (self.windowed or self.shared)
+            and added
+            and not (changed or removed)
+        ):
+            parsed, _ = await asyncio.to_thread(
+                load_track_files, added, workers=self.workers
+            )
+            parsed.sort()
+
+            self._append(parsed, {**self.files, **{f: files[f] for f in added}})
+            self.refresh_seconds = time.perf_counter() - start
+            logger.info(f"Added {len(parsed)} tracks")
+            return
+
+        self._swap(*await asyncio.to_thread(self._load), files)
+        self.refresh_seconds = self.load_seconds = time.perf_counter() - start
+        logger.info(f"Reloaded {len(self.tracks)} tracks")
+
+    def _append(self, parsed: TrackStore, files: dict[str, tuple[int, int]]):
+        start = len(self.tracks)
+        self.tracks.extend_store(parsed)
+
+        # The rollups and sketches do not depend on the order of the rows, so
+        # they take the new rows before they are sorted in
+        self.rollups.update()
+        self.approx.update(self.tracks, start)
+
+        # Pages are downloaded newest first, so new rows are often older than
+        # stored ones. Only the rows from the earliest new one on are sorted
+        # and indexed again.
+        self.store.reindex(self.tracks.sort())
+        self.files = files
+        self.version += 1
+
+    async def watch(self):
+        """
+        Refresh whenever a tracks file in the directory is written or removed.
+        """
+        logger = logging.getLogger(__name__)
+
+        async for _ in awatch(self.dir, watch_filter=is_tracks_file):
+            try:
+                await self.refresh()
+            except Exception:
+                # A file that is still being written is retried on the next change
+                logger.exception("Failed to refresh the tracks")
@@ -0,0 +1,61 @@
+import asyncio
+import os
+
+from library import Library
+from rollups import Rollups
+from store import Store
+
+
+def test_library_appends_new_files_and_reloads_changed_ones(tmp_path, write_page):
+    write_page(tmp_path, "tracks_0001.json", [1711782712, 1711788633])
+    library = Library(str(tmp_path), workers=1)
+    library.load()
+    tracks = library.tracks
+
+    write_page(tmp_path, "tracks_0002.json", [1711790000])
+    asyncio.run(library.refresh())
+
+    assert library.tracks is tracks
+    assert library.store.indexed == len(tracks) == 3
+    assert library.version == 2
+
+    write_page(tmp_path, "tracks_0003.json", [1711785000, 1711700000])
+    asyncio.run(library.refresh())
+
+    assert library.tracks is tracks
+    assert [int(t.timestamp.time.timestamp()) for t in library.tracks] == [
+        1711700000,
+        1711782712,
+        1711785000,
+        1711788633,
+        1711790000,
+    ]
+    rebuilt = Store(tracks)
+    assert library.store.indexed == 5
+    assert {
+        album: (s.playcount, s.first_played, s.last_played, list(s.positions))
+        for album, s in library.store._stats.items()
+    } == {
+        album: (s.playcount, s.first_played, s.last_played, list(s.positions))
+        for album, s in rebuilt._stats.items()
+    }
+    assert library.rollups.buckets == Rollups(tracks).buckets
+
+    os.remove(tmp_path / "tracks_0001.json")
+    asyncio.run(library.refresh())
+
+    assert len(library.tracks) == 3
+    assert library.store.indexed == 3
+
+
+def test_shared_library_reloads_from_the_shared_dataset(tmp_path, write_page):
+    write_page(tmp_path, "tracks_0001.json", [1711782712, 1711788633])
+    library = Library(str(tmp_path), workers=1, shared=True)
+    library.load()
+
+    write_page(tmp_path, "tracks_0002.json", [1711790000])
+    asyncio.run(library.refresh())
+
+    assert len(library.tracks) == 3
+    assert library.store.indexed == 3
+    assert library.version == 2
@@ -1,91 +1,398 @@
-from dataclasses import dataclass
-from datetime import datetime
+import asyncio
+import logging
+import os
+from dataclasses import asdict
+from contextlib import asynccontextmanager, suppress
+from datetime import date, datetime, time, timezone
+from functools import partial
+from typing import Annotated, Any, Optional
 
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import Depends, FastAPI, Query, Request, Response, HTTPException
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
+from pydantic import AfterValidator, BeforeValidator
 
 from last_fm_model import Album, Track
-from stats import first_and_last_listen, tracks_in_album, unique_albums
-from util import load_tracks_data
+from approx_stats import ApproximateCount
+from library import Library
+from metrics import CONTENT_TYPE, Gauge, MetricsMiddleware, Registry
+from response_cache import ResponseCache
+from rollups import GRANULARITIES, AlbumPlaycount, TimelinePoint
+from store import AlbumComparison, AlbumDetails
+from util import as_utc
 
 
-@dataclass
-class AlbumSummary:
-    mbid: str
-    name: str
+def env_date(name: str, at: time) -> Optional[datetime]:
+    value = os.getenv(name)
+    if not value:
+        return None
+    return datetime.combine(date.fromisoformat(value), at, tzinfo=timezone.utc)
 
 
-@dataclass
-class AlbumDetails:
-    name: str
-    mbid: str
-    first_listen: datetime
-    last_listen: datetime
-    total_playcount: int
+def day_bound(value: Any, at: time) -> Any:
+    """
+    Read a query value that is a date without a time as that time of its day, in UTC.
+    """
+    if isinstance(value, str):
+        try:
+            return datetime.combine(date.fromisoformat(value), at, tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return value
 
 
-class Store:
-    def __init__(self, tracks: list[Track]):
-        self.tracks = tracks
+# Query times without a time zone are UTC, like the plays. A date alone is the
+# start of its day at the start of a range, and the end of its day at the end.
+StartTime = Annotated[
+    datetime, BeforeValidator(partial(day_bound, at=time.min)), AfterValidator(as_utc)
+]
+EndTime = Annotated[
+    datetime, BeforeValidator(partial(day_bound, at=time.max)), AfterValidator(as_utc)
+]
 
-        self.albums = {
-            album.mbid: AlbumSummary(album.mbid, album.name)
-            for album in unique_albums(tracks)
-            if album.mbid != "" and album.name != ""
-        }
 
+# Set DATABASE to a file written by sqlite_store.py to answer from disk instead of memory.
+# Set DATE_FROM and DATE_TO (YYYY-MM-DD) to load only the plays of a range.
+# Set SHARED=1 to share one memory-mapped copy of the tracks between uvicorn workers.
+library = Library(
+    os.getenv("DATA_DIR", "data"),
+    database=os.getenv("DATABASE"),
+    date_from=env_date("DATE_FROM", time.min),
+    date_to=env_date("DATE_TO", time.max),
+    shared=os.getenv("SHARED") == "1",
+)
 
-tracks = load_tracks_data("data")
 
-albums = list(
-    album for album in unique_albums(tracks) if album.mbid != "" and album.name != ""
-)
+templates = Jinja2Templates(directory="templates")
 
+# Encoded responses for the current version of the library
+responses = ResponseCache(max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")))
 
-def by_playcount(album: Album):
-    return len(tracks_in_album(tracks, album))
+# The number of albums in the first page of the album list and in every page loaded after it
+ALBUM_PAGE_SIZE = 100
 
 
-albums.sort(key=by_playcount, reverse=True)
+# The number of seconds clients are asked to wait while the tracks are loading
+RETRY_AFTER_SECONDS = 5
 
 
-templates = Jinja2Templates(directory="templates")
+async def load_and_watch():
+    """
+    Load the tracks on a worker thread, then keep them up to date with the data directory.
+    """
+    try:
+        await asyncio.to_thread(library.load)
+    except Exception:
+        logging.getLogger(__name__).exception("Failed to load the tracks")
+        return
+
+    # Set WATCH=0 to only read the data directory at startup
+    if os.getenv("WATCH", "1") != "0" and os.path.isdir(library.dir):
+        await library.watch()
+
+
+@asynccontextmanager
+async def lifespan(api: FastAPI):
+    # The server starts listening at once, and /readyz reports when the tracks are loaded
+    loader = asyncio.create_task(load_and_watch())
+
+    yield
+
+    # Wait for the load or the watch to stop, so neither outlives the app
+    loader.cancel()
+    with suppress(asyncio.CancelledError):
+        await loader
 
 
-api = FastAPI()
+def require_ready():
+    if not library.ready:
+        raise HTTPException(
+            status_code=503,
+            detail="The tracks are loading",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
 
 
-@api.get("/")
-async def home(request: Request) -> HTMLResponse:
-    return templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "albums": [AlbumSummary(album.mbid, album.name) for album in albums],
-        },
+api = FastAPI(lifespan=lifespan)
+
+# The routes that answer from the tracks
+ready = [Depends(require_ready)]
+
+metrics = Registry()
+api.add_middleware(MetricsMiddleware, registry=metrics)
+
+metrics.register(
+    Gauge(
+        "rechord_ready",
+        "Whether the tracks are loaded",
+        function=lambda: int(library.ready),
+    )
+)
+metrics.register(
+    Gauge(
+        "rechord_tracks", "The number of tracks", function=lambda: len(library.tracks)
+    )
+)
+metrics.register(
+    Gauge(
+        "rechord_albums",
+        "The number of ranked albums",
+        function=lambda: len(library.store),
     )
+)
+metrics.register(
+    Gauge(
+        "rechord_load_duration_seconds",
+        "The duration of the last full load of the tracks",
+        function=lambda: library.load_seconds,
+    )
+)
+metrics.register(
+    Gauge(
+        "rechord_refresh_duration_seconds",
+        "The duration of the last refresh of the tracks",
+        function=lambda: library.refresh_seconds,
+    )
+)
+metrics.register(
+    Gauge(
+        "rechord_library_version",
+        "The version of the tracks, which changes with every refresh",
+        function=lambda: library.version,
+    )
+)
+metrics.register(
+    Gauge(
+        "rechord_cached_responses",
+        "The number of encoded responses in the cache",
+        function=lambda: len(responses.entries),
+    )
+)
 
 
-@api.get("/albums")
-async def albums_index():
-    return albums
+@api.get("/metrics", response_class=PlainTextResponse)
+async def metrics_index() -> Response:
+    return Response(metrics.exposition(), media_type=CONTENT_TYPE)
 
 
-@api.get("/albums/{album_id}")
-async def album_details(album_id: str) -> AlbumDetails:
-    album = next((album for album in albums if album.mbid == album_id), None)
+@api.get("/healthz")
+async def healthz() -> dict[str, str]:
+    return {"status": "ok"}
 
-    if not album:
-        raise HTTPException(status_code=404, detail="Album not found")
 
-    album_tracks = tracks_in_album(tracks, album)
-    first, last = first_and_last_listen(album_tracks)
+@api.get("/readyz")
+async def readyz() -> JSONResponse:
+    """
+    Answer 200 once the tracks are loaded and 503 before, with the progress of the load.
+    """
+    return JSONResponse(
+        {"ready": library.ready, **asdict(library.progress)},
+        status_code=200 if library.ready else 503,
+        headers={} if library.ready else {"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
 
-    return AlbumDetails(
-        name=album.name,
-        mbid=album.mbid,
-        first_listen=first,
-        last_listen=last,
-        total_playcount=len(album_tracks),
+def render_albums(template: str, cursor: int) -> bytes:
+    """
+    Render a page of the album ranking, ending with a sentinel that loads the next page when revealed.
+    """
+    summaries = library.store.summaries
+    end = cursor + ALBUM_PAGE_SIZE
+
+    return (
+        templates.get_template(template)
+        .render(
+            albums=summaries[cursor:end],
+            next_cursor=end if end < len(summaries) else None,
+        )
+        .encode("utf-8")
     )
+
+
+@api.get("/", response_class=HTMLResponse, dependencies=ready)
+async def home(request: Request) -> Response:
+    return responses.get(
+        library.version,
+        ("home",),
+        lambda: render_albums("index.html", 0),
+        media_type="text/html",
+    ).response(request)
+
+
+@api.get("/fragments/albums", response_class=HTMLResponse, dependencies=ready)
+async def albums_fragment(
+    request: Request, cursor: Annotated[int, Query(ge=0)] = 0
+) -> Response:
+    return responses.get(
+        library.version,
+        ("albums_fragment", cursor),
+        lambda: render_albums("album_list.html", cursor),
+        media_type="text/html",
+    ).response(request)
+
+
+@api.get("/tracks", dependencies=ready)
+async def tracks_index(
+    date_from: Annotated[StartTime, Query(alias="from")],
+    date_to: Annotated[EndTime, Query(alias="to")],
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 200,
+) -> list[Track]:
+    window = library.store.tracks_between(date_from, date_to)
+    return list(window[offset : offset + limit])
+
+
+@api.get("/albums", response_model=list[Album], dependencies=ready)
+async def albums_index(
+    request: Request,
+    date_from: Annotated[Optional[StartTime], Query(alias="from")] = None,
+    date_to: Annotated[Optional[EndTime], Query(alias="to")] = None,
+) -> Response:
+    store = library.store
+
+    def build() -> list[Album]:
+        if date_from is None and date_to is None:
+            return store.ranked_albums
+
+        return [
+            album
+            for album, _ in store.albums_between(
+                date_from or datetime.min.replace(tzinfo=timezone.utc),
+                date_to or datetime.max.replace(tzinfo=timezone.utc),
+            )
+        ]
+
+    return responses.get(
+        library.version, ("albums", date_from, date_to), build, list[Album]
+    ).response(request)
+
+
+@api.get("/albums/compare", response_model=list[AlbumComparison], dependencies=ready)
+async def albums_compare(
+    request: Request,
+    date_from: Annotated[StartTime, Query(alias="from")],
+    date_to: Annotated[EndTime, Query(alias="to")],
+    limit: Annotated[int, Query(ge=1, le=1000)] = 50,
+) -> Response:
+    store = library.store
+
+    def build() -> list[AlbumComparison]:
+        return store.compare_periods(date_from, date_to)[:limit]
+
+    return responses.get(
+        library.version,
+        ("compare", date_from, date_to, limit),
+        build,
+        list[AlbumComparison],
+    ).response(request)
+
+
+@api.get("/albums/top", response_model=list[AlbumPlaycount], dependencies=ready)
+async def albums_top(
+    request: Request,
+    period: Annotated[
+        Optional[str], Query(pattern=r"^\d{4}(-\d{2}(-\d{2})?)?$")
+    ] = None,
+    date_from: Annotated[Optional[date], Query(alias="from")] = None,
+    date_to: Annotated[Optional[date], Query(alias="to")] = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+) -> Response:
+    """
+    Rank the albums of a year, month or day (period=2023, 2023-05 or 2023-05-14)
+    or of the days between two dates, from the rollups.
+    """
+    rollups = library.rollups
+
+    def build() -> list[AlbumPlaycount]:
+        if period is None and (date_from is None or date_to is None):
+            raise HTTPException(status_code=422, detail="Pass a period, or from and to")
+
+        try:
+            if period is not None:
+                return rollups.top_of_period(period, limit)
+            return rollups.top(date_from, date_to, limit)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    return responses.get(
+        library.version,
+        ("top", period, date_from, date_to, limit),
+        build,
+        list[AlbumPlaycount],
+    ).response(request)
+
+
+@api.get(
+    "/albums/approximate",
+    response_model=list[ApproximateCount],
+    dependencies=ready,
+)
+async def albums_approximate(
+    request: Request, limit: Annotated[int, Query(ge=1, le=1000)] = 100
+) -> Response:
+    """
+    Rank the most played albums from fixed-size sketches. See approx_stats.
+    """
+
+    def build() -> list[ApproximateCount]:
+        return library.approx.top_albums(limit)
+
+    return responses.get(
+        library.version,
+        ("approximate", limit),
+        build,
+        list[ApproximateCount],
+    ).response(request)
+
+
+@api.get("/albums/{album_id}", response_model=AlbumDetails, dependencies=ready)
+async def album_details(request: Request, album_id: str) -> Response:
+    store = library.store
+
+    def build() -> AlbumDetails:
+        details = store.details(album_id)
+
+        if not details:
+            raise HTTPException(status_code=404, detail="Album not found")
+
+        return details
+
+    return responses.get(
+        library.version, ("album", album_id), build, AlbumDetails
+    ).response(request)
+
+
+@api.get(
+    "/albums/{album_id}/timeline",
+    response_model=list[TimelinePoint],
+    dependencies=ready,
+)
+async def album_timeline(
+    request: Request,
+    album_id: str,
+    granularity: Annotated[
+        str, Query(pattern="^(" + "|".join(GRANULARITIES) + ")$")
+    ] = "month",
+    date_from: Annotated[Optional[date], Query(alias="from")] = None,
+    date_to: Annotated[Optional[date], Query(alias="to")] = None,
+) -> Response:
+    """
+    Return the playcount of an album in every day, month or year, from the rollups.
+    """
+    store, rollups = library.store, library.rollups
+
+    def build() -> list[TimelinePoint]:
+        if store.album(album_id) is None:
+            raise HTTPException(status_code=404, detail="Album not found")
+
+        try:
+            return rollups.timeline(album_id, granularity, date_from, date_to)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    return responses.get(
+        library.version,
+        ("timeline", album_id, granularity, date_from, date_to),
+        build,
+        list[TimelinePoint],
+    ).response(request)
@@ -0,0 +1,127 @@
+from fastapi.testclient import TestClient
+
+import main
+from library import Library
+
+
+def test_data_routes_answer_once_the_tracks_are_loaded(
+    tmp_path, monkeypatch, write_page
+):
+    write_page(tmp_path, "tracks_0001.json", [1711782712, 1711788633])
+    library = Library(str(tmp_path), workers=1)
+    monkeypatch.setattr(main, "library", library)
+    client = TestClient(main.api)
+
+    assert client.get("/healthz").status_code == 200
+
+    response = client.get("/albums")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(main.RETRY_AFTER_SECONDS)
+
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["ready"] is False
+
+    library.load()
+
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json() == {
+        "ready": True,
+        "files": 1,
+        "files_loaded": 1,
+        "tracks_loaded": 2,
+        "seconds": response.json()["seconds"],
+        "error": None,
+    }
+    assert client.get("/albums").status_code == 200
+
+
+def test_query_times_are_utc_and_a_date_to_covers_its_day(
+    tmp_path, monkeypatch, write_page
+):
+    # 07:11 and 08:50 UTC on the 30th of March 2024
+    write_page(tmp_path, "tracks_0001.json", [1711782712, 1711788633])
+    library = Library(str(tmp_path), workers=1)
+    library.load()
+    monkeypatch.setattr(main, "library", library)
+    client = TestClient(main.api)
+
+    response = client.get("/tracks", params={"from": "2024-03-30", "to": "2024-03-30"})
+    assert len(response.json()) == 2
+
+    response = client.get(
+        "/tracks", params={"from": "2024-03-30T08:00:00", "to": "2024-03-30T09:00Z"}
+    )
+    assert [t["date"]["uts"] for t in response.json()] == ["2024-03-30T08:50:33Z"]
+
+    response = client.get(
+        "/albums/compare",
+        params={"from": "2024-03-01T00:00:00Z", "to": "2024-03-31T00:00:00"},
+    )
+    assert response.status_code == 200
+
+    assert (
+        client.get(
+            "/tracks", params={"from": "2024-03-30", "to": "2024-03-30", "offset": -3}
+        ).status_code
+        == 422
+    )
+    assert (
+        client.get(
+            "/tracks", params={"from": "2024-03-30", "to": "2024-03-30", "limit": 0}
+        ).status_code
+        == 422
+    )
+
+
+def test_rollup_routes_reject_ranges_they_cannot_serve(
+    tmp_path, monkeypatch, write_page
+):
+    write_page(tmp_path, "tracks_0001.json", [("suede", "So Young", 1711782712)])
+    library = Library(str(tmp_path), workers=1)
+    library.load()
+    monkeypatch.setattr(main, "library", library)
+    client = TestClient(main.api)
+
+    response = client.get(
+        "/albums/top", params={"from": "9999-12-01", "to": "9999-12-31"}
+    )
+    assert response.status_code == 200
+    assert response.json() == []
+
+    response = client.get(
+        "/albums/suede/timeline",
+        params={"granularity": "day", "from": "0001-01-01", "to": "9999-12-31"},
+    )
+    assert response.status_code == 422
+
+
+def test_album_list_is_rendered_in_pages(tmp_path, monkeypatch, write_page):
+    albums = [f"album-{i:03}" for i in range(main.ALBUM_PAGE_SIZE + 50)]
+    write_page(
+        tmp_path,
+        "tracks_0001.json",
+        [(album, "Song", 1711782712 + i) for i, album in enumerate(albums)],
+    )
+    library = Library(str(tmp_path), workers=1)
+    library.load()
+    monkeypatch.setattr(main, "library", library)
+    client = TestClient(main.api)
+
+    def listed(html: str) -> list[str]:
+        return [album for album in albums if f'href="/albums/{album}"' in html]
+
+    home = client.get("/").text
+    assert listed(home) == albums[: main.ALBUM_PAGE_SIZE]
+    assert f'hx-get="/fragments/albums?cursor={main.ALBUM_PAGE_SIZE}"' in home
+
+    response = client.get("/fragments/albums", params={"cursor": 40})
+    assert listed(response.text) == albums[40 : 40 + main.ALBUM_PAGE_SIZE]
+    assert 'hx-get="/fragments/albums?cursor=140"' in response.text
+
+    last = client.get("/fragments/albums", params={"cursor": main.ALBUM_PAGE_SIZE})
+    assert listed(last.text) == albums[main.ALBUM_PAGE_SIZE :]
+    assert "hx-get" not in last.text
+
+    assert client.get("/fragments/albums", params={"cursor": -1}).status_code == 422
@@ -0,0 +1,149 @@
+import os
+import json
+import threading
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from hashlib import sha256
+from typing import Optional
+
+MANIFEST_FILE_NAME = "manifest.jsonl"
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    """
+    A completed page download.
+
+    Times are stored as unix timestamps to keep the manifest independent of time zones.
+    Pages written to segment files share the file and the checksum of their segment.
+    """
+
+    file: str
+    date_from: int
+    date_to: int
+    page: int
+    total_pages: int
+    tracks: int
+    sha256: str
+    newest: Optional[int] = None
+
+    @property
+    def key(self) -> tuple[int, int, int]:
+        return (self.date_from, self.date_to, self.page)
+
+
+def checksum(data: bytes) -> str:
+    return sha256(data).hexdigest()
+
+
+class Manifest:
+    """
+    A checkpoint log of completed pages, kept in the destination directory.
+
+    Entries are appended one JSON object per line so that recording a page costs
+    a single small write. When a page is recorded more than once the last entry wins.
+    Entries may be recorded from a writer thread while the downloader reads them.
+    """
+
+    def __init__(
+        self,
+        dest_dir: str,
+        entries: Optional[dict[tuple[int, int, int], ManifestEntry]] = None,
+    ):
+        self.dest_dir = dest_dir
+        self.entries = entries if entries is not None else {}
+        self._lock = threading.Lock()
+        self._verified: dict[tuple[str, str], bool] = {}
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.dest_dir, MANIFEST_FILE_NAME)
+
+    @classmethod
+    def load(cls, dest_dir: str) -> "Manifest":
+        manifest = cls(dest_dir)
+
+        if not os.path.exists(manifest.path):
+            return manifest
+
+        with open(manifest.path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = ManifestEntry(**json.loads(line))
+                except (ValueError, TypeError):
+                    # A torn last line from an interrupted run
+                    continue
+                manifest.entries[entry.key] = entry
+
+        return manifest
+
+    def record(self, *entries: ManifestEntry):
+        with self._lock:
+            for entry in entries:
+                self.entries[entry.key] = entry
+
+            with open(self.path, "a") as f:
+                f.write("".join(json.dumps(asdict(entry)) + "\n" for entry in entries))
+
+    def snapshot(self) -> list[ManifestEntry]:
+        with self._lock:
+            return list(self.entries.values())
+
+    def is_valid(self, entry: ManifestEntry) -> bool:
+        """
+        Return True if the file of the entry exists and matches its checksum.
+        """
+        key = (entry.file, entry.sha256)
+        if key not in self._verified:
+            path = os.path.join(self.dest_dir, entry.file)
+
+            if not os.path.exists(path):
+                self._verified[key] = False
+            else:
+                with open(path, "rb") as f:
+                    self._verified[key] = checksum(f.read()) == entry.sha256
+
+        return self._verified[key]
+
+    def missing_pages(
+        self, date_from: datetime, date_to: datetime
+    ) -> Optional[list[int]]:
+        """
+        Return the pages of the given range that are missing or corrupt.
+
+        Returns None if nothing has been recorded for the range, in which case the
+        number of pages is unknown and the range has to be downloaded from the start.
+        """
+        entries = [
+            entry
+            for entry in self.snapshot()
+            if entry.date_from == int(date_from.timestamp())
+            and entry.date_to == int(date_to.timestamp())
+        ]
+
+        if not entries:
+            return None
+
+        total_pages = max(entry.total_pages for entry in entries)
+        completed = {entry.page for entry in entries if self.is_valid(entry)}
+
+        return [page for page in range(1, total_pages + 1) if page not in completed]
+
+    def newest_scrobble(self) -> Optional[datetime]:
+        """
+        Return the time of the newest scrobble in any recorded page.
+        """
+        newest = [
+            entry.newest
+            for entry in self.snapshot()
+            if entry.newest is not None
+            and os.path.exists(os.path.join(self.dest_dir, entry.file))
+        ]
+
+        if not newest:
+            return None
+
+        return datetime.fromtimestamp(max(newest), tz=timezone.utc)
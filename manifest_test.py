@@ -0,0 +1,54 @@
+from datetime import datetime, timezone
+
+from manifest import Manifest, ManifestEntry, checksum
+
+date_from = datetime(2024, 3, 1, tzinfo=timezone.utc)
+date_to = datetime(2024, 3, 31, tzinfo=timezone.utc)
+
+
+def write_page(manifest: Manifest, page: int, total_pages: int, newest: int):
+    name = f"tracks_{page}.json"
+    data = f'{{"page": {page}}}'.encode()
+
+    with open(f"{manifest.dest_dir}/{name}", "wb") as f:
+        f.write(data)
+
+    manifest.record(
+        ManifestEntry(
+            file=name,
+            date_from=int(date_from.timestamp()),
+            date_to=int(date_to.timestamp()),
+            page=page,
+            total_pages=total_pages,
+            tracks=200,
+            sha256=checksum(data),
+            newest=newest,
+        )
+    )
+
+
+def test_missing_pages_of_an_unknown_range():
+    assert Manifest(".").missing_pages(date_from, date_to) is None
+
+
+def test_missing_pages_skips_corrupt_and_absent_files(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    for page in [1, 2, 4]:
+        write_page(manifest, page, total_pages=5, newest=1711782712 - page)
+
+    with open(tmp_path / "tracks_2.json", "w") as f:
+        f.write("{")
+
+    reloaded = Manifest.load(str(tmp_path))
+
+    assert reloaded.missing_pages(date_from, date_to) == [2, 3, 5]
+
+
+def test_newest_scrobble(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    write_page(manifest, 1, total_pages=2, newest=1711782712)
+    write_page(manifest, 2, total_pages=2, newest=1711782000)
+
+    assert Manifest.load(str(tmp_path)).newest_scrobble() == datetime(
+        2024, 3, 30, 7, 11, 52, tzinfo=timezone.utc
+    )
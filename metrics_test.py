@@ -0,0 +1,57 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from metrics import Gauge, Histogram, MetricsMiddleware, Registry
+
+
+def test_histogram_exposition():
+    registry = Registry()
+    histogram = registry.register(
+        Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1))
+    )
+    registry.register(Gauge("items", "Items", function=lambda: 3))
+
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.1, "/a")
+    histogram.observe(2.5, "/a")
+
+    assert registry.exposition().splitlines() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a",le="1"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 2.65',
+        'latency_seconds_count{route="/a"} 3',
+        "# HELP items Items",
+        "# TYPE items gauge",
+        "items 3",
+    ]
+
+
+def test_middleware_labels_requests_with_their_route():
+    registry = Registry()
+    api = FastAPI()
+    api.add_middleware(MetricsMiddleware, registry=registry)
+
+    @api.get("/items/{item}")
+    async def item(item: str):
+        return list(registry.metrics["http_requests_in_progress"].values.items())
+
+    client = TestClient(api)
+    assert client.get("/items/a").json() == [[["GET", "/items/{item}"], 1]]
+    client.get("/items/b")
+    client.get("/missing")
+    client.post("/items/c")
+
+    requests = registry.metrics["http_requests_total"]
+    assert requests.values == {
+        ("GET", "/items/{item}", "200"): 2,
+        ("GET", "unmatched", "404"): 1,
+        ("POST", "/items/{item}", "405"): 1,
+    }
+    assert registry.metrics["http_requests_in_progress"].values == {
+        ("GET", "/items/{item}"): 0,
+        ("GET", "unmatched"): 0,
+        ("POST", "/items/{item}"): 0,
+    }
@@ -0,0 +1,302 @@
+import argparse
+import asyncio
+import random
+import secrets
+import time
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from generate_tracks import create_catalogue, generate_plays
+from last_fm_client import sign
+from last_fm_model import ErrorCode, Method
+
+MAX_LIMIT = 200
+
+
+@dataclass
+class MockConfig:
+    """
+    The behaviour of the mock Last.fm API.
+
+    Every request waits `latency` seconds plus up to `jitter` more. A share of
+    `error_rate` requests fails with error 29, and requests beyond
+    `rate_limit` per second (a token bucket holding one second of requests)
+    fail with error 29 too.
+    """
+
+    api_key: str = "api-key"
+    secret: str = "secret"
+    user: str = "scrbl"
+    scrobbles: int = 20_000
+    years: float = 5
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    rate_limit: Optional[float] = None
+    seed: int = 0
+
+
+class TokenBucket:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+class MockLastFm:
+    """
+    The listening history of one synthetic user, served the way Last.fm serves it.
+    """
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.bucket = TokenBucket(config.rate_limit) if config.rate_limit else None
+        self.tokens: set[str] = set()
+        self.requests = 0
+
+        self.date_to = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.date_from = self.date_to - timedelta(days=365.25 * config.years)
+
+        catalogue = create_catalogue(
+            random.Random(config.seed),
+            artists=500,
+            albums_per_artist=8,
+            tracks_per_album=12,
+            empty_mbid_rate=0.15,
+            no_album_rate=0.02,
+        )
+        # Newest first, with the negated times in ascending order for bisect
+        self.plays = list(
+            generate_plays(
+                random.Random(config.seed),
+                catalogue,
+                config.scrobbles,
+                self.date_from,
+                self.date_to,
+                exponent=1.1,
+            )
+        )
+        self.negated_times = [-int(play["date"]["uts"]) for play in self.plays]
+
+    def recent_tracks(self, params: dict[str, str]) -> dict[str, Any]:
+        date_from = int(params.get("from", 0))
+        date_to = int(params.get("to", 2**62))
+        page = max(1, int(params.get("page", 1)))
+        limit = min(MAX_LIMIT, max(1, int(params.get("limit", 50))))
+
+        start = bisect_left(self.negated_times, -date_to)
+        end = bisect_right(self.negated_times, -date_from)
+        total = end - start
+        first = start + (page - 1) * limit
+
+        return {
+            "recenttracks": {
+                "track": self.plays[first : min(first + limit, end)],
+                "@attr": {
+                    "user": self.config.user,
+                    "totalPages": str(-(-total // limit)),
+                    "page": str(page),
+                    "perPage": str(limit),
+                    "total": str(total),
+                },
+            }
+        }
+
+    def handle(self, params: dict[str, str]) -> tuple[int, dict[str, Any]]:
+        """
+        Answer an API call with a status and a body.
+        """
+        if params.get("api_key") != self.config.api_key:
+            return error(403, ErrorCode.invalid_api_key, "Invalid API key")
+
+        signed = {key: value for key, value in params.items() if key != "api_sig"}
+        if params.get("api_sig") != sign(signed, self.config.secret):
+            return error(
+                403, ErrorCode.invalid_signature, "Invalid method signature supplied"
+            )
+
+        method = params.get("method")
+
+        if method == Method.auth_get_token:
+            token = secrets.token_hex(16)
+            self.tokens.add(token)
+            return 200, {"token": token}
+
+        if method == Method.auth_get_session:
+            if params.get("token") not in self.tokens:
+                return error(403, ErrorCode.unauthorized_token, "Unauthorized Token")
+            self.tokens.discard(params["token"])
+            key = secrets.token_hex(16)
+            return 200, {
+                "session": {"name": self.config.user, "key": key, "subscriber": 0}
+            }
+
+        if method == Method.user_get_recent_tracks:
+            if params.get("user") != self.config.user:
+                return error(404, ErrorCode.invalid_parameters, "User not found")
+            try:
+                return 200, self.recent_tracks(params)
+            except ValueError:
+                return error(400, ErrorCode.invalid_parameters, "Invalid parameters")
+
+        return error(400, ErrorCode.invalid_method, "Invalid Method")
+
+    async def delay(self):
+        seconds = self.config.latency + self.rng.uniform(0, self.config.jitter)
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def throttled(self) -> bool:
+        if self.bucket is not None and not self.bucket.take():
+            return True
+        return self.rng.random() < self.config.error_rate
+
+
+def error(status: int, code: int, message: str) -> tuple[int, dict[str, Any]]:
+    return status, {"error": code, "message": message}
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    """
+    Create an app that serves user.getRecentTracks, auth.getToken and
+    auth.getSession at /2.0, like ws.audioscrobbler.com.
+    """
+    mock = MockLastFm(config)
+    app = FastAPI()
+    app.state.mock = mock
+
+    @app.get("/2.0")
+    @app.get("/2.0/")
+    async def api(request: Request) -> JSONResponse:
+        mock.requests += 1
+        await mock.delay()
+
+        if mock.throttled():
+            status, body = error(
+                429, ErrorCode.rate_limit_exceeded, "Rate Limit Exceeded"
+            )
+        else:
+            status, body = mock.handle(dict(request.query_params))
+
+        return JSONResponse(body, status_code=status)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a mock Last.fm API with a synthetic listening history."
+    )
+    parser.add_argument("--host", help="The host", required=False, default="127.0.0.1")
+    parser.add_argument(
+        "--port", help="The port", required=False, type=int, default=8001
+    )
+    parser.add_argument(
+        "--api-key",
+        help="The API key clients must use",
+        required=False,
+        dest="api_key",
+        default="api-key",
+    )
+    parser.add_argument(
+        "--secret",
+        help="The API secret requests must be signed with",
+        required=False,
+        dest="secret",
+        default="secret",
+    )
+    parser.add_argument(
+        "--user",
+        help="The username of the listening history",
+        required=False,
+        dest="user",
+        default="scrbl",
+    )
+    parser.add_argument(
+        "--scrobbles",
+        help="The number of plays in the listening history",
+        required=False,
+        dest="scrobbles",
+        type=int,
+        default=20_000,
+    )
+    parser.add_argument(
+        "--latency",
+        help="The minimum response time in milliseconds",
+        required=False,
+        dest="latency",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--jitter",
+        help="The maximum number of milliseconds added to the response time at random",
+        required=False,
+        dest="jitter",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--error-rate",
+        help="The share of requests that fail with error 29",
+        required=False,
+        dest="error_rate",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--rate-limit",
+        help="The number of requests per second above which requests fail with error 29",
+        required=False,
+        dest="rate_limit",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--seed",
+        help="The seed of the listening history and of the injected errors",
+        required=False,
+        dest="seed",
+        type=int,
+        default=0,
+    )
+
+    args = parser.parse_args()
+
+    app = create_app(
+        MockConfig(
+            api_key=args.api_key,
+            secret=args.secret,
+            user=args.user,
+            scrobbles=args.scrobbles,
+            latency=args.latency / 1000,
+            jitter=args.jitter / 1000,
+            error_rate=args.error_rate,
+            rate_limit=args.rate_limit,
+            seed=args.seed,
+        )
+    )
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
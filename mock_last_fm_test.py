@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime, timezone
+
+from httpx import ASGITransport, AsyncClient
+
+from last_fm_client import create_signed_get_request
+from downloader_load import run
+from last_fm_model import ErrorCode, Method
+from mock_last_fm import MockConfig, create_app
+from rate_limit import RateLimiter
+
+config = MockConfig(scrobbles=1000, seed=1)
+app = create_app(config)
+
+
+def client() -> AsyncClient:
+    return AsyncClient(
+        base_url="http://mock.last.fm/",
+        params={"api_key": config.api_key, "format": "json"},
+        transport=ASGITransport(app=app),
+    )
+
+
+def test_downloader_fetches_every_track_from_the_mock():
+    result = asyncio.run(
+        run(
+            ASGITransport(app=app),
+            "http://mock.last.fm/",
+            config.api_key,
+            config.secret,
+            config.user,
+            datetime(1970, 1, 1, tzinfo=timezone.utc),
+            datetime(2024, 1, 1, tzinfo=timezone.utc),
+            concurrency=4,
+            limiter=RateLimiter(1000),
+        )
+    )
+
+    assert result.pages == 5
+    assert result.tracks == 1000
+    assert result.statuses == {200: 5}
+
+
+def test_mock_checks_signatures_and_issues_sessions():
+    async def calls():
+        async with client() as c:
+            forged = create_signed_get_request(c, Method.auth_get_token, "wrong")
+            token_request = create_signed_get_request(
+                c, Method.auth_get_token, config.secret
+            )
+            token = (await c.send(token_request)).json()["token"]
+            session_request = create_signed_get_request(
+                c, Method.auth_get_session, config.secret, {"token": token}
+            )
+            return (
+                (await c.send(forged)).json(),
+                (await c.send(session_request)).json(),
+            )
+
+    forged, session = asyncio.run(calls())
+
+    assert forged["error"] == ErrorCode.invalid_signature
+    assert session["session"]["name"] == config.user
+
+
+def test_mock_rejects_requests_above_the_rate_limit():
+    limited = create_app(MockConfig(scrobbles=10, rate_limit=2))
+
+    async def calls():
+        async with AsyncClient(
+            base_url="http://mock.last.fm/",
+            params={"api_key": "api-key", "format": "json"},
+            transport=ASGITransport(app=limited),
+        ) as c:
+            return [
+                await c.send(
+                    create_signed_get_request(c, Method.auth_get_token, "secret")
+                )
+                for _ in range(3)
+            ]
+
+    responses = asyncio.run(calls())
+
+    assert [r.status_code for r in responses] == [200, 200, 429]
+    assert responses[2].json()["error"] == ErrorCode.rate_limit_exceeded
@@ -0,0 +1,118 @@
+import asyncio
+import random
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Spaces out requests so that at most `requests_per_second` are started per second.
+
+    Callers reserve the next free slot and sleep until it arrives, so concurrent
+    callers are served in the order in which they called `acquire`.
+    """
+
+    def __init__(self, requests_per_second: float):
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second must be greater than 0")
+
+        self.requests_per_second = requests_per_second
+        self._next_slot = 0.0
+
+    @property
+    def interval(self) -> float:
+        return 1 / self.requests_per_second
+
+    def reserve(self) -> float:
+        """
+        Reserve the next free slot and return the number of seconds to wait for it.
+        """
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        return slot - now
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wait(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def succeeded(self, elapsed: float) -> None:
+        """
+        Called with the response time of every successful request.
+        """
+
+    def throttled(self) -> None:
+        """
+        Called when the server reports that the rate limit was exceeded.
+        """
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    A rate limiter that finds the server limit with additive increase, multiplicative decrease.
+
+    Every successful request raises the rate so that it grows by about `increase`
+    requests per second each second. Every rate limit error cuts the rate by
+    `decrease`. While response times exceed `latency_factor` times the fastest
+    response seen so far the server is assumed to be queueing, and the rate is held.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float,
+        min_requests_per_second: float = 0.2,
+        max_requests_per_second: float = 50,
+        increase: float = 0.5,
+        decrease: float = 0.5,
+        latency_factor: float = 2.0,
+    ):
+        super().__init__(requests_per_second)
+
+        if not 0 < min_requests_per_second <= max_requests_per_second:
+            raise ValueError(
+                "min_requests_per_second must be greater than 0 and at most max_requests_per_second"
+            )
+
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+
+        self.min_requests_per_second = min_requests_per_second
+        self.max_requests_per_second = max_requests_per_second
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.min_latency: Optional[float] = None
+
+    def succeeded(self, elapsed: float) -> None:
+        if self.min_latency is None or elapsed < self.min_latency:
+            self.min_latency = elapsed
+
+        if elapsed > self.latency_factor * self.min_latency:
+            return
+
+        self.requests_per_second = min(
+            self.max_requests_per_second,
+            self.requests_per_second + self.increase / self.requests_per_second,
+        )
+
+    def throttled(self) -> None:
+        self.requests_per_second = max(
+            self.min_requests_per_second,
+            self.requests_per_second * self.decrease,
+        )
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Return the number of seconds to wait before retry number `attempt` (starting at 0).
+
+    Uses exponential backoff with full jitter, so that clients that failed
+    together do not retry together.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
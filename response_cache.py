@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from functools import cache
+from typing import Any, Optional
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+@cache
+def adapter(response_type: Any) -> TypeAdapter:
+    return TypeAdapter(response_type)
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """
+    Return the content codings of an Accept-Encoding header that are not refused with q=0.
+    """
+    encodings = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        name, _, value = params.strip().partition("=")
+        try:
+            refused = name.strip() == "q" and float(value) == 0
+        except ValueError:
+            refused = False
+        if coding.strip() and not refused:
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+class CachedResponse:
+    """
+    A body encoded once, with its ETag. Compressed variants are made when first asked for.
+    """
+
+    def __init__(self, body: bytes, media_type: str = "application/json"):
+        self.body = body
+        self.media_type = media_type
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self._variants: dict[str, bytes] = {}
+
+    @classmethod
+    def encode(cls, content: Any, response_type: Any) -> "CachedResponse":
+        return cls(adapter(response_type).dump_json(content))
+
+    def variant(self, encoding: str) -> bytes:
+        body = self._variants.get(encoding)
+        if body is None:
+            if encoding == "br":
+                body = brotli.compress(self.body)
+            else:
+                body = gzip.compress(self.body, mtime=0)
+            self._variants[encoding] = body
+        return body
+
+    def response(self, request: Request) -> Response:
+        """
+        Answer a request with a 304 if it has the current ETag, or with the body
+        in the best encoding it accepts.
+        """
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+
+        encoding = None
+        if brotli is not None and "br" in accepted:
+            encoding = "br"
+        elif "gzip" in accepted:
+            encoding = "gzip"
+
+        # Every encoding is a different representation, so it has its own strong ETag
+        etag = f'{self.etag[:-1]}-{encoding}"' if encoding else self.etag
+        headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return Response(
+                self.variant(encoding), media_type=self.media_type, headers=headers
+            )
+
+        return Response(self.body, media_type=self.media_type, headers=headers)
+
+
+class ResponseCache:
+    """
+    A least recently used cache of encoded responses for one version of the data.
+
+    Entries are dropped as soon as a different version is asked for, so they
+    never have to be invalidated one by one.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.version: Optional[Hashable] = None
+        self.entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+
+    def get(
+        self,
+        version: Hashable,
+        key: Hashable,
+        build: Callable[[], Any],
+        response_type: Any = None,
+        media_type: str = "application/json",
+    ) -> CachedResponse:
+        """
+        Return the cached response for the key, encoding the result of `build` if there is none.
+
+        Without a response type, `build` returns the body, for example a rendered template.
+        """
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry
+
+        if response_type is None:
+            entry = CachedResponse(build(), media_type)
+        else:
+            entry = CachedResponse.encode(build(), response_type)
+
+        self.entries[key] = entry
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        return entry
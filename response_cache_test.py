@@ -0,0 +1,69 @@
+import gzip
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from response_cache import ResponseCache, accepted_encodings
+
+builds = []
+cache = ResponseCache(max_entries=2)
+version = 1
+api = FastAPI()
+
+
+@api.get("/items/{item}")
+async def item(request: Request, item: str):
+    def build():
+        builds.append(item)
+        return {"item": item}
+
+    return cache.get(version, item, build, dict[str, str]).response(request)
+
+
+def test_cached_responses_are_revalidated_and_compressed():
+    client = TestClient(api)
+
+    plain = client.get("/items/a", headers={"accept-encoding": "identity"})
+    compressed = client.get("/items/a", headers={"accept-encoding": "gzip"})
+    not_modified = client.get(
+        "/items/a",
+        headers={"accept-encoding": "identity", "if-none-match": plain.headers["etag"]},
+    )
+
+    assert plain.content == b'{"item":"a"}'
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["etag"] != plain.headers["etag"]
+    assert not_modified.status_code == 304
+    assert builds == ["a"]
+
+
+def test_cache_is_bounded_and_cleared_by_a_new_version():
+    global version
+    builds.clear()
+    cache.entries.clear()
+    client = TestClient(api)
+
+    for item in ["a", "b", "c", "a"]:
+        client.get(f"/items/{item}")
+    version = 2
+    client.get("/items/c")
+
+    assert builds == ["a", "b", "c", "a", "c"]
+    assert list(cache.entries) == ["c"]
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("gzip;q=0, br, Deflate;q=0.5") == {"br", "deflate"}
+    assert (
+        gzip.decompress(
+            cache.get(3, "x", lambda: {"item": "x"}, dict[str, str]).variant("gzip")
+        )
+        == b'{"item":"x"}'
+    )
+
+
+def test_rendered_bodies_are_cached_as_is():
+    entry = cache.get(4, "page", lambda: b"<li>a</li>", media_type="text/html")
+
+    assert entry.body == b"<li>a</li>"
+    assert entry.media_type == "text/html"
@@ -0,0 +1,286 @@
+from calendar import monthrange
+from collections import Counter
+from collections.abc import Iterator
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from last_fm_model import Album, Artist
+from sqlite_store import SqliteTracks
+from store import is_ranked
+from track_store import TrackStore
+
+GRANULARITIES = ("day", "month", "year")
+
+# The most buckets a timeline has, a century of days
+MAX_TIMELINE_POINTS = 36525
+
+# An album and the artist it was played by
+Pair = tuple[Album, Artist]
+
+
+@dataclass
+class AlbumPlaycount:
+    mbid: str
+    name: str
+    artist: str
+    playcount: int
+
+
+@dataclass
+class TimelinePoint:
+    period: str
+    playcount: int
+
+
+def period_name(day: date, granularity: str) -> str:
+    """
+    Return the name of the day, month or year bucket of a day: 2024-03-01, 2024-03 or 2024.
+    """
+    if granularity == "day":
+        return day.isoformat()
+    if granularity == "month":
+        return f"{day.year:04}-{day.month:02}"
+    if granularity == "year":
+        return f"{day.year:04}"
+
+    raise ValueError(f"Unsupported granularity: {granularity}")
+
+
+def period_bounds(day: date, granularity: str) -> tuple[date, date]:
+    """
+    Return the first and last day of the day, month or year bucket of a day.
+    """
+    if granularity == "day":
+        return day, day
+    if granularity == "month":
+        return day.replace(day=1), last_of_month(day)
+    if granularity == "year":
+        return date(day.year, 1, 1), date(day.year, 12, 31)
+
+    raise ValueError(f"Unsupported granularity: {granularity}")
+
+
+def parse_period(period: str) -> tuple[str, date, date]:
+    """
+    Return the granularity and the first and last day of a period named like
+    2024, 2024-03 or 2024-03-01.
+    """
+    parts = period.split("-")
+    try:
+        if len(parts) == 1:
+            return "year", *period_bounds(date(int(parts[0]), 1, 1), "year")
+        if len(parts) == 2:
+            first = date(int(parts[0]), int(parts[1]), 1)
+            return "month", *period_bounds(first, "month")
+        if len(parts) == 3:
+            day = date.fromisoformat(period)
+            return "day", day, day
+    except ValueError:
+        pass
+
+    raise ValueError(f"Invalid period: {period}")
+
+
+def last_of_month(day: date) -> date:
+    return day.replace(day=monthrange(day.year, day.month)[1])
+
+
+def count_periods(date_from: date, date_to: date, granularity: str) -> int:
+    """
+    Return the number of buckets of the granularity between the dates.
+    """
+    if date_from > date_to:
+        return 0
+    if granularity == "day":
+        return (date_to - date_from).days + 1
+    if granularity == "month":
+        return (
+            (date_to.year - date_from.year) * 12 + date_to.month - date_from.month + 1
+        )
+    if granularity == "year":
+        return date_to.year - date_from.year + 1
+
+    raise ValueError(f"Unsupported granularity: {granularity}")
+
+
+def periods_between(date_from: date, date_to: date) -> Iterator[tuple[str, str]]:
+    """
+    Yield the fewest day, month and year buckets that cover the days between
+    the dates, as (granularity, period) pairs.
+
+    Whole years and months are covered by one bucket each, so any range takes
+    at most about 80 buckets plus one per year.
+    """
+    day = date_from
+    while day <= date_to:
+        for granularity in ("year", "month", "day"):
+            first, last = period_bounds(day, granularity)
+            if first == day and last <= date_to:
+                break
+
+        yield granularity, period_name(day, granularity)
+
+        # Stop before stepping past the last day, which may be date.max
+        if last == date_to:
+            break
+        day = last + timedelta(days=1)
+
+
+def periods_of(date_from: date, date_to: date, granularity: str) -> list[str]:
+    """
+    Return the names of every bucket of the granularity between the dates, in order.
+    """
+    periods = []
+    day = date_from
+    while day <= date_to:
+        periods.append(period_name(day, granularity))
+
+        last = period_bounds(day, granularity)[1]
+        if last >= date_to:
+            break
+        day = last + timedelta(days=1)
+
+    return periods
+
+
+class Rollups:
+    """
+    The playcounts of every album and artist per day, month and year, built in one pass.
+
+    Any period is ranked by adding up at most a few hundred buckets instead of
+    reading its plays. Like Store, the rollups are updated with the tracks
+    appended since they were built. The plays are counted per day by the
+    backend, from the columns of a TrackStore or with one query on SqliteTracks.
+    """
+
+    def __init__(self, tracks: TrackStore | SqliteTracks):
+        self.tracks = tracks
+        self.indexed = 0
+        self.buckets: dict[str, dict[str, Counter[Pair]]] = {
+            granularity: {} for granularity in GRANULARITIES
+        }
+        # The pairs of every album, by MBID, for timelines
+        self.pairs: dict[str, set[Pair]] = {}
+        # The first and last day anything was played
+        self.first_day: Optional[date] = None
+        self.last_day: Optional[date] = None
+        self.update()
+
+    def update(self):
+        """
+        Add the tracks appended since the rollups were built or last updated.
+        """
+        days: dict[int, date] = {}
+
+        for day_number, album, artist, count in self.tracks.daily_plays(self.indexed):
+            pair = (album, artist)
+            day = days.get(day_number)
+            if day is None:
+                day = days[day_number] = datetime.fromtimestamp(
+                    day_number * 86400, tz=timezone.utc
+                ).date()
+
+            for granularity in GRANULARITIES:
+                counter = self.buckets[granularity].setdefault(
+                    period_name(day, granularity), Counter()
+                )
+                counter[pair] += count
+
+            self.pairs.setdefault(pair[0].mbid, set()).add(pair)
+
+        if days:
+            played = [*days.values(), *filter(None, (self.first_day, self.last_day))]
+            self.first_day, self.last_day = min(played), max(played)
+
+        self.indexed = len(self.tracks)
+
+    def playcounts(self, date_from: date, date_to: date) -> Counter[Pair]:
+        """
+        Return the playcount of every pair played between the dates, both included.
+
+        The dates are clamped to the days that were played, so a range of any
+        length takes a bounded number of buckets.
+        """
+        total: Counter[Pair] = Counter()
+        if self.first_day is None or self.last_day is None:
+            return total
+
+        for granularity, period in periods_between(
+            max(date_from, self.first_day), min(date_to, self.last_day)
+        ):
+            counter = self.bucket(granularity, period)
+            if counter:
+                total.update(counter)
+        return total
+
+    def bucket(self, granularity: str, period: str) -> Optional[Counter[Pair]]:
+        """
+        Return the playcount of every pair played in a period, or None if none was.
+        """
+        return self.buckets[granularity].get(period)
+
+    def album_playcounts(self, mbid: str, granularity: str) -> dict[str, int]:
+        """
+        Return the playcount of an album in every period of the granularity it was played in.
+        """
+        pairs = self.pairs.get(mbid, ())
+        return {
+            period: sum(counter[pair] for pair in pairs)
+            for period, counter in self.buckets[granularity].items()
+            if any(pair in counter for pair in pairs)
+        }
+
+    def top(self, date_from: date, date_to: date, limit: int) -> list[AlbumPlaycount]:
+        """
+        Rank the albums with an MBID and a name played between the dates, by artist.
+        """
+        return [
+            AlbumPlaycount(album.mbid, album.name, artist.name, playcount)
+            for (album, artist), playcount in self.playcounts(
+                date_from, date_to
+            ).most_common()
+            if is_ranked(album)
+        ][:limit]
+
+    def top_of_period(self, period: str, limit: int) -> list[AlbumPlaycount]:
+        """
+        Rank the albums played in a year, month or day, such as 2023, 2023-05 or 2023-05-14.
+        """
+        _, date_from, date_to = parse_period(period)
+        return self.top(date_from, date_to, limit)
+
+    def timeline(
+        self,
+        mbid: str,
+        granularity: str,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+    ) -> list[TimelinePoint]:
+        """
+        Return the playcount of an album in every day, month or year between the
+        dates, including the ones it was not played in.
+
+        By default the timeline spans the buckets the album was played in.
+        Raises a ValueError if it would have more than MAX_TIMELINE_POINTS.
+        """
+        playcounts = self.album_playcounts(mbid, granularity)
+        if not playcounts:
+            return []
+
+        if date_from is None or date_to is None:
+            played = sorted(playcounts)
+            if date_from is None:
+                date_from = parse_period(played[0])[1]
+            if date_to is None:
+                date_to = parse_period(played[-1])[2]
+
+        if count_periods(date_from, date_to, granularity) > MAX_TIMELINE_POINTS:
+            raise ValueError(
+                f"A timeline has at most {MAX_TIMELINE_POINTS} points of a {granularity}"
+            )
+
+        return [
+            TimelinePoint(period, playcounts.get(period, 0))
+            for period in periods_of(date_from, date_to, granularity)
+        ]
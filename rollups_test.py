@@ -0,0 +1,102 @@
+from datetime import date, datetime, timezone
+
+from pytest import raises
+
+from rollups import Rollups, periods_between
+from sqlite_store import SqliteTracks, connect, ingest
+from store import Store
+from track_store import TrackStore
+from util import load_tracks_data
+
+
+def uts(year: int, month: int, day: int) -> int:
+    return int(datetime(year, month, day, 12, tzinfo=timezone.utc).timestamp())
+
+
+history = [
+    ("suede", "Animal Nitrate", uts(2022, 12, 31)),
+    ("suede", "So Young", uts(2023, 1, 1)),
+    ("coming-up", "Trash", uts(2023, 5, 14)),
+    ("coming-up", "Lazy", uts(2023, 5, 14)),
+    ("suede", "Metal Mickey", uts(2023, 5, 20)),
+    ("coming-up", "Beautiful Ones", uts(2024, 2, 1)),
+]
+
+
+def test_periods_between_covers_a_range_with_few_buckets():
+    periods = list(periods_between(date(2022, 12, 30), date(2024, 2, 2)))
+
+    assert periods == [
+        ("day", "2022-12-30"),
+        ("day", "2022-12-31"),
+        ("year", "2023"),
+        ("month", "2024-01"),
+        ("day", "2024-02-01"),
+        ("day", "2024-02-02"),
+    ]
+    assert list(periods_between(date(9999, 12, 1), date.max)) == [("month", "9999-12")]
+
+
+def test_rollups_serve_ranges_at_the_ends_of_the_calendar(tmp_path, write_page):
+    write_page(tmp_path, "tracks_0001.json", history)
+    rollups = Rollups(
+        TrackStore.from_tracks(load_tracks_data(str(tmp_path), workers=1))
+    )
+
+    assert rollups.top(date(9999, 12, 1), date(9999, 12, 31), 10) == []
+    assert len(rollups.top(date.min, date.max, 10)) == 2
+    assert rollups.timeline("suede", "year", date.min, date.max)[-1].period == "9999"
+
+    with raises(ValueError):
+        rollups.timeline("suede", "day", date.min, date.max)
+
+
+def test_rollups_rank_periods_and_update_incrementally(tmp_path, write_page):
+    write_page(tmp_path, "tracks_0001.json", history[:5])
+    tracks = TrackStore.from_tracks(load_tracks_data(str(tmp_path), workers=1))
+    rollups = Rollups(tracks)
+
+    assert {a.mbid: a.playcount for a in rollups.top_of_period("2023", 10)} == {
+        "suede": 2,
+        "coming-up": 2,
+    }
+    assert [(a.mbid, a.playcount) for a in rollups.top_of_period("2023-05", 1)] == [
+        ("coming-up", 2)
+    ]
+    assert rollups.top_of_period("2023-05-20", 10)[0].mbid == "suede"
+
+    write_page(tmp_path, "tracks_0002.json", history[5:])
+    tracks.extend_store(
+        TrackStore.from_tracks(load_tracks_data(str(tmp_path), workers=1)[5:])
+    )
+    rollups.update()
+
+    assert rollups.indexed == 6
+    assert [
+        (p.period, p.playcount) for p in rollups.timeline("coming-up", "month")
+    ] == [
+        ("2023-05", 2),
+        *((f"2023-{m:02}", 0) for m in range(6, 13)),
+        ("2024-01", 0),
+        ("2024-02", 1),
+    ]
+
+    totals = {
+        a.mbid: a.playcount for a in rollups.top(date(2000, 1, 1), date(2030, 1, 1), 10)
+    }
+    store = Store(tracks)
+    assert totals == {s.album.mbid: s.playcount for s in store.ranking}
+
+
+def test_rollups_on_sqlite_tracks_match_a_track_store(tmp_path, write_page):
+    write_page(tmp_path, "tracks_0001.json", history)
+    connection = connect(str(tmp_path / "rechord.db"))
+    ingest(connection, str(tmp_path))
+
+    on_sqlite = Rollups(SqliteTracks(connection))
+    in_memory = Rollups(
+        TrackStore.from_tracks(load_tracks_data(str(tmp_path), workers=1))
+    )
+
+    assert on_sqlite.indexed == 6
+    assert on_sqlite.buckets == in_memory.buckets
@@ -0,0 +1,127 @@
+import gzip
+import io
+import os
+from hashlib import sha256
+from typing import BinaryIO, Generator, Optional
+
+import zstandard
+
+from last_fm_model import TRACK_ADAPTER, Track
+
+SEGMENT_FORMATS = ("ndjson.gz", "ndjson.zst")
+
+
+def segment_format(file: str) -> Optional[str]:
+    """
+    Return the segment format of the file name, or None if it is not a segment.
+    """
+    for format in SEGMENT_FORMATS:
+        if file.endswith(f".{format}"):
+            return format
+    return None
+
+
+def open_segment(path: str, mode: str, format: str) -> BinaryIO:
+    """
+    Open a compressed segment for reading ("rb") or writing ("wb").
+    """
+    if mode not in ("rb", "wb"):
+        raise ValueError(f"Unsupported mode: {mode}")
+
+    if format == "ndjson.gz":
+        return gzip.open(path, mode, compresslevel=6)
+
+    if format == "ndjson.zst":
+        f = open(path, mode)
+        if mode == "rb":
+            return io.BufferedReader(
+                zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+            )
+        return zstandard.ZstdCompressor(level=3).stream_writer(f, closefd=True)
+
+    raise ValueError(f"Unsupported segment format: {format}")
+
+
+def read_segment(path: str) -> Generator[Track, None, None]:
+    """
+    Yield the tracks of a segment file, one per line.
+    """
+    format = segment_format(path)
+    if format is None:
+        raise ValueError(f"Not a segment file: {path}")
+
+    with open_segment(path, "rb", format) as f:
+        for line in f:
+            if line.strip():
+                yield TRACK_ADAPTER.validate_json(line)
+
+
+def encode_tracks(tracks: list[Track]) -> bytes:
+    """
+    Encode tracks as NDJSON in the same shape as the Last.fm API, so they validate as Track.
+    """
+    return b"".join(
+        TRACK_ADAPTER.dump_json(track, by_alias=True) + b"\n" for track in tracks
+    )
+
+
+class SegmentWriter:
+    """
+    Writes NDJSON into a series of compressed segment files named {prefix}_{sequence}.{format}.
+
+    A segment is written to a .part file and renamed when it is closed, so readers
+    never see a partially written segment.
+    """
+
+    def __init__(self, dest_dir: str, prefix: str, format: str, max_bytes: int):
+        if format not in SEGMENT_FORMATS:
+            raise ValueError(f"Unsupported segment format: {format}")
+
+        self.dest_dir = dest_dir
+        self.prefix = prefix
+        self.format = format
+        self.max_bytes = max_bytes
+        self.sequence = 1
+        self._file: Optional[BinaryIO] = None
+        self._written = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.prefix}_{str(self.sequence).zfill(4)}.{self.format}"
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.dest_dir, self.name)
+
+    def write(self, data: bytes) -> str:
+        """
+        Write data to the current segment and return the name of the segment.
+        """
+        if self._file is None:
+            self._file = open_segment(f"{self.path}.part", "wb", self.format)
+            self._written = 0
+
+        self._file.write(data)
+        self._written += len(data)
+        return self.name
+
+    def full(self) -> bool:
+        return self._written >= self.max_bytes
+
+    def close(self) -> Optional[tuple[str, str]]:
+        """
+        Close the current segment and return its name and checksum, or None if nothing was written.
+        """
+        if self._file is None:
+            return None
+
+        self._file.close()
+        self._file = None
+        os.replace(f"{self.path}.part", self.path)
+
+        with open(self.path, "rb") as f:
+            digest = sha256(f.read()).hexdigest()
+
+        closed = (self.name, digest)
+        self.sequence += 1
+        return closed
@@ -0,0 +1,48 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from pytest import mark
+
+from download_tracks import RecentTracksPage, SegmentPageWriter
+from last_fm_model import Track
+from manifest import Manifest
+from util import load_tracks_data
+
+date_from = datetime(2024, 3, 1, tzinfo=timezone.utc)
+date_to = datetime(2024, 3, 31, tzinfo=timezone.utc)
+
+
+def page(number: int, tracks: list[Track]) -> RecentTracksPage:
+    return RecentTracksPage(
+        content=b"",
+        tracks=tracks,
+        page=number,
+        total_pages=3,
+        total_tracks=3 * len(tracks),
+        elapsed_time=timedelta(),
+    )
+
+
+@mark.parametrize("format", ["ndjson.gz", "ndjson.zst"])
+def test_segments_round_trip(tmp_path, format, make_track):
+    manifest = Manifest(str(tmp_path))
+    pages = [
+        page(n, [make_track(1711782712 - 10 * n - i) for i in range(5)])
+        for n in [1, 2, 3]
+    ]
+
+    with SegmentPageWriter(manifest, format, segment_bytes=2000) as writer:
+        for p in pages:
+            writer.write(date_from, date_to, p)
+
+    segments = sorted(f for f in os.listdir(tmp_path) if f.endswith(format))
+    assert len(segments) > 1
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".part")]
+
+    reloaded = Manifest.load(str(tmp_path))
+    assert reloaded.missing_pages(date_from, date_to) == []
+
+    tracks = load_tracks_data(str(tmp_path))
+    assert sorted(tracks, key=lambda t: t.timestamp.time) == sorted(
+        (t for p in pages for t in p.tracks), key=lambda t: t.timestamp.time
+    )
@@ -0,0 +1,535 @@
+import fcntl
+import json
+import logging
+import marshal
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections import Counter
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timezone
+from typing import Optional
+
+from approx_stats import ApproxStats
+from rollups import GRANULARITIES, Pair, Rollups, period_name
+from snapshot import load_with_snapshot
+from store import AlbumStats, Store, is_ranked
+from track_store import TrackStore
+from util import file_key, tracks_files
+
+SHARED_FILE_NAME = ".shared"
+MAGIC = b"RECHSHM2"
+
+# The magic is followed by the offset of the header, which is written last.
+PREAMBLE = struct.Struct("<8sQ")
+
+# The columns of the rows, then the aggregates of every album by album ID. The
+# plays of album i are positions[position_offsets[i] : position_offsets[i + 1]].
+# Then the rollups: the rows of bucket b are rollup_offsets[b] to
+# rollup_offsets[b + 1], and the rows of album i are listed in rollup_rows like
+# its plays are in positions. Then the arrays of the approximate stats.
+COLUMNS = (
+    ("timestamps", "q"),
+    ("artist_ids", "i"),
+    ("album_ids", "i"),
+    ("track_ids", "i"),
+    ("playcounts", "q"),
+    ("first_played", "q"),
+    ("last_played", "q"),
+    ("position_offsets", "q"),
+    ("positions", "i"),
+    ("ranking", "i"),
+    ("rollup_offsets", "q"),
+    ("rollup_buckets", "i"),
+    ("rollup_albums", "i"),
+    ("rollup_artists", "i"),
+    ("rollup_counts", "q"),
+    ("rollup_row_offsets", "q"),
+    ("rollup_rows", "i"),
+    ("artist_registers", "B"),
+    ("album_registers", "B"),
+    ("track_registers", "B"),
+    ("artist_counts", "q"),
+    ("album_counts", "q"),
+)
+
+
+@dataclass(frozen=True)
+class SharedHeader:
+    rows: int
+    # The offset of every column, by name, and its number of items
+    columns: dict[str, tuple[int, int]]
+    tables_offset: int
+    tables_length: int
+    # The modification time and size of every tracks file, by name
+    files: dict[str, tuple[int, int]]
+
+
+def scan_files(dir: str) -> dict[str, tuple[int, int]]:
+    return {os.path.basename(f): file_key(f) for f in tracks_files(dir)}
+
+
+def album_columns(tracks: TrackStore) -> dict[str, array]:
+    """
+    Aggregate the plays of every album of a sorted store, as Store does, into columns.
+    """
+    album_count = len(tracks.album_keys)
+    playcounts = array("q", [0]) * album_count
+    first_played = array("q", [0]) * album_count
+    last_played = array("q", [0]) * album_count
+
+    for position, album_id in enumerate(tracks.album_ids):
+        played_at = tracks.timestamps[position]
+        if playcounts[album_id] == 0:
+            first_played[album_id] = played_at
+        playcounts[album_id] += 1
+        last_played[album_id] = played_at
+
+    position_offsets = array("q", [0]) * (album_count + 1)
+    for album_id in range(album_count):
+        position_offsets[album_id + 1] = (
+            position_offsets[album_id] + playcounts[album_id]
+        )
+
+    positions = array("i", [0]) * len(tracks)
+    filled = array("q", position_offsets[:-1])
+    for position, album_id in enumerate(tracks.album_ids):
+        positions[filled[album_id]] = position
+        filled[album_id] += 1
+
+    # The order of Store: by playcount, ties in the order the albums were first played
+    played = [album_id for album_id in range(album_count) if playcounts[album_id]]
+    played.sort(key=lambda album_id: positions[position_offsets[album_id]])
+    ranking = array(
+        "i",
+        sorted(
+            (i for i in played if is_ranked(tracks.album(i))),
+            key=playcounts.__getitem__,
+            reverse=True,
+        ),
+    )
+
+    return {
+        "playcounts": playcounts,
+        "first_played": first_played,
+        "last_played": last_played,
+        "position_offsets": position_offsets,
+        "positions": positions,
+        "ranking": ranking,
+    }
+
+
+def rollup_columns(tracks: TrackStore) -> tuple[dict[str, array], list[list[str]]]:
+    """
+    Count the plays of every album and artist per day, month and year, as Rollups
+    does, into columns. Returns them and the periods of every granularity, in order.
+    """
+    daily = Counter(
+        zip(
+            [t // 86400 for t in tracks.timestamps], tracks.album_ids, tracks.artist_ids
+        )
+    )
+    days = {
+        day: datetime.fromtimestamp(day * 86400, tz=timezone.utc).date()
+        for day in {day for day, _, _ in daily}
+    }
+
+    periods = []
+    offsets = array("q")
+    buckets, albums, artists, counts = array("i"), array("i"), array("i"), array("q")
+    for granularity in GRANULARITIES:
+        playcounts: Counter[tuple[str, int, int]] = Counter()
+        for (day, album_id, artist_id), count in daily.items():
+            period = period_name(days[day], granularity)
+            playcounts[period, album_id, artist_id] += count
+
+        names: list[str] = []
+        for (period, album_id, artist_id), count in sorted(playcounts.items()):
+            if not names or names[-1] != period:
+                names.append(period)
+                offsets.append(len(albums))
+            buckets.append(len(offsets) - 1)
+            albums.append(album_id)
+            artists.append(artist_id)
+            counts.append(count)
+        periods.append(names)
+    offsets.append(len(albums))
+
+    album_count = len(tracks.album_keys)
+    row_offsets = array("q", [0]) * (album_count + 1)
+    for album_id in albums:
+        row_offsets[album_id + 1] += 1
+    for album_id in range(album_count):
+        row_offsets[album_id + 1] += row_offsets[album_id]
+
+    rows = array("i", [0]) * len(albums)
+    filled = array("q", row_offsets[:-1])
+    for row, album_id in enumerate(albums):
+        rows[filled[album_id]] = row
+        filled[album_id] += 1
+
+    columns = {
+        "rollup_offsets": offsets,
+        "rollup_buckets": buckets,
+        "rollup_albums": albums,
+        "rollup_artists": artists,
+        "rollup_counts": counts,
+        "rollup_row_offsets": row_offsets,
+        "rollup_rows": rows,
+    }
+    return columns, periods
+
+
+def approx_columns(approx: ApproxStats) -> tuple[dict[str, array], tuple]:
+    """
+    Return the arrays of approximate stats as columns, and the rest of them.
+    """
+    columns = {
+        "artist_registers": array("B", approx.artists.registers),
+        "album_registers": array("B", approx.albums.registers),
+        "track_registers": array("B", approx.tracks.registers),
+        "artist_counts": approx.artist_counts.counts,
+        "album_counts": approx.album_counts.counts,
+    }
+    rest = (
+        approx.artist_counts.total,
+        approx.album_counts.total,
+        approx.top_artist_keys.counters,
+        approx.top_album_keys.counters,
+    )
+    return columns, rest
+
+
+def write_shared(path: str, tracks: TrackStore, files: dict[str, tuple[int, int]]):
+    """
+    Write a sorted store, the aggregates of its albums, its rollups and its
+    approximate stats as a shared dataset.
+
+    Every column starts at a multiple of 8 bytes, so it can be used in place.
+    """
+    if not tracks.is_sorted:
+        raise ValueError("The tracks must be sorted")
+
+    approx = ApproxStats()
+    approx.update(tracks)
+    rollups, periods = rollup_columns(tracks)
+    sketches, sketch_rest = approx_columns(approx)
+
+    columns = {
+        "timestamps": tracks.timestamps,
+        "artist_ids": tracks.artist_ids,
+        "album_ids": tracks.album_ids,
+        "track_ids": tracks.track_ids,
+        **album_columns(tracks),
+        **rollups,
+        **sketches,
+    }
+    tmp_path = f"{path}.tmp"
+
+    with open(tmp_path, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, 0))
+
+        offsets = {}
+        for name, _ in COLUMNS:
+            f.write(b"\0" * (-f.tell() % 8))
+            offsets[name] = (f.tell(), len(columns[name]))
+            f.write(columns[name].tobytes())
+
+        tables = marshal.dumps(
+            (
+                tracks.artist_keys,
+                tracks.album_keys,
+                tracks.album_images,
+                tracks.track_keys,
+                periods,
+                sketch_rest,
+            )
+        )
+        tables_offset = f.tell()
+        f.write(tables)
+
+        header = SharedHeader(
+            rows=len(tracks),
+            columns=offsets,
+            tables_offset=tables_offset,
+            tables_length=len(tables),
+            files=files,
+        )
+        header_offset = f.tell()
+        f.write(json.dumps(asdict(header)).encode("utf-8"))
+
+        f.seek(0)
+        f.write(PREAMBLE.pack(MAGIC, header_offset))
+
+    os.replace(tmp_path, path)
+
+
+def read_shared_header(mm: mmap.mmap) -> Optional[SharedHeader]:
+    """
+    Read the header of a shared dataset, or return None if it is not a usable one.
+    """
+    if len(mm) < PREAMBLE.size:
+        return None
+
+    magic, header_offset = PREAMBLE.unpack(mm[: PREAMBLE.size])
+    if magic != MAGIC or header_offset == 0:
+        return None
+
+    data = json.loads(mm[header_offset:])
+    return SharedHeader(
+        rows=data["rows"],
+        columns={name: tuple(column) for name, column in data["columns"].items()},
+        tables_offset=data["tables_offset"],
+        tables_length=data["tables_length"],
+        files={name: tuple(key) for name, key in data["files"].items()},
+    )
+
+
+class SharedTrackStore(TrackStore):
+    """
+    A read-only TrackStore whose columns are views of a memory-mapped shared dataset.
+
+    The pages of the columns are shared by every process that attaches to the
+    same file, so they are held in memory once however many processes serve
+    them. Only the tables of artists, albums and tracks are copied into each
+    process, and they grow with the catalogue rather than with the plays.
+    """
+
+    def append(self, track):
+        raise TypeError("A shared store is read-only")
+
+    def extend_store(self, other: TrackStore):
+        raise TypeError("A shared store is read-only")
+
+    def sort(self) -> int:
+        return len(self)
+
+
+class SharedStore(Store):
+    """
+    The album index of a shared dataset, read from its aggregates rather than built
+    from the plays. The positions of the plays of every album are views of the file.
+    """
+
+    def __init__(self, tracks: SharedTrackStore, columns: dict[str, memoryview]):
+        self.tracks = tracks
+        self.keeps_positions = True
+        self.indexed = len(tracks)
+        self._stats = {}
+
+        offsets = columns["position_offsets"]
+        for album_id, playcount in enumerate(columns["playcounts"]):
+            if playcount == 0:
+                continue
+            album = tracks.album(album_id)
+            self._stats[album] = AlbumStats(
+                album,
+                playcount,
+                columns["first_played"][album_id],
+                columns["last_played"][album_id],
+                columns["positions"][offsets[album_id] : offsets[album_id + 1]],
+            )
+
+        self._rank([self._stats[tracks.album(i)] for i in columns["ranking"]])
+
+    def update(self):
+        pass
+
+
+class SharedRollups(Rollups):
+    """
+    The rollups of a shared dataset. The buckets are read from views of the file
+    when a period is ranked, so only the names of the periods are copied.
+    """
+
+    def __init__(
+        self,
+        tracks: SharedTrackStore,
+        columns: dict[str, memoryview],
+        periods: list[list[str]],
+    ):
+        self.tracks = tracks
+        self.indexed = len(tracks)
+        self.columns = columns
+        self.periods = dict(zip(GRANULARITIES, periods))
+
+        # The index of the first bucket of every granularity in the columns,
+        # and of every bucket by granularity and period
+        self.first_bucket: dict[str, int] = {}
+        self.bucket_index: dict[str, dict[str, int]] = {}
+        first = 0
+        for granularity, names in self.periods.items():
+            self.first_bucket[granularity] = first
+            self.bucket_index[granularity] = {
+                name: first + i for i, name in enumerate(names)
+            }
+            first += len(names)
+
+        # The IDs of the albums of every MBID, for timelines
+        self.album_ids: dict[str, list[int]] = {}
+        for album_id, (mbid, _) in enumerate(tracks.album_keys):
+            self.album_ids.setdefault(mbid, []).append(album_id)
+
+        days = self.periods["day"]
+        self.first_day = date.fromisoformat(days[0]) if days else None
+        self.last_day = date.fromisoformat(days[-1]) if days else None
+
+    def update(self):
+        pass
+
+    def bucket(self, granularity: str, period: str) -> Optional[Counter[Pair]]:
+        index = self.bucket_index[granularity].get(period)
+        if index is None:
+            return None
+
+        columns, tracks = self.columns, self.tracks
+        start, end = columns["rollup_offsets"][index : index + 2]
+        return Counter(
+            {
+                (tracks.album(album_id), tracks.artist(artist_id)): count
+                for album_id, artist_id, count in zip(
+                    columns["rollup_albums"][start:end],
+                    columns["rollup_artists"][start:end],
+                    columns["rollup_counts"][start:end],
+                )
+            }
+        )
+
+    def album_playcounts(self, mbid: str, granularity: str) -> dict[str, int]:
+        columns = self.columns
+        offsets = columns["rollup_row_offsets"]
+        names = self.periods[granularity]
+        first = self.first_bucket[granularity]
+
+        playcounts: dict[str, int] = {}
+        for album_id in self.album_ids.get(mbid, ()):
+            for row in columns["rollup_rows"][
+                offsets[album_id] : offsets[album_id + 1]
+            ]:
+                bucket = columns["rollup_buckets"][row] - first
+                if 0 <= bucket < len(names):
+                    period = names[bucket]
+                    playcounts[period] = (
+                        playcounts.get(period, 0) + columns["rollup_counts"][row]
+                    )
+        return playcounts
+
+
+def shared_approx(columns: dict[str, memoryview], rest: tuple) -> ApproxStats:
+    """
+    Return the approximate stats of a shared dataset. The Count-Min counters are
+    views of the file; the registers and the heavy hitters are small and copied.
+    """
+    approx = ApproxStats()
+    approx.artists.registers = bytearray(columns["artist_registers"])
+    approx.albums.registers = bytearray(columns["album_registers"])
+    approx.tracks.registers = bytearray(columns["track_registers"])
+    approx.artist_counts.counts = columns["artist_counts"]
+    approx.album_counts.counts = columns["album_counts"]
+    (
+        approx.artist_counts.total,
+        approx.album_counts.total,
+        approx.top_artist_keys.counters,
+        approx.top_album_keys.counters,
+    ) = rest
+    return approx
+
+
+Attached = tuple[SharedTrackStore, SharedStore, SharedRollups, ApproxStats]
+
+
+def attach(path: str) -> Optional[Attached]:
+    """
+    Map a shared dataset into memory, or return None if the file is not a usable one.
+    """
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    header = read_shared_header(mm)
+    if header is None:
+        mm.close()
+        return None
+
+    view = memoryview(mm)
+    columns = {
+        name: view[offset : offset + length * array(typecode).itemsize].cast(typecode)
+        for (name, typecode), (offset, length) in (
+            (column, header.columns[column[0]]) for column in COLUMNS
+        )
+    }
+
+    tables = marshal.loads(
+        view[header.tables_offset : header.tables_offset + header.tables_length]
+    )
+    *catalogue, periods, sketch_rest = tables
+    tracks = SharedTrackStore.from_tables(*catalogue)
+    tracks.timestamps = columns["timestamps"]
+    tracks.artist_ids = columns["artist_ids"]
+    tracks.album_ids = columns["album_ids"]
+    tracks.track_ids = columns["track_ids"]
+    tracks._sorted_length = header.rows
+
+    return (
+        tracks,
+        SharedStore(tracks, columns),
+        SharedRollups(tracks, columns, periods),
+        shared_approx(columns, sketch_rest),
+    )
+
+
+def is_current(path: str, files: dict[str, tuple[int, int]]) -> bool:
+    """
+    Return True if the shared dataset was built from exactly these files.
+    """
+    try:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header = read_shared_header(mm)
+    except (FileNotFoundError, ValueError):
+        return False
+
+    return header is not None and header.files == files
+
+
+def load_shared(
+    dir: str,
+    path: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> Attached:
+    """
+    Attach to the shared dataset of the directory, building it first if it is
+    missing or any tracks file changed.
+
+    Processes serving the same directory, such as uvicorn workers, take a lock
+    to build it, so it is built by the first of them while the others wait and
+    then attach to it.
+    """
+    logger = logging.getLogger(__name__)
+
+    if path is None:
+        path = os.path.join(dir, SHARED_FILE_NAME)
+
+    start = time.perf_counter()
+
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            files = scan_files(dir)
+            if not is_current(path, files):
+                logger.info(f"Building the shared dataset {path}")
+                write_shared(path, load_with_snapshot(dir, workers=workers), files)
+
+            attached = attach(path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    if attached is None:
+        raise ValueError(f"{path} is not a shared dataset")
+
+    logger.info(
+        f"Attached to {len(attached[0])} tracks in {time.perf_counter() - start:.2f} seconds"
+    )
+
+    return attached
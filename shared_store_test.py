@@ -0,0 +1,64 @@
+import os
+from datetime import date
+
+from approx_stats import ApproxStats
+from rollups import Rollups
+from shared_store import SHARED_FILE_NAME, load_shared
+from snapshot import load_with_snapshot
+from store import Store
+
+
+def test_shared_dataset_matches_the_store(tmp_path, write_page, plays):
+    write_page(tmp_path, "tracks_0001.json", plays[: len(plays) // 2])
+    write_page(tmp_path, "tracks_0002.json", plays[len(plays) // 2 :])
+
+    tracks, store, _, _ = load_shared(str(tmp_path), workers=1)
+    expected_tracks = load_with_snapshot(str(tmp_path), workers=1)
+    expected = Store(expected_tracks)
+
+    assert list(tracks) == list(expected_tracks)
+    assert tracks.is_sorted
+    assert store.ranked_albums
+    assert store.ranked_albums == expected.ranked_albums
+    assert store.summaries == expected.summaries
+    for mbid in expected.albums:
+        assert store.details(mbid) == expected.details(mbid)
+        assert store.tracks_in_album(mbid) == expected.tracks_in_album(mbid)
+
+
+def test_shared_dataset_is_rebuilt_when_files_change(tmp_path, write_page):
+    write_page(tmp_path, "tracks_0001.json", [1711782712])
+    load_shared(str(tmp_path), workers=1)
+    built = os.stat(tmp_path / SHARED_FILE_NAME).st_mtime_ns
+
+    load_shared(str(tmp_path), workers=1)
+    assert os.stat(tmp_path / SHARED_FILE_NAME).st_mtime_ns == built
+
+    write_page(tmp_path, "tracks_0002.json", [1711700000])
+    tracks, store, _, _ = load_shared(str(tmp_path), workers=1)
+
+    assert len(tracks) == 2
+    assert store.indexed == 2
+
+
+def test_shared_rollups_and_sketches_match_built_ones(tmp_path, write_page, plays):
+    write_page(tmp_path, "tracks_0001.json", [*plays, ("suede", "Sleeping Pills", 1)])
+
+    tracks, _, rollups, approx = load_shared(str(tmp_path), workers=1)
+    expected_tracks = load_with_snapshot(str(tmp_path), workers=1)
+    expected = Rollups(expected_tracks)
+    expected_approx = ApproxStats()
+    expected_approx.update(expected_tracks)
+
+    for period in ["1970", "2024-03", "2024-03-30", "2024-03-31"]:
+        assert rollups.top_of_period(period, 10) == expected.top_of_period(period, 10)
+    assert rollups.top(date.min, date.max, 10) == expected.top(date.min, date.max, 10)
+    for granularity in ["day", "month", "year"]:
+        assert rollups.timeline("suede", granularity) == expected.timeline(
+            "suede", granularity
+        )
+    assert rollups.timeline("unknown", "day") == []
+
+    assert approx.distinct_tracks() == expected_approx.distinct_tracks() == 4
+    assert approx.top_albums() == expected_approx.top_albums()
+    assert approx.top_artists() == expected_approx.top_artists()
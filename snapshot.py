@@ -0,0 +1,281 @@
+import json
+import logging
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+import time
+from array import array
+from dataclasses import asdict, dataclass
+from functools import partial
+from collections.abc import Callable
+from typing import Optional
+
+from track_store import TrackStore
+from util import file_key, load_track_files, tracks_files
+
+SNAPSHOT_FILE_NAME = ".snapshot"
+MAGIC = b"RECHORD1"
+
+# The magic is followed by the offset of the header, which is written last.
+PREAMBLE = struct.Struct("<8sQ")
+
+
+@dataclass(frozen=True)
+class Section:
+    """
+    The rows parsed from one tracks file, stored as consecutive column arrays.
+    """
+
+    file: str
+    mtime_ns: int
+    size: int
+    offset: int
+    rows: int
+
+
+@dataclass(frozen=True)
+class Header:
+    tables_offset: int
+    tables_length: int
+    sections: list[Section]
+    timestamp_itemsize: int = array("q").itemsize
+    id_itemsize: int = array("i").itemsize
+
+
+def read_header(f) -> Optional[Header]:
+    """
+    Read the header of a snapshot, or return None if the file is not a usable snapshot.
+    """
+    preamble = f.read(PREAMBLE.size)
+    if len(preamble) < PREAMBLE.size:
+        return None
+
+    magic, header_offset = PREAMBLE.unpack(preamble)
+    if magic != MAGIC or header_offset == 0:
+        return None
+
+    f.seek(header_offset)
+    try:
+        data = json.loads(f.read())
+        header = Header(
+            tables_offset=data["tables_offset"],
+            tables_length=data["tables_length"],
+            sections=[Section(**section) for section in data["sections"]],
+            timestamp_itemsize=data["timestamp_itemsize"],
+            id_itemsize=data["id_itemsize"],
+        )
+    except (ValueError, KeyError, TypeError):
+        return None
+
+    if (
+        header.timestamp_itemsize != array("q").itemsize
+        or header.id_itemsize != array("i").itemsize
+    ):
+        return None
+
+    return header
+
+
+def read_section(store: TrackStore, mm: mmap.mmap, section: Section):
+    """
+    Append the rows of a section to a store whose tables are the snapshot tables.
+    """
+    offset = section.offset
+
+    for column in (
+        store.timestamps,
+        store.artist_ids,
+        store.album_ids,
+        store.track_ids,
+    ):
+        length = section.rows * column.itemsize
+        column.frombytes(mm[offset : offset + length])
+        offset += length
+
+
+def read_tables(mm: mmap.mmap, header: Header) -> Optional[tuple]:
+    """
+    Read the tables of a snapshot, or return None if they are not readable.
+    """
+    try:
+        return marshal.loads(
+            mm[header.tables_offset : header.tables_offset + header.tables_length]
+        )
+    except (ValueError, EOFError, TypeError):
+        return None
+
+
+def write_snapshot(
+    path: str,
+    store: TrackStore,
+    ranges: list[tuple[str, int, int]],
+    keys: dict[str, tuple[int, int]],
+):
+    """
+    Write the rows of every file of the store as a section of a new snapshot.
+
+    `keys` holds the modification time and size of every file, taken before it
+    was parsed. Rows are sorted by time within each section and sections are
+    ordered by their first row. Pages do not overlap in time, so a store read
+    back from the snapshot is usually in order without sorting.
+
+    The snapshot is written to a temporary file of its own and moved into
+    place, so processes that load the same directory at once do not clash.
+    """
+    sections = []
+    ordered = []
+    for tracks_file, start, end in ranges:
+        order = sorted(range(start, end), key=store.timestamps.__getitem__)
+        first = store.timestamps[order[0]] if order else 0
+        ordered.append((first, tracks_file, order))
+
+    ordered.sort(key=lambda section: section[0])
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}."
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(PREAMBLE.pack(MAGIC, 0))
+
+            tables = marshal.dumps(
+                (
+                    store.artist_keys,
+                    store.album_keys,
+                    store.album_images,
+                    store.track_keys,
+                )
+            )
+            tables_offset = f.tell()
+            f.write(tables)
+
+            for _, tracks_file, order in ordered:
+                mtime_ns, size = keys[tracks_file]
+                sections.append(
+                    Section(
+                        file=os.path.basename(tracks_file),
+                        mtime_ns=mtime_ns,
+                        size=size,
+                        offset=f.tell(),
+                        rows=len(order),
+                    )
+                )
+                f.write(array("q", (store.timestamps[i] for i in order)).tobytes())
+                f.write(array("i", (store.artist_ids[i] for i in order)).tobytes())
+                f.write(array("i", (store.album_ids[i] for i in order)).tobytes())
+                f.write(array("i", (store.track_ids[i] for i in order)).tobytes())
+
+            header = Header(
+                tables_offset=tables_offset,
+                tables_length=len(tables),
+                sections=sections,
+            )
+            header_offset = f.tell()
+            f.write(json.dumps(asdict(header)).encode("utf-8"))
+
+            f.seek(0)
+            f.write(PREAMBLE.pack(MAGIC, header_offset))
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def report_progress(
+    progress: Callable[[int, int], None],
+    files_before: int,
+    tracks_before: int,
+    files: int,
+    tracks: int,
+):
+    progress(files_before + files, tracks_before + tracks)
+
+
+def load_with_snapshot(
+    dir: str,
+    snapshot_path: Optional[str] = None,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> TrackStore:
+    """
+    Load the tracks in the directory into a TrackStore, ordered by the time they
+    were played, reusing the rows of unchanged files from a snapshot.
+
+    A file is unchanged if its name, modification time and size match its
+    section in the snapshot. Only new and changed files are parsed. The snapshot
+    is rewritten whenever files were parsed or removed. If given, `progress` is
+    called with the numbers of files and tracks loaded so far.
+    """
+    logger = logging.getLogger(__name__)
+
+    if snapshot_path is None:
+        snapshot_path = os.path.join(dir, SNAPSHOT_FILE_NAME)
+
+    start = time.perf_counter()
+    files = {os.path.basename(f): f for f in tracks_files(dir)}
+    # Taken before any file is parsed, so a file rewritten during the load is
+    # cached with its old key and parsed again on the next load
+    keys = {f: file_key(f) for f in files.values()}
+    store = TrackStore()
+    ranges = []
+    stale = dict(files)
+    removed = False
+
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, "rb") as f:
+            header = read_header(f)
+
+            if header is not None:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    tables = read_tables(mm, header)
+                    if tables is None:
+                        logger.warning(f"Rebuilding the unreadable {snapshot_path}")
+                        header = Header(0, 0, [])
+                    else:
+                        store = TrackStore.from_tables(*tables)
+
+                    for section in header.sections:
+                        tracks_file = files.get(section.file)
+
+                        if tracks_file is None:
+                            removed = True
+                            continue
+
+                        if keys[tracks_file] != (section.mtime_ns, section.size):
+                            continue
+
+                        start_row = len(store)
+                        read_section(store, mm, section)
+                        ranges.append((tracks_file, start_row, len(store)))
+                        del stale[section.file]
+
+    logger.info(
+        f"Read {len(store)} tracks from the snapshot, {len(stale)} files are new or changed"
+    )
+
+    reused, offset = len(files) - len(stale), len(store)
+    report = None
+    if progress is not None:
+        progress(reused, offset)
+        report = partial(report_progress, progress, reused, offset)
+
+    if stale or removed:
+        parsed, parsed_ranges = load_track_files(
+            list(stale.values()), workers=workers, progress=report
+        )
+
+        store.extend_store(parsed)
+        ranges.extend((f, offset + s, offset + e) for f, s, e in parsed_ranges)
+
+        write_snapshot(snapshot_path, store, ranges, keys)
+
+    store.sort()
+
+    logger.info(
+        f"Loaded {len(store)} tracks from {len(files)} files in {time.perf_counter() - start:.2f} seconds"
+    )
+
+    return store
@@ -0,0 +1,66 @@
+import os
+
+import snapshot
+from snapshot import SNAPSHOT_FILE_NAME, load_with_snapshot
+
+
+def test_load_with_snapshot_parses_only_changed_files(
+    tmp_path, monkeypatch, write_page
+):
+    write_page(tmp_path, "tracks_0001.json", [1711782712, 1711782000])
+    write_page(tmp_path, "tracks_0002.json", [1711781500, 1711781000])
+
+    cold = load_with_snapshot(str(tmp_path), workers=1)
+    assert os.path.exists(tmp_path / SNAPSHOT_FILE_NAME)
+
+    parsed = []
+    load_track_files = snapshot.load_track_files
+
+    def recording_load_track_files(files, workers=None, progress=None):
+        parsed.extend(os.path.basename(f) for f in files)
+        return load_track_files(files, workers=workers, progress=progress)
+
+    monkeypatch.setattr(snapshot, "load_track_files", recording_load_track_files)
+
+    warm = load_with_snapshot(str(tmp_path), workers=1)
+    assert parsed == []
+    assert list(warm) == list(cold)
+
+    write_page(tmp_path, "tracks_0002.json", [1711781500, 1711781000, 1711780000])
+    os.remove(tmp_path / "tracks_0001.json")
+
+    changed = load_with_snapshot(str(tmp_path), workers=1)
+    assert parsed == ["tracks_0002.json"]
+    assert list(changed.timestamps) == [1711780000, 1711781000, 1711781500]
+
+
+def test_load_with_snapshot_rebuilds_an_unreadable_snapshot(tmp_path, write_page):
+    write_page(tmp_path, "tracks_0001.json", [1711782712, 1711782000])
+    cold = load_with_snapshot(str(tmp_path), workers=1)
+
+    with open(tmp_path / SNAPSHOT_FILE_NAME, "r+b") as f:
+        f.seek(-8, os.SEEK_END)
+        f.write(b"not json")
+
+    assert list(load_with_snapshot(str(tmp_path), workers=1)) == list(cold)
+    assert [f for f in os.listdir(tmp_path) if f.startswith(".")] == [
+        SNAPSHOT_FILE_NAME
+    ]
+
+
+def test_load_with_snapshot_keys_files_before_parsing_them(
+    tmp_path, monkeypatch, write_page
+):
+    write_page(tmp_path, "tracks_0001.json", [1711782712])
+    load_track_files = snapshot.load_track_files
+
+    def rewriting_load_track_files(files, workers=None, progress=None):
+        loaded = load_track_files(files, workers=workers, progress=progress)
+        write_page(tmp_path, "tracks_0001.json", [1711782712, 1711782000])
+        return loaded
+
+    monkeypatch.setattr(snapshot, "load_track_files", rewriting_load_track_files)
+    assert len(load_with_snapshot(str(tmp_path), workers=1)) == 1
+
+    monkeypatch.setattr(snapshot, "load_track_files", load_track_files)
+    assert len(load_with_snapshot(str(tmp_path), workers=1)) == 2
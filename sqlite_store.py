@@ -0,0 +1,447 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+from collections.abc import Iterator, Sequence
+from datetime import datetime, timezone
+from typing import Any, Optional, overload
+
+from last_fm_model import Album, Artist, Image, Timestamp, Track
+from track_store import Play
+from util import file_key, load_tracks_file, tracks_files
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artists (
+    id INTEGER PRIMARY KEY,
+    mbid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (mbid, name)
+);
+
+CREATE TABLE IF NOT EXISTS albums (
+    id INTEGER PRIMARY KEY,
+    mbid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    images TEXT NOT NULL,
+    UNIQUE (mbid, name)
+);
+
+CREATE INDEX IF NOT EXISTS albums_mbid ON albums (mbid);
+
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    played_at INTEGER NOT NULL,
+    artist_id INTEGER NOT NULL REFERENCES artists (id),
+    album_id INTEGER NOT NULL REFERENCES albums (id),
+    name TEXT NOT NULL,
+    mbid TEXT NOT NULL,
+    url TEXT NOT NULL,
+    UNIQUE (played_at, artist_id, name)
+);
+
+CREATE INDEX IF NOT EXISTS tracks_played_at ON tracks (played_at);
+
+CREATE INDEX IF NOT EXISTS tracks_album_id ON tracks (album_id, played_at);
+
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+SELECT_TRACKS = """
+SELECT tracks.played_at, tracks.name, tracks.mbid, tracks.url,
+       artists.id, artists.mbid, artists.name,
+       albums.id, albums.mbid, albums.name, albums.images
+FROM tracks
+JOIN artists ON artists.id = tracks.artist_id
+JOIN albums ON albums.id = tracks.album_id
+"""
+
+
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def ingest(connection: sqlite3.Connection, dir: str) -> int:
+    """
+    Load the tracks files in the directory into the database and return the number of new tracks.
+
+    Files whose modification time and size are unchanged since they were last
+    ingested are skipped. Plays are unique by time, artist and track name, so
+    overlapping pages are stored once.
+    """
+    logger = logging.getLogger(__name__)
+
+    ingested = {
+        name: (mtime_ns, size)
+        for name, mtime_ns, size in connection.execute(
+            "SELECT name, mtime_ns, size FROM files"
+        )
+    }
+    artists = {
+        (mbid, name): id
+        for id, mbid, name in connection.execute("SELECT id, mbid, name FROM artists")
+    }
+    albums = {
+        (mbid, name): id
+        for id, mbid, name in connection.execute("SELECT id, mbid, name FROM albums")
+    }
+
+    def artist_id(artist: Artist) -> int:
+        key = (artist.mbid, artist.name)
+        if key not in artists:
+            artists[key] = connection.execute(
+                "INSERT INTO artists (mbid, name) VALUES (?, ?)", key
+            ).lastrowid
+        return artists[key]
+
+    def album_id(track: Track) -> int:
+        key = (track.album.mbid, track.album.name)
+        if key not in albums:
+            images = json.dumps([(image.size, image.url) for image in track.images])
+            albums[key] = connection.execute(
+                "INSERT INTO albums (mbid, name, images) VALUES (?, ?, ?)",
+                (*key, images),
+            ).lastrowid
+        return albums[key]
+
+    total = 0
+
+    for tracks_file in tracks_files(dir):
+        name = os.path.basename(tracks_file)
+        key = file_key(tracks_file)
+
+        if ingested.get(name) == key:
+            continue
+
+        tracks = load_tracks_file(tracks_file)
+
+        with connection:
+            cursor = connection.executemany(
+                "INSERT OR IGNORE INTO tracks (played_at, artist_id, album_id, name, mbid, url) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        int(track.timestamp.time.timestamp()),
+                        artist_id(track.artist),
+                        album_id(track),
+                        track.name,
+                        track.mbid,
+                        track.url,
+                    )
+                    for track in tracks
+                ],
+            )
+            added = cursor.rowcount
+            connection.execute(
+                "INSERT OR REPLACE INTO files (name, mtime_ns, size) VALUES (?, ?, ?)",
+                (name, *key),
+            )
+
+        logger.debug(f"Ingested {added} new tracks from {name}")
+        total += added
+
+    return total
+
+
+class SqliteTracks(Sequence[Track]):
+    """
+    The tracks in a database, or the subset of them that matches a condition.
+
+    Nothing is loaded into memory up front. The filters return new SqliteTracks
+    with a narrower condition, and the aggregates in stats run as indexed SQL
+    queries on them. Iterating yields tracks in the order they were played.
+    """
+
+    def __init__(
+        self,
+        connection: sqlite3.Connection,
+        where: str = "",
+        params: tuple[Any, ...] = (),
+        cache: Optional[dict[tuple[str, int], Any]] = None,
+    ):
+        self.connection = connection
+        self.where = where
+        self.params = params
+        self._cache = cache if cache is not None else {}
+
+    @classmethod
+    def open(cls, path: str) -> "SqliteTracks":
+        return cls(connect(path))
+
+    def _filter(self, condition: str, params: tuple[Any, ...]) -> "SqliteTracks":
+        where = f"{self.where} AND ({condition})" if self.where else f"({condition})"
+        return SqliteTracks(self.connection, where, self.params + params, self._cache)
+
+    @property
+    def _where_clause(self) -> str:
+        return f"WHERE {self.where}" if self.where else ""
+
+    def _artist(self, artist_id: int, mbid: str, name: str) -> Artist:
+        artist = self._cache.get(("artist", artist_id))
+        if artist is None:
+            artist = self._cache[("artist", artist_id)] = Artist(
+                **{"mbid": mbid, "#text": name}
+            )
+        return artist
+
+    def _album(self, album_id: int, mbid: str, name: str) -> Album:
+        album = self._cache.get(("album", album_id))
+        if album is None:
+            album = self._cache[("album", album_id)] = Album(
+                **{"mbid": mbid, "#text": name}
+            )
+        return album
+
+    def _track(self, row: tuple) -> Track:
+        played_at, name, mbid, url, artist_id, artist_mbid, artist_name = row[:7]
+        album_id, album_mbid, album_name, images = row[7:]
+
+        artist = self._artist(artist_id, artist_mbid, artist_name)
+        album = self._album(album_id, album_mbid, album_name)
+
+        album_images = self._cache.get(("images", album_id))
+        if album_images is None:
+            album_images = self._cache[("images", album_id)] = [
+                Image(**{"size": size, "#text": image_url})
+                for size, image_url in json.loads(images)
+            ]
+
+        return Track(
+            **{
+                "artist": artist,
+                "mbid": mbid,
+                "album": album,
+                "name": name,
+                "url": url,
+                "image": album_images,
+                "date": Timestamp(uts=played_at),
+            }
+        )
+
+    def __len__(self) -> int:
+        (count,) = self.connection.execute(
+            f"SELECT COUNT(*) FROM tracks {self._where_clause}", self.params
+        ).fetchone()
+        return count
+
+    def __iter__(self) -> Iterator[Track]:
+        cursor = self.connection.execute(
+            f"{SELECT_TRACKS} {self._where_clause} ORDER BY tracks.played_at, tracks.id",
+            self.params,
+        )
+        for row in cursor:
+            yield self._track(row)
+
+    @overload
+    def __getitem__(self, index: int) -> Track: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Track]: ...
+
+    def __getitem__(self, index: int | slice) -> Track | list[Track]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return self._rows(limit=max(0, stop - start), offset=start)
+
+        if index < 0:
+            index += len(self)
+
+        rows = self._rows(limit=1, offset=index) if index >= 0 else []
+        if not rows:
+            raise IndexError("track index out of range")
+        return rows[0]
+
+    def _rows(self, limit: int, offset: int) -> list[Track]:
+        cursor = self.connection.execute(
+            f"{SELECT_TRACKS} {self._where_clause} ORDER BY tracks.played_at, tracks.id LIMIT ? OFFSET ?",
+            self.params + (limit, offset),
+        )
+        return [self._track(row) for row in cursor]
+
+    def tracks_between(self, date_from: datetime, date_to: datetime) -> "SqliteTracks":
+        return self._filter(
+            "tracks.played_at BETWEEN ? AND ?",
+            (date_from.timestamp(), date_to.timestamp()),
+        )
+
+    def tracks_in_album(self, album: Album) -> "SqliteTracks":
+        return self._filter(
+            "tracks.album_id IN (SELECT id FROM albums WHERE mbid = ? AND name = ?)",
+            (album.mbid, album.name),
+        )
+
+    def unique_albums(self) -> set[Album]:
+        cursor = self.connection.execute(
+            f"SELECT DISTINCT albums.mbid, albums.name FROM tracks JOIN albums ON albums.id = tracks.album_id {self._where_clause}",
+            self.params,
+        )
+        return {Album(**{"mbid": mbid, "#text": name}) for mbid, name in cursor}
+
+    def first_and_last_listen(self) -> tuple[datetime, datetime]:
+        first, last = self.connection.execute(
+            f"SELECT MIN(played_at), MAX(played_at) FROM tracks {self._where_clause}",
+            self.params,
+        ).fetchone()
+
+        if first is None:
+            raise ValueError("No tracks provided")
+
+        return (
+            datetime.fromtimestamp(first, tz=timezone.utc),
+            datetime.fromtimestamp(last, tz=timezone.utc),
+        )
+
+    def plays(self, start: int = 0) -> Iterator[Play]:
+        """
+        Yield the rows from position `start` on, in the order of iteration, in one query.
+        """
+        cursor = self.connection.execute(
+            f"""
+            SELECT tracks.played_at, artists.id, artists.mbid, artists.name,
+                   albums.id, albums.mbid, albums.name, tracks.name, tracks.mbid
+            FROM tracks
+            JOIN artists ON artists.id = tracks.artist_id
+            JOIN albums ON albums.id = tracks.album_id
+            {self._where_clause}
+            ORDER BY tracks.played_at, tracks.id
+            LIMIT -1 OFFSET ?
+            """,
+            self.params + (start,),
+        )
+        for row in cursor:
+            yield Play(
+                row[0], self._artist(*row[1:4]), self._album(*row[4:7]), *row[7:]
+            )
+
+    def daily_plays(self, start: int = 0) -> Iterator[tuple[int, Album, Artist, int]]:
+        """
+        Yield the day (since the epoch), album, artist and number of plays of
+        every album and artist played from position `start` on, in one query.
+        """
+        cursor = self.connection.execute(
+            f"""
+            SELECT plays.day, albums.id, albums.mbid, albums.name,
+                   artists.id, artists.mbid, artists.name, plays.playcount
+            FROM (
+                SELECT played_at / 86400 AS day, album_id, artist_id, COUNT(*) AS playcount
+                FROM (
+                    SELECT tracks.played_at, tracks.album_id, tracks.artist_id
+                    FROM tracks
+                    {self._where_clause}
+                    ORDER BY tracks.played_at, tracks.id
+                    LIMIT -1 OFFSET ?
+                )
+                GROUP BY day, album_id, artist_id
+            ) AS plays
+            JOIN albums ON albums.id = plays.album_id
+            JOIN artists ON artists.id = plays.artist_id
+            """,
+            self.params + (start,),
+        )
+        for day, album_id, album_mbid, album_name, *artist, playcount in cursor:
+            yield (
+                day,
+                self._album(album_id, album_mbid, album_name),
+                self._artist(*artist),
+                playcount,
+            )
+
+    def track_plays(
+        self, start: int = 0
+    ) -> Iterator[tuple[Artist, Album, str, str, int]]:
+        """
+        Yield the artist, album, name, MBID and number of plays of every track
+        played from position `start` on, in one query.
+        """
+        cursor = self.connection.execute(
+            f"""
+            SELECT artists.id, artists.mbid, artists.name,
+                   albums.id, albums.mbid, albums.name,
+                   plays.name, plays.mbid, plays.playcount
+            FROM (
+                SELECT artist_id, album_id, name, mbid, COUNT(*) AS playcount
+                FROM (
+                    SELECT tracks.artist_id, tracks.album_id, tracks.name, tracks.mbid
+                    FROM tracks
+                    {self._where_clause}
+                    ORDER BY tracks.played_at, tracks.id
+                    LIMIT -1 OFFSET ?
+                )
+                GROUP BY artist_id, album_id, name, mbid
+            ) AS plays
+            JOIN artists ON artists.id = plays.artist_id
+            JOIN albums ON albums.id = plays.album_id
+            """,
+            self.params + (start,),
+        )
+        for row in cursor:
+            yield (
+                self._artist(*row[0:3]),
+                self._album(*row[3:6]),
+                *row[6:],
+            )
+
+    def albums_by_playcount(self) -> list[tuple[Album, int]]:
+        cursor = self.connection.execute(
+            f"""
+            SELECT albums.mbid, albums.name, COUNT(*) AS playcount
+            FROM tracks JOIN albums ON albums.id = tracks.album_id
+            {self._where_clause}
+            GROUP BY tracks.album_id
+            ORDER BY playcount DESC
+            """,
+            self.params,
+        )
+        return [
+            (Album(**{"mbid": mbid, "#text": name}), playcount)
+            for mbid, name, playcount in cursor
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ingest downloaded tracks into a SQLite database."
+    )
+    parser.add_argument(
+        "--data-dir",
+        help="The directory with the downloaded tracks files",
+        required=False,
+        dest="data_dir",
+        default="data",
+    )
+    parser.add_argument(
+        "--database",
+        help="The SQLite database file. Created if it does not exist",
+        required=False,
+        dest="database",
+        default="rechord.db",
+    )
+    parser.add_argument(
+        "--log-level",
+        help="The log level",
+        required=False,
+        dest="log_level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+
+    connection = connect(args.database)
+    total = ingest(connection, args.data_dir)
+    connection.close()
+
+    logging.getLogger(__name__).info(f"Ingested {total} new tracks")
+
+
+if __name__ == "__main__":
+    main()
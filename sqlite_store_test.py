@@ -0,0 +1,64 @@
+from datetime import datetime, timezone
+
+from last_fm_model import Album
+from sqlite_store import SqliteTracks, connect, ingest
+from track_store import TrackStore
+from stats import (
+    albums_by_playcount,
+    first_and_last_listen,
+    plays as stats_plays,
+    tracks_between,
+    tracks_in_album,
+    unique_albums,
+)
+
+
+def test_ingest_stores_overlapping_pages_once(tmp_path, write_page, plays):
+    write_page(tmp_path, "tracks_0001.json", plays[:2])
+    write_page(tmp_path, "tracks_0002.json", plays[1:])
+    connection = connect(str(tmp_path / "rechord.db"))
+
+    assert ingest(connection, str(tmp_path)) == 3
+    assert ingest(connection, str(tmp_path)) == 0
+    assert len(SqliteTracks(connection)) == 3
+
+
+def test_stats_on_sqlite_tracks(tmp_path, write_page, plays):
+    write_page(tmp_path, "tracks_0001.json", plays)
+    connection = connect(str(tmp_path / "rechord.db"))
+    ingest(connection, str(tmp_path))
+    tracks = SqliteTracks(connection)
+    suede = Album(**{"mbid": "suede", "#text": "suede"})
+
+    album_tracks = tracks_in_album(tracks, suede)
+
+    assert [t.name for t in album_tracks] == ["Animal Nitrate", "So Young"]
+    assert first_and_last_listen(album_tracks) == (
+        datetime(2024, 3, 30, 7, 11, 52, tzinfo=timezone.utc),
+        datetime(2024, 3, 30, 9, 13, 20, tzinfo=timezone.utc),
+    )
+    assert {album.mbid for album in unique_albums(tracks)} == {"suede", "dog-man-star"}
+    assert albums_by_playcount(tracks)[0] == (suede, 2)
+
+    window = tracks_between(
+        tracks,
+        datetime(2024, 3, 30, 8, tzinfo=timezone.utc),
+        datetime(2024, 3, 30, 10, tzinfo=timezone.utc),
+    )
+    assert [t.name for t in window] == ["The Asphalt World", "So Young"]
+    assert [t.name for t in tracks_in_album(window, suede)] == ["So Young"]
+    assert tracks[-1].name == "So Young"
+
+
+def test_plays_from_a_position_match_across_backends(tmp_path, write_page, plays):
+    write_page(tmp_path, "tracks_0001.json", plays)
+    connection = connect(str(tmp_path / "rechord.db"))
+    ingest(connection, str(tmp_path))
+    tracks = SqliteTracks(connection)
+    loaded = list(tracks)
+
+    expected = list(stats_plays(loaded, 1))
+
+    assert [play.name for play in expected] == ["The Asphalt World", "So Young"]
+    assert list(stats_plays(tracks, 1)) == expected
+    assert list(stats_plays(TrackStore.from_tracks(loaded), 1)) == expected
@@ -1,11 +1,58 @@
-from collections.abc import Sequence
+from collections import Counter
+from collections.abc import Iterable, Iterator, Sequence
 from datetime import datetime
+from itertools import islice
+from typing import Optional, Protocol, runtime_checkable
 from last_fm_model import Album, Track
+from track_store import Play
+
+
+@runtime_checkable
+class Backend(Protocol):
+    """
+    A sequence of tracks that answers the functions of this module itself, from
+    its columns or with a query, such as TrackStore and SqliteTracks.
+    """
+
+    def plays(self, start: int = 0) -> Iterator[Play]: ...
+
+    def tracks_between(
+        self, date_from: datetime, date_to: datetime
+    ) -> Sequence[Track]: ...
+
+    def unique_albums(self) -> set[Album]: ...
+
+    def tracks_in_album(self, album: Album) -> Sequence[Track]: ...
+
+    def first_and_last_listen(self) -> tuple[datetime, datetime]: ...
+
+    def albums_by_playcount(self) -> list[tuple[Album, int]]: ...
+
+
+def plays(tracks: Sequence[Track], start: int = 0) -> Iterator[Play]:
+    """
+    Given a sequence of tracks, yield the plays from position `start` on, in order.
+
+    A Backend yields them itself, so it neither builds a Track per play nor is
+    indexed play by play.
+    """
+    if isinstance(tracks, Backend):
+        yield from tracks.plays(start)
+        return
+
+    for track in islice(tracks, start, None):
+        yield Play(
+            int(track.timestamp.time.timestamp()),
+            track.artist,
+            track.album,
+            track.name,
+            track.mbid,
+        )
 
 
 def tracks_between(
     tracks: Sequence[Track], date_from: datetime, date_to: datetime
-) -> list[Track]:
+) -> Sequence[Track]:
     """
     Given a list of tracks and two dates, return a list of tracks that were played between those dates.
 
@@ -16,7 +63,12 @@ def tracks_between(
 
     Returns:
     A list of Track objects that were played between the given dates.
+    A Backend finds them itself: a sorted TrackStore is binary searched and the
+    result is a slice of it, and SqliteTracks returns a narrower SqliteTracks.
     """
+    if isinstance(tracks, Backend):
+        return tracks.tracks_between(date_from, date_to)
+
     return [track for track in tracks if date_from <= track.timestamp.time <= date_to]
 
 
@@ -30,6 +82,9 @@ def unique_albums(tracks: Sequence[Track]) -> set[Album]:
     Returns:
     A list of unique album names.
     """
+    if isinstance(tracks, Backend):
+        return tracks.unique_albums()
+
     return set(track.album for track in tracks)
 
 
@@ -40,7 +95,7 @@ def by_time_played(track: Track) -> datetime:
     return track.timestamp.time
 
 
-def tracks_in_album(tracks: Sequence[Track], album: Album) -> list[Track]:
+def tracks_in_album(tracks: Sequence[Track], album: Album) -> Sequence[Track]:
     """
     Given a list of tracks and an album, return a list of tracks that belong to that album.
 
@@ -50,7 +105,11 @@ def tracks_in_album(tracks: Sequence[Track], album: Album) -> list[Track]:
 
     Returns:
     A list of Track objects that belong to the given album.
+    For SqliteTracks, the tracks are not loaded but returned as a narrower SqliteTracks.
     """
+    if isinstance(tracks, Backend):
+        return tracks.tracks_in_album(album)
+
     return [track for track in tracks if track.album == album]
 
 
@@ -58,6 +117,9 @@ def first_and_last_listen(tracks: Sequence[Track]) -> tuple[datetime, datetime]:
     """
     Given a sequence of tracks, return the first and last time played.
     """
+    if isinstance(tracks, Backend):
+        return tracks.first_and_last_listen()
+
     if not tracks:
         raise ValueError("No tracks provided")
 
@@ -68,3 +130,114 @@ def first_and_last_listen(tracks: Sequence[Track]) -> tuple[datetime, datetime]:
     first, last = sorted_tracks[0], sorted_tracks[-1]
 
     return (first.timestamp.time, last.timestamp.time)
+
+
+def albums_by_playcount(tracks: Sequence[Track]) -> list[tuple[Album, int]]:
+    """
+    Given a sequence of tracks, return every album with the number of times its tracks were played.
+
+    Args:
+    tracks: A list of Track objects.
+
+    Returns:
+    A list of (album, playcount) pairs, the most played album first.
+    """
+    if isinstance(tracks, Backend):
+        return tracks.albums_by_playcount()
+
+    return Counter(track.album for track in tracks).most_common()
+
+
+class Accumulator(Protocol):
+    """
+    A statistic computed in a single pass over tracks, in any order.
+    """
+
+    def add(self, track: Track): ...
+
+
+def accumulate(tracks: Iterable[Track], *accumulators: Accumulator):
+    """
+    Feed every track to every accumulator in a single pass.
+
+    With util.iter_tracks, statistics of histories larger than memory take
+    memory in proportion to their albums rather than their tracks.
+    """
+    adds = [accumulator.add for accumulator in accumulators]
+    for track in tracks:
+        for add in adds:
+            add(track)
+
+
+class UniqueAlbums:
+    """
+    The albums of the tracks, like unique_albums.
+    """
+
+    def __init__(self):
+        self.albums: set[Album] = set()
+
+    def add(self, track: Track):
+        self.albums.add(track.album)
+
+    def result(self) -> set[Album]:
+        return self.albums
+
+
+class AlbumPlaycounts:
+    """
+    The number of plays of every album, like albums_by_playcount.
+    """
+
+    def __init__(self):
+        self.playcounts: Counter[Album] = Counter()
+
+    def add(self, track: Track):
+        self.playcounts[track.album] += 1
+
+    def result(self) -> list[tuple[Album, int]]:
+        return self.playcounts.most_common()
+
+
+class FirstAndLastListen:
+    """
+    The first and last time any track was played, like first_and_last_listen,
+    and the first and last time every album was played.
+    """
+
+    def __init__(self):
+        self.first: Optional[datetime] = None
+        self.last: Optional[datetime] = None
+        self.albums: dict[Album, tuple[datetime, datetime]] = {}
+
+    def add(self, track: Track):
+        played_at = track.timestamp.time
+
+        if self.first is None or played_at < self.first:
+            self.first = played_at
+        if self.last is None or played_at > self.last:
+            self.last = played_at
+
+        album = self.albums.get(track.album)
+        if album is None:
+            self.albums[track.album] = (played_at, played_at)
+        elif played_at < album[0] or played_at > album[1]:
+            self.albums[track.album] = (
+                min(album[0], played_at),
+                max(album[1], played_at),
+            )
+
+    def result(self) -> tuple[datetime, datetime]:
+        if self.first is None or self.last is None:
+            raise ValueError("No tracks provided")
+
+        return self.first, self.last
+
+    def album(self, album: Album) -> tuple[datetime, datetime]:
+        """
+        Return the first and last time the album was played.
+        """
+        if album not in self.albums:
+            raise ValueError("No tracks provided")
+
+        return self.albums[album]
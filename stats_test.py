@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+
+from pytest import raises
+
+from stats import (
+    AlbumPlaycounts,
+    Backend,
+    FirstAndLastListen,
+    UniqueAlbums,
+    accumulate,
+    albums_by_playcount,
+    first_and_last_listen,
+    tracks_in_album,
+    unique_albums,
+)
+from track_store import TrackStore
+from util import iter_tracks, load_tracks_data
+
+
+def test_accumulators_match_the_stats_functions(tracks):
+    albums, playcounts, listens = (
+        UniqueAlbums(),
+        AlbumPlaycounts(),
+        FirstAndLastListen(),
+    )
+
+    accumulate(iter(tracks), albums, playcounts, listens)
+
+    assert albums.result() == unique_albums(tracks)
+    assert playcounts.result() == albums_by_playcount(tracks)
+    assert listens.result() == first_and_last_listen(tracks)
+    for album in unique_albums(tracks):
+        assert listens.album(album) == first_and_last_listen(
+            tracks_in_album(tracks, album)
+        )
+
+
+def test_a_track_store_answers_the_stats_functions_itself(tracks):
+    unsorted = TrackStore.from_tracks(reversed(tracks))
+    assert isinstance(unsorted, Backend)
+    assert not isinstance(tracks, Backend)
+
+    assert first_and_last_listen(unsorted) == first_and_last_listen(tracks)
+    assert dict(albums_by_playcount(unsorted)) == dict(albums_by_playcount(tracks))
+
+
+def test_first_and_last_listen_needs_tracks():
+    with raises(ValueError):
+        FirstAndLastListen().result()
+    with raises(ValueError):
+        first_and_last_listen(TrackStore())
+
+
+def test_iter_tracks_streams_the_directory(tmp_path, write_page):
+    write_page(tmp_path, "tracks_1_9_0001.json", [400, 300])
+    write_page(tmp_path, "tracks_1_9_0002.json", [200, 100])
+
+    assert sorted(iter_tracks(str(tmp_path)), key=lambda t: t.timestamp.time) == (
+        load_tracks_data(str(tmp_path), workers=1)
+    )
+    assert [
+        int(t.timestamp.time.timestamp())
+        for t in iter_tracks(
+            str(tmp_path),
+            date_from=datetime.fromtimestamp(150, tz=timezone.utc),
+            date_to=datetime.fromtimestamp(300, tz=timezone.utc),
+        )
+    ] == [300, 200]
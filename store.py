@@ -0,0 +1,236 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from last_fm_model import Album, Track
+from sqlite_store import SqliteTracks
+from stats import albums_by_playcount, plays, tracks_between
+from util import as_utc
+
+
+@dataclass
+class AlbumSummary:
+    mbid: str
+    name: str
+
+
+@dataclass
+class AlbumDetails:
+    name: str
+    mbid: str
+    first_listen: datetime
+    last_listen: datetime
+    total_playcount: int
+
+
+@dataclass
+class AlbumComparison:
+    mbid: str
+    name: str
+    playcount: int
+    previous_playcount: int
+    change: int
+
+
+@dataclass
+class AlbumStats:
+    """
+    The aggregates of one album, with the positions of its plays in the indexed
+    tracks, or None if the tracks find the plays of an album themselves.
+    """
+
+    album: Album
+    playcount: int
+    first_played: int
+    last_played: int
+    positions: Optional[array]
+
+    def summary(self) -> AlbumSummary:
+        return AlbumSummary(self.album.mbid, self.album.name)
+
+    def details(self) -> AlbumDetails:
+        return AlbumDetails(
+            name=self.album.name,
+            mbid=self.album.mbid,
+            first_listen=datetime.fromtimestamp(self.first_played, tz=timezone.utc),
+            last_listen=datetime.fromtimestamp(self.last_played, tz=timezone.utc),
+            total_playcount=self.playcount,
+        )
+
+
+def is_ranked(album: Album) -> bool:
+    """
+    Whether the album can be ranked and looked up, which needs an MBID and a name.
+    """
+    return album.mbid != "" and album.name != ""
+
+
+class Store:
+    """
+    An index of the albums in a sequence of tracks, built in one pass.
+
+    Albums without an MBID or a name are left out of the ranking and cannot be
+    looked up. If several albums share an MBID, the most played one is used.
+
+    The positions of the plays of every album are kept to look them up, except
+    on SqliteTracks, which finds them with an index of the database instead.
+    """
+
+    def __init__(self, tracks: Sequence[Track]):
+        self.tracks = tracks
+        self.keeps_positions = not isinstance(tracks, SqliteTracks)
+        self.indexed = 0
+        self._stats: dict[Album, AlbumStats] = {}
+        self.update()
+
+    def update(self):
+        """
+        Index the tracks appended since the index was built or last updated.
+
+        Only the new plays are read, but the ranking is sorted again.
+        """
+        stats = self._stats
+        for position, (played_at, _, album, _, _) in enumerate(
+            plays(self.tracks, self.indexed), self.indexed
+        ):
+            album_stats = stats.get(album)
+            if album_stats is None:
+                album_stats = stats[album] = AlbumStats(
+                    album,
+                    0,
+                    played_at,
+                    played_at,
+                    array("i") if self.keeps_positions else None,
+                )
+            album_stats.playcount += 1
+            album_stats.first_played = min(album_stats.first_played, played_at)
+            album_stats.last_played = max(album_stats.last_played, played_at)
+            if album_stats.positions is not None:
+                album_stats.positions.append(position)
+            self.indexed = position + 1
+
+        self._rank(
+            sorted(
+                (s for s in stats.values() if is_ranked(s.album)),
+                key=lambda s: s.playcount,
+                reverse=True,
+            )
+        )
+
+    def reindex(self, start: int):
+        """
+        Index the sorted tracks again from position `start` on, after the rows
+        from there were reordered, as when older tracks are sorted in.
+
+        Only the albums played from `start` on are touched. Needs the positions.
+        """
+        if not self.keeps_positions:
+            raise TypeError(
+                "Only an index with the positions of the plays can be reindexed"
+            )
+
+        for album, album_stats in list(self._stats.items()):
+            positions = album_stats.positions
+            if positions[-1] < start:
+                continue
+
+            del positions[bisect_left(positions, start) :]
+            if not positions:
+                del self._stats[album]
+                continue
+
+            album_stats.playcount = len(positions)
+            last = self.tracks[positions[-1]]
+            album_stats.last_played = int(last.timestamp.time.timestamp())
+
+        self.indexed = start
+        self.update()
+
+    def _rank(self, ranking: list[AlbumStats]):
+        """
+        Set the ranking, the most played album first, and the lookups derived from it.
+        """
+        self.ranking = ranking
+
+        self.albums: dict[str, AlbumStats] = {}
+        for album_stats in self.ranking:
+            self.albums.setdefault(album_stats.album.mbid, album_stats)
+
+        self.summaries = [album_stats.summary() for album_stats in self.ranking]
+        self.ranked_albums = [album_stats.album for album_stats in self.ranking]
+
+    def __len__(self) -> int:
+        return len(self.ranking)
+
+    def album(self, mbid: str) -> Optional[AlbumStats]:
+        return self.albums.get(mbid)
+
+    def details(self, mbid: str) -> Optional[AlbumDetails]:
+        album_stats = self.albums.get(mbid)
+        return album_stats.details() if album_stats is not None else None
+
+    def tracks_in_album(self, mbid: str) -> list[Track]:
+        """
+        Return the plays of an album in the order of the indexed tracks.
+        """
+        album_stats = self.albums.get(mbid)
+        if album_stats is None:
+            return []
+        if album_stats.positions is None:
+            # One query for the album rather than one per position
+            return list(self.tracks.tracks_in_album(album_stats.album))
+        return [self.tracks[i] for i in album_stats.positions]
+
+    def tracks_between(self, date_from: datetime, date_to: datetime) -> Sequence[Track]:
+        """
+        Return the tracks played between the dates. Times without a time zone are UTC.
+        """
+        return tracks_between(self.tracks, as_utc(date_from), as_utc(date_to))
+
+    def albums_between(
+        self, date_from: datetime, date_to: datetime
+    ) -> list[tuple[Album, int]]:
+        """
+        Rank the albums played between the dates by the number of plays in that window.
+        """
+        return [
+            (album, playcount)
+            for album, playcount in albums_by_playcount(
+                self.tracks_between(date_from, date_to)
+            )
+            if is_ranked(album)
+        ]
+
+    def compare_periods(
+        self, date_from: datetime, date_to: datetime
+    ) -> list[AlbumComparison]:
+        """
+        Compare the albums played between the dates with the period of the same length just before.
+
+        Albums are ranked by their playcount in the period, then by the previous one.
+        Times without a time zone are UTC.
+        """
+        date_from, date_to = as_utc(date_from), as_utc(date_to)
+        # Plays are timed to the second and both ends of a window are inclusive
+        previous_to = date_from - timedelta(seconds=1)
+        previous_from = previous_to - (date_to - date_from)
+        previous = dict(self.albums_between(previous_from, previous_to))
+        current = dict(self.albums_between(date_from, date_to))
+
+        comparisons = [
+            AlbumComparison(
+                mbid=album.mbid,
+                name=album.name,
+                playcount=current.get(album, 0),
+                previous_playcount=previous.get(album, 0),
+                change=current.get(album, 0) - previous.get(album, 0),
+            )
+            for album in current.keys() | previous.keys()
+        ]
+        comparisons.sort(
+            key=lambda c: (c.playcount, c.previous_playcount), reverse=True
+        )
+        return comparisons
@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+
+from sqlite_store import SqliteTracks, connect, ingest
+from store import AlbumDetails, Store
+from track_store import TrackStore
+
+
+def test_store_ranks_albums_by_playcount(tracks):
+    for indexed in (tracks, TrackStore.from_tracks(tracks)):
+        store = Store(indexed)
+
+        assert [s.mbid for s in store.summaries] == ["suede", "dog-man-star"]
+        assert store.tracks_in_album("suede") == [tracks[0], tracks[2]]
+        assert store.details("suede") == AlbumDetails(
+            name="suede",
+            mbid="suede",
+            first_listen=datetime(2024, 3, 30, 7, 11, 52, tzinfo=timezone.utc),
+            last_listen=datetime(2024, 3, 30, 9, 13, 20, tzinfo=timezone.utc),
+            total_playcount=2,
+        )
+        assert store.details("unknown") is None
+
+
+def test_store_on_sqlite_tracks(tmp_path, write_page, plays):
+    write_page(tmp_path, "tracks_0001.json", plays)
+    connection = connect(str(tmp_path / "rechord.db"))
+    ingest(connection, str(tmp_path))
+
+    store = Store(SqliteTracks(connection))
+
+    assert [s.mbid for s in store.summaries] == ["suede", "dog-man-star"]
+    assert store.details("dog-man-star").total_playcount == 1
+    assert all(s.positions is None for s in store.ranking)
+    assert [t.name for t in store.tracks_in_album("suede")] == [
+        "Animal Nitrate",
+        "So Young",
+    ]
+
+
+def test_store_compares_periods(tracks):
+    store = Store(TrackStore.from_tracks(tracks))
+    store.tracks.sort()
+
+    comparisons = store.compare_periods(
+        datetime(2024, 3, 30, 8, tzinfo=timezone.utc),
+        datetime(2024, 3, 30, 9, 30, tzinfo=timezone.utc),
+    )
+
+    assert [(c.mbid, c.playcount, c.previous_playcount) for c in comparisons] == [
+        ("suede", 1, 1),
+        ("dog-man-star", 1, 0),
+    ]
@@ -0,0 +1,375 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from collections.abc import Iterable, Iterator, Sequence
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional, overload
+
+from last_fm_model import Album, Artist, Image, Timestamp, Track
+
+# Table entries are kept as plain tuples of strings, in the order of the JSON fields.
+ArtistKey = tuple[str, str]  # (mbid, name)
+AlbumKey = tuple[str, str]  # (mbid, name)
+ImagesKey = tuple[tuple[str, str], ...]  # ((size, url), ...)
+TrackKey = tuple[str, str, str]  # (name, mbid, url)
+
+
+class Play(NamedTuple):
+    """
+    A row of a track store without the images and URL of its track, and with
+    the time it was played in seconds since the epoch.
+    """
+
+    played_at: int
+    artist: Artist
+    album: Album
+    name: str
+    mbid: str
+
+
+class TrackStore(Sequence[Track]):
+    """
+    A columnar, in-memory store of tracks.
+
+    Every play costs a timestamp and three integer IDs. Artists, albums and
+    track names are interned into tables of plain tuples that the IDs point
+    into, and the images are kept once per album. Indexing returns a Track
+    view that is built on access, so the store can be passed to the functions
+    in stats. Artist, Album and Image objects are built once, when first needed.
+    """
+
+    def __init__(self):
+        self.timestamps = array("q")
+        self.artist_ids = array("i")
+        self.album_ids = array("i")
+        self.track_ids = array("i")
+
+        self.artist_keys: list[ArtistKey] = []
+        self.album_keys: list[AlbumKey] = []
+        self.album_images: list[ImagesKey] = []
+        self.track_keys: list[TrackKey] = []
+
+        self._artist_index: dict[ArtistKey, int] = {}
+        self._album_index: dict[AlbumKey, int] = {}
+        self._track_index: dict[TrackKey, int] = {}
+
+        self._artists: dict[int, Artist] = {}
+        self._albums: dict[int, Album] = {}
+        self._images: dict[int, list[Image]] = {}
+
+        # The number of rows when they were last known to be in order of time
+        self._sorted_length = 0
+
+    @classmethod
+    def from_tracks(cls, tracks: Iterable[Track]) -> "TrackStore":
+        store = cls()
+        store.extend(tracks)
+        return store
+
+    @classmethod
+    def from_tables(
+        cls,
+        artist_keys: list[ArtistKey],
+        album_keys: list[AlbumKey],
+        album_images: list[ImagesKey],
+        track_keys: list[TrackKey],
+    ) -> "TrackStore":
+        """
+        Create an empty store with the given tables, for rows whose IDs already point into them.
+        """
+        store = cls()
+        store.artist_keys = artist_keys
+        store.album_keys = album_keys
+        store.album_images = album_images
+        store.track_keys = track_keys
+        store._artist_index = {key: i for i, key in enumerate(artist_keys)}
+        store._album_index = {key: i for i, key in enumerate(album_keys)}
+        store._track_index = {key: i for i, key in enumerate(track_keys)}
+        return store
+
+    def append(self, track: Track):
+        self.timestamps.append(int(track.timestamp.time.timestamp()))
+        self.artist_ids.append(
+            self._intern_artist((track.artist.mbid, track.artist.name))
+        )
+        self.album_ids.append(
+            self._intern_album(
+                (track.album.mbid, track.album.name),
+                tuple((image.size, image.url) for image in track.images),
+            )
+        )
+        self.track_ids.append(self._intern_track((track.name, track.mbid, track.url)))
+
+    def extend(self, tracks: Iterable[Track]):
+        for track in tracks:
+            self.append(track)
+
+    def extend_store(self, other: "TrackStore"):
+        """
+        Append the rows of another store, translating its IDs into this store's tables.
+        """
+        artist_map = [self._intern_artist(key) for key in other.artist_keys]
+        album_map = [
+            self._intern_album(key, images)
+            for key, images in zip(other.album_keys, other.album_images)
+        ]
+        track_map = [self._intern_track(key) for key in other.track_keys]
+
+        self.timestamps.extend(other.timestamps)
+        self.artist_ids.extend(artist_map[i] for i in other.artist_ids)
+        self.album_ids.extend(album_map[i] for i in other.album_ids)
+        self.track_ids.extend(track_map[i] for i in other.track_ids)
+
+    def sort(self) -> int:
+        """
+        Order the rows by the time they were played, oldest first.
+
+        Returns the position of the first row that moved, or the number of
+        rows if none did. Only the rows from there on are sorted again.
+        """
+        timestamps = self.timestamps
+
+        # Rows are only ever appended, so the rows known to be sorted need no check
+        known = max(0, self._sorted_length)
+        if all(
+            timestamps[i - 1] <= timestamps[i]
+            for i in range(max(1, known), len(timestamps))
+        ):
+            self._sorted_length = len(timestamps)
+            return len(timestamps)
+
+        # The rows after the known ones only move the known rows later than the earliest of them
+        start = bisect_right(timestamps, min(timestamps[known:]), 0, known)
+        order = sorted(range(start, len(timestamps)), key=timestamps.__getitem__)
+        self.timestamps[start:] = array("q", (timestamps[i] for i in order))
+        self.artist_ids[start:] = array("i", (self.artist_ids[i] for i in order))
+        self.album_ids[start:] = array("i", (self.album_ids[i] for i in order))
+        self.track_ids[start:] = array("i", (self.track_ids[i] for i in order))
+        self._sorted_length = len(timestamps)
+        return start
+
+    @property
+    def is_sorted(self) -> bool:
+        """
+        Whether the rows are known to be in order of time, as they are after sort().
+        """
+        return self._sorted_length == len(self.timestamps)
+
+    def _intern_artist(self, key: ArtistKey) -> int:
+        artist_id = self._artist_index.get(key)
+        if artist_id is None:
+            artist_id = len(self.artist_keys)
+            self._artist_index[key] = artist_id
+            self.artist_keys.append(key)
+        return artist_id
+
+    def _intern_album(self, key: AlbumKey, images: ImagesKey) -> int:
+        album_id = self._album_index.get(key)
+        if album_id is None:
+            album_id = len(self.album_keys)
+            self._album_index[key] = album_id
+            self.album_keys.append(key)
+            self.album_images.append(images)
+        return album_id
+
+    def _intern_track(self, key: TrackKey) -> int:
+        track_id = self._track_index.get(key)
+        if track_id is None:
+            track_id = len(self.track_keys)
+            self._track_index[key] = track_id
+            self.track_keys.append(key)
+        return track_id
+
+    def artist(self, artist_id: int) -> Artist:
+        artist = self._artists.get(artist_id)
+        if artist is None:
+            mbid, name = self.artist_keys[artist_id]
+            artist = self._artists[artist_id] = Artist(**{"mbid": mbid, "#text": name})
+        return artist
+
+    def album(self, album_id: int) -> Album:
+        album = self._albums.get(album_id)
+        if album is None:
+            mbid, name = self.album_keys[album_id]
+            album = self._albums[album_id] = Album(**{"mbid": mbid, "#text": name})
+        return album
+
+    def images(self, album_id: int) -> list[Image]:
+        images = self._images.get(album_id)
+        if images is None:
+            images = self._images[album_id] = [
+                Image(**{"size": size, "#text": url})
+                for size, url in self.album_images[album_id]
+            ]
+        return images
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @overload
+    def __getitem__(self, index: int) -> Track: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "TrackSelection": ...
+
+    def __getitem__(self, index: int | slice) -> "Track | TrackSelection":
+        if isinstance(index, slice):
+            return self._select(index)
+
+        album_id = self.album_ids[index]
+        name, mbid, url = self.track_keys[self.track_ids[index]]
+
+        return Track(
+            **{
+                "artist": self.artist(self.artist_ids[index]),
+                "mbid": mbid,
+                "album": self.album(album_id),
+                "name": name,
+                "url": url,
+                "image": self.images(album_id),
+                "date": Timestamp(uts=self.timestamps[index]),
+            }
+        )
+
+    def _select(self, index: slice) -> "TrackSelection":
+        """
+        Return a read-only store with the selected rows that shares the tables of this store.
+        """
+        selection = TrackSelection.__new__(TrackSelection)
+        selection.__dict__.update(self.__dict__)
+        selection.timestamps = self.timestamps[index]
+        selection.artist_ids = self.artist_ids[index]
+        selection.album_ids = self.album_ids[index]
+        selection.track_ids = self.track_ids[index]
+        selection._sorted_length = (
+            len(selection.timestamps)
+            if self.is_sorted and (index.step is None or index.step > 0)
+            else -1
+        )
+        return selection
+
+    def time(self, index: int) -> datetime:
+        return datetime.fromtimestamp(self.timestamps[index], tz=timezone.utc)
+
+    def album_id(self, album: Album) -> Optional[int]:
+        return self._album_index.get((album.mbid, album.name))
+
+    def unique_albums(self) -> set[Album]:
+        return {self.album(album_id) for album_id in set(self.album_ids)}
+
+    def first_and_last_listen(self) -> tuple[datetime, datetime]:
+        if not self.timestamps:
+            raise ValueError("No tracks provided")
+
+        if self.is_sorted:
+            first, last = self.timestamps[0], self.timestamps[-1]
+        else:
+            first, last = min(self.timestamps), max(self.timestamps)
+
+        return (
+            datetime.fromtimestamp(first, tz=timezone.utc),
+            datetime.fromtimestamp(last, tz=timezone.utc),
+        )
+
+    def albums_by_playcount(self) -> list[tuple[Album, int]]:
+        return [
+            (self.album(album_id), playcount)
+            for album_id, playcount in Counter(self.album_ids).most_common()
+        ]
+
+    def tracks_in_album(self, album: Album) -> list[Track]:
+        album_id = self.album_id(album)
+        if album_id is None:
+            return []
+
+        return [self[i] for i, a in enumerate(self.album_ids) if a == album_id]
+
+    def plays(self, start: int = 0) -> Iterator[Play]:
+        """
+        Yield the rows from position `start` on, read from the columns.
+        """
+        track_keys = self.track_keys
+        for played_at, artist_id, album_id, track_id in zip(
+            self.timestamps[start:],
+            self.artist_ids[start:],
+            self.album_ids[start:],
+            self.track_ids[start:],
+        ):
+            name, mbid, _ = track_keys[track_id]
+            yield Play(
+                played_at, self.artist(artist_id), self.album(album_id), name, mbid
+            )
+
+    def daily_plays(self, start: int = 0) -> Iterator[tuple[int, Album, Artist, int]]:
+        """
+        Yield the day (since the epoch), album, artist and number of plays of
+        every album and artist played from position `start` on, read from the columns.
+        """
+        plays = Counter(
+            zip(
+                [t // 86400 for t in self.timestamps[start:]],
+                self.album_ids[start:],
+                self.artist_ids[start:],
+            )
+        )
+        for (day, album_id, artist_id), playcount in plays.items():
+            yield day, self.album(album_id), self.artist(artist_id), playcount
+
+    def track_plays(
+        self, start: int = 0
+    ) -> Iterator[tuple[Artist, Album, str, str, int]]:
+        """
+        Yield the artist, album, name, MBID and number of plays of every track
+        played from position `start` on, read from the columns.
+        """
+        plays = Counter(
+            zip(
+                self.artist_ids[start:],
+                self.album_ids[start:],
+                self.track_ids[start:],
+            )
+        )
+        for (artist_id, album_id, track_id), playcount in plays.items():
+            name, mbid, _ = self.track_keys[track_id]
+            yield self.artist(artist_id), self.album(album_id), name, mbid, playcount
+
+    def bounds_between(self, date_from: datetime, date_to: datetime) -> tuple[int, int]:
+        """
+        Return the range of rows played between the dates, found by binary search.
+
+        The rows must be sorted.
+        """
+        return (
+            bisect_left(self.timestamps, date_from.timestamp()),
+            bisect_right(self.timestamps, date_to.timestamp()),
+        )
+
+    def tracks_between(
+        self, date_from: datetime, date_to: datetime
+    ) -> "TrackStore | list[Track]":
+        """
+        Return the tracks played between the dates.
+
+        A sorted store is searched in O(log N) and the result is a slice of it.
+        An unsorted store is scanned.
+        """
+        if self.is_sorted:
+            start, end = self.bounds_between(date_from, date_to)
+            return self[start:end]
+
+        start, end = date_from.timestamp(), date_to.timestamp()
+        return [self[i] for i, t in enumerate(self.timestamps) if start <= t <= end]
+
+
+class TrackSelection(TrackStore):
+    """
+    A slice of a TrackStore. It has its own rows but shares the tables, indexes
+    and caches of the store it was taken from, so it is read-only: appending
+    to it would intern new entries into the tables of that store.
+    """
+
+    def append(self, track: Track):
+        raise TypeError("A slice of a track store is read-only")
+
+    def extend_store(self, other: TrackStore):
+        raise TypeError("A slice of a track store is read-only")
@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+
+from pytest import raises
+
+from last_fm_model import Album
+from stats import tracks_between, tracks_in_album, unique_albums
+from track_store import TrackStore
+
+
+def test_track_store_views_equal_the_stored_tracks(tracks):
+    store = TrackStore.from_tracks(tracks)
+
+    assert len(store) == 3
+    assert list(store) == tracks
+    assert len(store.album_keys) == 2
+    assert len(store.artist_keys) == 1
+
+
+def test_track_store_slices_share_tables_and_are_read_only(tracks, make_track):
+    store = TrackStore.from_tracks(tracks)
+
+    selection = store[1:]
+
+    assert isinstance(selection, TrackStore)
+    assert list(selection) == tracks[1:]
+    assert list(selection[1:]) == tracks[2:]
+    assert selection.album_keys is store.album_keys
+
+    with raises(TypeError):
+        selection.append(make_track(("coming-up", "Trash", 1711800000)))
+    with raises(TypeError):
+        selection.extend_store(TrackStore.from_tracks(tracks))
+    assert len(store.album_keys) == 2
+
+
+def test_stats_on_a_track_store(tracks):
+    store = TrackStore.from_tracks(tracks)
+    suede = Album(**{"mbid": "suede", "#text": "suede"})
+
+    assert unique_albums(store) == unique_albums(tracks)
+    assert tracks_in_album(store, suede) == [tracks[0], tracks[2]]
+    assert (
+        tracks_between(
+            store,
+            datetime(2024, 3, 30, 8, tzinfo=timezone.utc),
+            datetime(2024, 3, 30, 10, tzinfo=timezone.utc),
+        )
+        == tracks[1:]
+    )
+
+
+def test_sorted_track_store_is_searched_by_time(tracks):
+    store = TrackStore.from_tracks(reversed(tracks))
+    store.sort()
+
+    window = store.tracks_between(
+        datetime(2024, 3, 30, 8, tzinfo=timezone.utc),
+        datetime.fromtimestamp(1711790000, tz=timezone.utc),
+    )
+
+    assert isinstance(window, TrackStore)
+    assert window.is_sorted
+    assert list(window) == tracks[1:]
+    assert not store[::-1].is_sorted
+
+
+def test_sorting_appended_rows_only_moves_the_later_ones(tracks):
+    store = TrackStore.from_tracks(tracks[:1] + tracks[2:])
+    assert store.sort() == 2
+
+    store.append(tracks[1])
+
+    assert store.sort() == 1
+    assert list(store) == tracks
+    assert store.sort() == 3
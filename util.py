@@ -1,8 +1,16 @@
 import os
-import json
-from datetime import date, timedelta
-from typing import Generator
-from last_fm_model import Track, GetRecentTracksOutput
+import math
+import multiprocessing
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from collections.abc import Callable, Iterator
+from typing import Generator, Optional
+from catalogue import files_between
+from last_fm_model import Track, RECENT_TRACKS_ADAPTER
+from segments import read_segment, segment_format
+from track_store import TrackStore
 
 
 def date_intervals(
@@ -28,6 +36,11 @@ def days_between(from_date: date, to_date: date) -> Generator[date, None, None]:
         from_date += timedelta(days=1)
 
 
+def as_utc(time: datetime) -> datetime:
+    """Return the time, read as UTC if it has no time zone, as all plays are."""
+    return time if time.tzinfo is not None else time.replace(tzinfo=timezone.utc)
+
+
 def get_renv(name: str) -> str:
     """Return the value of an environment variable. Throw an exception if it is not set."""
     value = os.getenv(name)
@@ -36,17 +49,232 @@ def get_renv(name: str) -> str:
     return value
 
 
-def load_tracks_data(dir: str) -> list[Track]:
-    tracks = []
+def tracks_files(dir: str) -> list[str]:
+    """
+    Return the paths of the page files and NDJSON segments in the directory, by name.
 
-    for tracks_file in [
+    Compacted segments are numbered in time order, so they load already sorted.
+    """
+    return [
         os.path.join(dir, file)
-        for file in os.listdir(dir)
-        if file.startswith("tracks_") and file.endswith(".json")
-    ]:
-        with open(tracks_file, "r") as f:
-            data = json.load(f)
-            recent_tracks_output = GetRecentTracksOutput(**data)
-            tracks.extend(recent_tracks_output.recent_tracks.tracks)
-
-    return tracks
+        for file in sorted(os.listdir(dir))
+        if file.startswith("tracks_")
+        and (file.endswith(".json") or segment_format(file) is not None)
+    ]
+
+
+def file_key(path: str) -> tuple[int, int]:
+    """
+    Return the modification time and size of a file, which change whenever it is rewritten.
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_tracks_file(tracks_file: str) -> list[Track]:
+    if segment_format(tracks_file) is not None:
+        return list(read_segment(tracks_file))
+
+    with open(tracks_file, "rb") as f:
+        recent_tracks_output = RECENT_TRACKS_ADAPTER.validate_json(f.read())
+        return recent_tracks_output.recent_tracks.tracks
+
+
+def iter_tracks_files(files: list[str]) -> Iterator[Track]:
+    """
+    Yield the tracks of the files one at a time, in file order.
+
+    Only one page is held in memory at a time, and segments are streamed line by line.
+    """
+    for tracks_file in files:
+        if segment_format(tracks_file) is not None:
+            yield from read_segment(tracks_file)
+        else:
+            yield from load_tracks_file(tracks_file)
+
+
+def iter_tracks(
+    dir: str,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> Iterator[Track]:
+    """
+    Yield the tracks in the directory one at a time, in file order rather than
+    time order, so memory does not grow with the history.
+
+    With `date_from` or `date_to`, only the tracks played between them are
+    yielded, and in a catalogued directory only the segments that overlap the
+    range are opened, along with any file it does not list.
+    """
+    if date_from is None and date_to is None:
+        yield from iter_tracks_files(tracks_files(dir))
+        return
+
+    files = files_between(dir, tracks_files(dir), date_from, date_to)
+
+    for track in iter_tracks_files(files):
+        played_at = track.timestamp.time
+        if (date_from is None or played_at >= date_from) and (
+            date_to is None or played_at <= date_to
+        ):
+            yield track
+
+
+def load_tracks_chunk(
+    files: list[str],
+) -> tuple[TrackStore, list[tuple[str, int]], dict[str, float]]:
+    """
+    Load the files into a TrackStore, in order.
+
+    Returns the store, the number of rows of every file and the parse time of
+    every file in seconds. Runs in the worker processes of load_track_files. A
+    TrackStore is returned rather than a list of tracks, because it is many
+    times cheaper to pickle.
+    """
+    store = TrackStore()
+    rows = []
+    timings = {}
+
+    for tracks_file in files:
+        start = time.perf_counter()
+        tracks = load_tracks_file(tracks_file)
+        store.extend(tracks)
+        rows.append((tracks_file, len(tracks)))
+        timings[tracks_file] = time.perf_counter() - start
+
+    return store, rows, timings
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Return a pool of `workers` processes started from a fork server.
+
+    Forking the calling process could copy locks held by its other threads, such
+    as those of a running server, so the workers are forked from a clean one.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("forkserver")
+    )
+
+
+def load_track_files(
+    files: list[str],
+    workers: Optional[int] = None,
+    timings: Optional[dict[str, float]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> tuple[TrackStore, list[tuple[str, int, int]]]:
+    """
+    Load the files into a TrackStore, in file order.
+
+    Files are parsed in chunks across a pool of `workers` processes (one per core
+    by default). Returns the store and the range of rows (start, end) of every file.
+    The parse time of every file is logged at debug level and, if given, stored in `timings`.
+    If given, `progress` is called with the numbers of files and tracks loaded
+    so far after every chunk.
+    """
+    logger = logging.getLogger(__name__)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    chunk_size = max(1, math.ceil(len(files) / (workers * 4)))
+    chunks = [files[i : i + chunk_size] for i in range(0, len(files), chunk_size)]
+
+    store = TrackStore()
+    ranges = []
+
+    def merge(chunk_store: TrackStore, rows: list[tuple[str, int]], chunk_timings):
+        start = len(store)
+        store.extend_store(chunk_store)
+
+        for tracks_file, count in rows:
+            ranges.append((tracks_file, start, start + count))
+            start += count
+
+        report_timings(logger, chunk_timings, timings)
+        if progress is not None:
+            progress(len(ranges), len(store))
+
+    if workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            merge(*load_tracks_chunk(chunk))
+    else:
+        with process_pool(workers) as executor:
+            for result in executor.map(load_tracks_chunk, chunks):
+                merge(*result)
+
+    return store, ranges
+
+
+def load_track_store(
+    dir: str,
+    workers: Optional[int] = None,
+    timings: Optional[dict[str, float]] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> TrackStore:
+    """
+    Load the tracks in the directory into a TrackStore, ordered by the time they
+    were played. See load_track_files.
+
+    With `date_from` or `date_to`, only the tracks played between them are
+    returned. In a directory with a catalogue, written by compact.py, only the
+    segments that overlap the range are opened, so loading takes time in
+    proportion to the range rather than to the whole history. Files added
+    since the catalogue was written are always opened and trimmed.
+    """
+    logger = logging.getLogger(__name__)
+
+    start = time.perf_counter()
+    files = tracks_files(dir)
+    if date_from is not None or date_to is not None:
+        files = files_between(dir, files, date_from, date_to)
+
+    store, _ = load_track_files(
+        files, workers=workers, timings=timings, progress=progress
+    )
+    store.sort()
+
+    if date_from is not None or date_to is not None:
+        first, last = store.bounds_between(
+            date_from or datetime.fromtimestamp(0, tz=timezone.utc),
+            date_to or datetime.max.replace(tzinfo=timezone.utc),
+        )
+        store = store[first:last]
+
+    logger.info(
+        f"Loaded {len(store)} tracks from {len(files)} files in {time.perf_counter() - start:.2f} seconds"
+    )
+
+    return store
+
+
+def report_timings(
+    logger: logging.Logger,
+    chunk_timings: dict[str, float],
+    timings: Optional[dict[str, float]],
+):
+    for tracks_file, seconds in chunk_timings.items():
+        logger.debug(f"Parsed {tracks_file} in {seconds * 1000:.1f} ms")
+
+    if timings is not None:
+        timings.update(chunk_timings)
+
+
+def load_tracks_data(
+    dir: str,
+    workers: Optional[int] = None,
+    timings: Optional[dict[str, float]] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> list[Track]:
+    """
+    Load the tracks of every page file and every NDJSON segment in the directory,
+    ordered by the time they were played. See load_track_store.
+    """
+    return list(
+        load_track_store(
+            dir, workers=workers, timings=timings, date_from=date_from, date_to=date_to
+        )
+    )
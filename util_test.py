@@ -1,5 +1,5 @@
-from util import date_intervals
-from datetime import date, timedelta
+from util import date_intervals, load_tracks_data
+from datetime import date, datetime, timedelta, timezone
 from last_fm_model import Method
 from last_fm_client import sign
 
@@ -30,3 +30,25 @@ def test_sign():
     }
 
     assert sign(params, secret) == "185a53fa45fb3bc0b13b757c231a0eac"
+
+
+def test_load_tracks_data_orders_tracks_by_time(tmp_path, write_page):
+    write_page(tmp_path, "tracks_0001.json", [1711782712, 1711782000])
+    write_page(tmp_path, "tracks_0002.json", [1711782500, 1711781000])
+    timings = {}
+
+    tracks = load_tracks_data(str(tmp_path), workers=2, timings=timings)
+
+    assert [int(t.timestamp.time.timestamp()) for t in tracks] == [
+        1711781000,
+        1711782000,
+        1711782500,
+        1711782712,
+    ]
+    assert tracks[-1].timestamp.time == datetime(
+        2024, 3, 30, 7, 11, 52, tzinfo=timezone.utc
+    )
+    assert sorted(timings) == [
+        str(tmp_path / "tracks_0001.json"),
+        str(tmp_path / "tracks_0002.json"),
+    ]